@@ -0,0 +1,342 @@
+#!/usr/bin/python
+
+# Benchmarks for kvrg-avg
+#
+# Builds synthetic config directories with a number of trackers and entries
+# per tracker, runs avg commands against them as separate processes (the same
+# way they're used from a shell) and prints the results as JSON.
+#
+# Examples:
+#   python bench.py
+#   python bench.py --trackers 1,100,10000 --entries 10,100000,10000000
+#   python bench.py --format binary --output bench_output.txt
+#   python bench.py --serve
+#   python bench.py --check --pushers 64
+#
+# With --check, nothing is timed: every scenario only runs the concurrent push
+# and checks that no value was lost and that the count and average match the
+# ones rebuilt from the tracker file, exiting with status 1 if they don't.
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+import concurrent.futures
+
+# Default location of the avg script: main.py next to this file
+default_avg = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Benchmark every avg command across tracker sizes.")
+
+    parser.add_argument("--avg", default=default_avg, help="path to the avg script (default: main.py)")
+    parser.add_argument("--trackers", default="1,100", help="comma-separated numbers of trackers (default: 1,100)")
+    parser.add_argument("--entries", default="10,10000", help="comma-separated numbers of entries per tracker (default: 10,10000)")
+    parser.add_argument("--types", default="normal,date", help="tracker types to benchmark (default: normal,date)")
+    parser.add_argument("--format", default="text", choices=["text", "binary"], help="tracker storage format (default: text)")
+    parser.add_argument("--serve", action="store_true", help="run the commands through 'avg serve'")
+    parser.add_argument("--repeat", type=int, default=20, help="how many times each command is timed (default: 20)")
+    parser.add_argument("--batch", type=int, default=1000, help="values per batched push (default: 1000)")
+    parser.add_argument("--pushers", type=int, default=16, help="parallel processes for the concurrent push (default: 16)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="parallel processes used to build the trackers")
+    parser.add_argument("--output", help="write the JSON results to this file instead of stdout")
+    parser.add_argument("--check", action="store_true", help="only check that concurrent pushes lose nothing, and exit with status 1 if they do")
+
+    return parser.parse_args()
+
+# Synthetic data
+
+# Returns n entries for a tracker of the given type, one per line
+def make_entries(tracker_type, n, seed=0):
+    generator = random.Random(seed)
+
+    if tracker_type == "normal":
+        return "".join(f"{round(generator.uniform(0, 100), 2)}\n" for index in range(n))
+
+    # Dates a few minutes to a few hours apart, starting in 2000
+    epoch = 946684800
+    lines = []
+
+    for index in range(n):
+        epoch += generator.randint(1, 180) * 60
+        lines.append(time.strftime("%Y/%m/%d/%H/%M", time.gmtime(epoch)) + "\n")
+
+    return "".join(lines)
+
+# Runs avg with $HOME set to home, and returns its duration in seconds, exit
+# status and peak RSS in kilobytes
+def run_avg(settings, home, arguments, stdin_path=None):
+    environment = dict(os.environ, HOME=home)
+    stdin = open(stdin_path, "rb") if stdin_path else subprocess.DEVNULL
+
+    try:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            [sys.executable, settings.avg] + arguments,
+            env=environment,
+            stdin=stdin,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+
+        # wait4 returns the resource usage of this process alone
+        pid, status, usage = os.wait4(process.pid, 0)
+        duration = time.perf_counter() - start
+
+    finally:
+        if stdin_path:
+            stdin.close()
+
+    # Lets Popen know the process is gone
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    rss = usage.ru_maxrss if sys.platform != "darwin" else usage.ru_maxrss // 1024
+
+    return duration, process.returncode, rss
+
+# Creates a config directory with the given trackers, and returns $HOME
+def build_home(settings, tracker_type, trackers, entries):
+    home = tempfile.mkdtemp(prefix="avg-bench-")
+    os.makedirs(f"{home}/.config")
+
+    entries_path = f"{home}/entries"
+    with open(entries_path, "w") as entries_file:
+        entries_file.write(make_entries(tracker_type, entries))
+
+    def build_tracker(index):
+        name = f"tracker{index}"
+
+        create = ["create", name, "date"] if tracker_type == "date" else ["create", name]
+        run_avg(settings, home, create)
+        run_avg(settings, home, ["push", name, "-"], entries_path)
+
+        if settings.format == "binary":
+            run_avg(settings, home, ["convert", name, "--to", "binary"])
+
+    # The first tracker also creates config/avg
+    build_tracker(0)
+
+    with concurrent.futures.ThreadPoolExecutor(settings.jobs) as pool:
+        list(pool.map(build_tracker, range(1, trackers)))
+
+    return home
+
+# Statistics
+
+def percentile(samples, quantile):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+# Times the same command settings.repeat times
+# items is how many things one run handles (values pushed, trackers listed),
+#   used for the throughput
+def measure(settings, home, arguments, items=1, stdin_path=None):
+    durations = []
+    peak_rss = 0
+    failures = 0
+
+    for run in range(settings.repeat):
+        duration, status, rss = run_avg(settings, home, arguments, stdin_path)
+
+        durations.append(duration)
+        peak_rss = max(peak_rss, rss)
+        failures += status != 0
+
+    return {
+        "runs": len(durations),
+        "failures": failures,
+        "mean_ms": sum(durations) / len(durations) * 1000,
+        "p50_ms": percentile(durations, 0.5) * 1000,
+        "p90_ms": percentile(durations, 0.9) * 1000,
+        "p99_ms": percentile(durations, 0.99) * 1000,
+        "throughput_per_second": items * len(durations) / sum(durations),
+        "peak_rss_kb": peak_rss
+    }
+
+# Reads an attribute of a tracker with "avg get"
+def read_attribute(settings, home, attribute, name):
+    output = subprocess.run(
+        [sys.executable, settings.avg, "get", attribute, name],
+        env=dict(os.environ, HOME=home),
+        capture_output=True,
+        text=True
+    )
+
+    return output.stdout.strip()
+
+def read_count(settings, home, name):
+    return int(read_attribute(settings, home, "count", name))
+
+# Runs settings.pushers pushes of settings.batch values to one tracker at the
+# same time, and checks that none of the values were lost
+def measure_concurrent_push(settings, home, batch_path):
+    before = read_count(settings, home, "tracker0")
+
+    start = time.perf_counter()
+
+    with concurrent.futures.ThreadPoolExecutor(settings.pushers) as pool:
+        results = list(pool.map(
+            lambda pusher: run_avg(settings, home, ["push", "tracker0", "-"], batch_path),
+            range(settings.pushers)
+        ))
+
+    duration = time.perf_counter() - start
+    pushed = settings.pushers * settings.batch
+
+    return {
+        "pushers": settings.pushers,
+        "values": pushed,
+        "seconds": duration,
+        "throughput_per_second": pushed / duration,
+        "failures": sum(status != 0 for duration, status, rss in results),
+        "lost_values": pushed - (read_count(settings, home, "tracker0") - before),
+        "peak_rss_kb": max(rss for duration, status, rss in results)
+    }
+
+# Runs the concurrent push against one config directory, and returns the
+# problems it found
+# The count and average that the pushes left are compared with the ones
+#   "avg rebuild" computes from the entries, which catches a push that
+#   overwrote another one's state.
+def check_scenario(settings, home, batch_path):
+    results = measure_concurrent_push(settings, home, batch_path)
+    problems = []
+
+    if results["failures"]:
+        problems.append(f"{results['failures']} pushes failed")
+
+    if results["lost_values"]:
+        problems.append(f"{results['lost_values']} values were lost")
+
+    count = read_attribute(settings, home, "count", "tracker0")
+    average = read_attribute(settings, home, "average", "tracker0")
+
+    run_avg(settings, home, ["rebuild", "tracker0"])
+
+    for attribute, value in [("count", count), ("average", average)]:
+        rebuilt = read_attribute(settings, home, attribute, "tracker0")
+
+        if rebuilt != value:
+            problems.append(f"the {attribute} was {value}, but {rebuilt} after rebuilding")
+
+    return problems
+
+# Runs every benchmark against one config directory
+def run_scenario(settings, tracker_type, trackers, entries):
+    build_start = time.perf_counter()
+    home = build_home(settings, tracker_type, trackers, entries)
+    build_seconds = time.perf_counter() - build_start
+
+    daemon = None
+
+    try:
+        if settings.serve:
+            daemon = subprocess.Popen(
+                [sys.executable, settings.avg, "serve"],
+                env=dict(os.environ, HOME=home),
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+
+            while not os.path.exists(f"{home}/.config/avg/socket"):
+                time.sleep(0.01)
+
+        # Dates are pushed as "now", so that they're after every entry and
+        #   appended (see push_backfill for earlier dates)
+        batch_path = f"{home}/batch"
+        with open(batch_path, "w") as batch_file:
+            if tracker_type == "date":
+                batch_file.write("now\n" * settings.batch)
+            else:
+                batch_file.write(make_entries(tracker_type, settings.batch, seed=1))
+
+        single_value = "now" if tracker_type == "date" else "42"
+
+        if settings.check:
+            return check_scenario(settings, home, batch_path)
+
+        results = {
+            "push": measure(settings, home, ["push", "tracker0", single_value]),
+            "push_batch": measure(settings, home, ["push", "tracker0", "-"], settings.batch, batch_path),
+            "push_concurrent": measure_concurrent_push(settings, home, batch_path),
+            "ingest": measure(settings, home, ["ingest", "tracker0", "--follow", "-"], settings.batch, batch_path),
+            "list": measure(settings, home, ["list"], trackers),
+            "get": measure(settings, home, ["get", "average", "tracker0"]),
+            "info": measure(settings, home, ["info", "tracker0"])
+        }
+
+        # A date from before the last 100 entries the tracker was built with,
+        #   which push merges into the entries after it
+        if tracker_type == "date":
+            with open(f"{home}/entries") as entries_file:
+                lines = entries_file.read().split()
+
+            results["push_backfill"] = measure(settings, home, ["push", "tracker0", lines[max(len(lines) - 100, 0)]])
+
+        # avg list showing the ETA of date trackers
+        with open(f"{home}/.config/avg/config", "w") as config_file:
+            config_file.write("ETA\n")
+
+        results["list_ETA"] = measure(settings, home, ["list"], trackers)
+
+    finally:
+        if daemon is not None:
+            daemon.terminate()
+            daemon.wait()
+
+        shutil.rmtree(home)
+
+    return {
+        "type": tracker_type,
+        "trackers": trackers,
+        "entries": entries,
+        "format": settings.format,
+        "serve": settings.serve,
+        "build_seconds": build_seconds,
+        "results": results
+    }
+
+def main():
+    settings = parse_arguments()
+
+    scenarios = []
+    failed = False
+
+    for tracker_type in settings.types.split(","):
+        for trackers in [int(number) for number in settings.trackers.split(",")]:
+            for entries in [int(number) for number in settings.entries.split(",")]:
+                if settings.check:
+                    print(f"Checking {settings.pushers} concurrent pushes to {tracker_type} trackers with {entries} entries...", file=sys.stderr)
+
+                    for problem in run_scenario(settings, tracker_type, trackers, entries):
+                        print(f"  {problem}", file=sys.stderr)
+                        failed = True
+
+                    continue
+
+                print(f"Benchmarking {trackers} {tracker_type} trackers with {entries} entries...", file=sys.stderr)
+                scenarios.append(run_scenario(settings, tracker_type, trackers, entries))
+
+    if settings.check:
+        sys.exit(1 if failed else 0)
+
+    output = json.dumps({
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "scenarios": scenarios
+    }, indent=4)
+
+    if settings.output:
+        with open(settings.output, "w") as output_file:
+            output_file.write(output + "\n")
+    else:
+        print(output)
+
+if __name__ == "__main__":
+    main()
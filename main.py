@@ -1,599 +1,5444 @@
 #!/usr/bin/python
 
+import time
+
+# Used by "avg --timing" and "avg --profile", see "Profiling"
+start_time = time.perf_counter()
+
 import os
 import sys
-import subprocess
-import datetime
 import math
+import struct
+import array
+import mmap
+import fcntl
+import operator
+import itertools
+
+# Most commands only need a few modules, and importing the rest would take
+# longer than running the command itself. Those modules (json, datetime,
+# socket, ...) are imported by the functions that use them instead.
+
+# NumPy is optional; it makes rebuilding states and the date interval
+# statistics faster. It's imported the first time it's needed, because
+# importing it takes much longer than most commands.
+numpy = None
+numpy_imported = False
+
+# Smaller batches (e.g. a single push) are handled without NumPy, so that they
+# don't pay for importing it
+NUMPY_MINIMUM = 1000
+
+# Returns the numpy module, or None if it isn't installed
+def import_numpy():
+    global numpy, numpy_imported
+
+    if not numpy_imported:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+
+        numpy_imported = True
+
+    return numpy
+
+# Profiling
+# "avg --timing" and "avg --profile" (see main) time the phases of a command:
+# the ones of main ("imports", "config", "daemon", "command") and the ones
+# commands mark themselves (e.g. "push: lock"). A phase is the time since the
+# previous one ended; a phase that happens more than once (e.g. every batch of
+# "avg ingest") adds up. "--profile" also keeps counters (e.g. "lines_parsed").
+# Both are off unless main turns them on, so a Store used from Python doesn't
+# keep anything.
+
+# The total seconds of every phase, in the order they first ended, or None
+# when nothing is timed
+timings = None
+phase_start = start_time
+
+# The counters of "--profile", or None when nothing is counted
+counters = None
+
+# Records that a phase ended now
+def end_phase(phase):
+    global phase_start
+
+    if timings is None:
+        return
+
+    now = time.perf_counter()
+    timings[phase] = timings.get(phase, 0) + now - phase_start
+    phase_start = now
+
+# Adds number to a counter
+def add_count(counter, number=1):
+    if counters is not None:
+        counters[counter] = counters.get(counter, 0) + number
+
+# The average (second line of a tracker file) is padded with spaces to this
+# width, so that push can overwrite it in place instead of rewriting the whole
+# file. Every reader already uses .strip(), which removes the padding.
+AVERAGE_WIDTH = 32
+
+# Running aggregates
+# Every tracker has a state file in config/avg/state with the same name. It
+# stores the number of entries and their sum (normal trackers), or the number
+# of entries and the first and last timestamps (date trackers). The average
+# interval of a date tracker is (last - first) / (count - 1), because the
+# intervals between adjacent entries add up to last - first.
+# This lets push update the average without reading the entries again.
+# The state also holds streaming statistics (see "Streaming statistics").
+# Date trackers in milliseconds also have a "unit" of 1000 (see "Dates").
+# States written by older versions (with a different "version") are rebuilt.
+
+STATE_VERSION = 2
+
+def new_state(mode=None, unit=1):
+    state = {
+        "version": STATE_VERSION,
+        "count": 0,
+        "sum": 0,
+        "first": None,
+        "last": None,
+        "samples": 0,
+        "mean": 0,
+        "m2": 0,
+        "min": None,
+        "max": None,
+        "sketch": new_sketch(),
+        "mode": mode,
+        "window": [],
+        "window_position": 0,
+        "ewma": None
+    }
+
+    if unit != 1:
+        state["unit"] = unit
+
+    return state
+
+# The number of units per second of the dates and intervals of a state: 1, or
+# 1000 for date trackers in milliseconds
+def state_unit(state):
+    return state.get("unit", 1)
+
+# Dates
+# Date trackers store their entries as whole seconds since the epoch (in
+# binary trackers, avg.db and states), or as "YYYY/MM/DD/HH/MM" lines in text
+# trackers, with "/SS" after them if the seconds aren't 0. Every date is local
+# time treated as UTC, so that differences are the same as subtracting two
+# naive datetime objects. A pushed date can be:
+# - "YYYY/MM/DD/HH/MM", or "YYYY/MM/DD/HH/MM/SS" with an optional fraction
+#   ("/SS.mmm"), which is rounded down to the second (with a note, see
+#   warn_dropped_fractions)
+# - "@" followed by a Unix timestamp (e.g. "@1760000000.123"), converted to
+#   local time the same way
+# - "now", the current second
+# Trackers created with "--milliseconds" store milliseconds since the epoch
+# instead: their unit (see state_unit) is 1000, the functions below take it as
+# unit, and their lines have a ".mmm" fraction if it isn't 0. Their intervals
+# are still printed in seconds, with 3 decimals (see round_seconds).
+
+# The number of units per second of date trackers created with "--milliseconds"
+MILLISECONDS = 1000
+
+# Days in every month of a year that isn't a leap year
+MONTH_DAYS = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# Converts a "YYYY/MM/DD/HH/MM" or "YYYY/MM/DD/HH/MM/SS" line to seconds since
+# the epoch (or units, with the ".mmm" fraction)
+# The number of days since 1970 is computed with the days_from_civil
+#   algorithm (http://howardhinnant.github.io/date_algorithms.html), like
+#   dates_to_epochs does, which is faster than importing calendar
+def date_to_epoch(argument, unit=1):
+    year = int(argument[0:4])
+    month = int(argument[5:7])
+    day = int(argument[8:10])
+
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month + (-3 if month > 2 else 9)) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    days = era * 146097 + day_of_era - 719468
+
+    seconds = int(argument[17:19]) if len(argument) > 16 else 0
+    epoch = days * 86400 + int(argument[11:13]) * 3600 + int(argument[14:16]) * 60 + seconds
+
+    if unit == 1:
+        return epoch
+
+    return epoch * unit + fraction_to_units(argument[20:], unit)
+
+# Converts the digits after the "." of a date to units, rounded down (always 0
+# for whole seconds)
+def fraction_to_units(digits, unit):
+    return int(digits[:3].ljust(3, "0")) * unit // 1000
+
+# The first and last second that a "YYYY/MM/DD/HH/MM/SS" line can hold
+EARLIEST_DATE = date_to_epoch("0001/01/01/00/00/00")
+LATEST_DATE = date_to_epoch("9999/12/31/23/59/59")
+
+# Converts any date that can be pushed (see "Dates") to seconds since the
+# epoch (or units), or returns None if it isn't a valid date
+# Checking and converting is done in one pass over the string, without
+# building a datetime.
+def parse_date(argument, unit=1):
+    if argument == "now":
+        return local_time(unit)
+
+    if not isinstance(argument, str):
+        return None
+
+    if argument[:1] == "@":
+        try:
+            return timestamp_to_local(float(argument[1:]), unit)
+
+        except (ValueError, OverflowError, OSError):
+            return None
+
+    # Everything but the slashes (and the fraction of the seconds) is a digit
+    if len(argument) == 16:
+        digits = argument[0:4] + argument[5:7] + argument[8:10] + argument[11:13] + argument[14:16]
+        slashes = argument[4:14:3]
+
+    elif len(argument) >= 19 and (len(argument) == 19 or argument[19] == "." and argument[20:].isdigit()):
+        digits = argument[0:4] + argument[5:7] + argument[8:10] + argument[11:13] + argument[14:16] + argument[17:19]
+        slashes = argument[4:17:3]
+
+    else:
+        return None
+
+    if slashes.strip("/") or not (digits.isascii() and digits.isdigit()):
+        return None
+
+    year = int(digits[0:4])
+    month = int(digits[4:6])
+    day = int(digits[6:8])
+
+    if not 1 <= month <= 12 or year == 0:
+        return None
+
+    leap = year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+
+    if not 1 <= day <= MONTH_DAYS[month - 1] + (month == 2 and leap):
+        return None
+
+    if int(digits[8:10]) > 23 or int(digits[10:12]) > 59 or int(digits[12:14] or 0) > 59:
+        return None
+
+    return date_to_epoch(argument, unit)
+
+# Converts a Unix timestamp (in seconds) to local time in units since the
+# epoch, like the dates of "now", or returns None if its year isn't between 1
+# and 9999, since it couldn't be written back as a date
+# Raises ValueError or OverflowError if it isn't a finite number.
+def timestamp_to_local(moment, unit=1):
+    seconds = math.floor(moment)
+    local = seconds + time.localtime(seconds).tm_gmtoff
+
+    if not EARLIEST_DATE <= local <= LATEST_DATE:
+        return None
+
+    if unit == 1:
+        return local
+
+    # A float is a little off from the decimal digits it was written with
+    #   (1760000000.123 is 1760000000.1229999), so the fraction is rounded
+    #   down with some leeway
+    return local * unit + min(math.floor((moment - seconds) * unit + 0.001), unit - 1)
+
+# Adds one value (a float, or seconds since the epoch for date trackers) to
+# a state
+def add_value_to_state(state, tracker_type, value):
+    if tracker_type == "normal":
+        state["sum"] += value
+        add_sample(state, value)
+        add_to_window(state, value, value)
+
+    else:
+        if state["first"] is None:
+            state["first"] = value
+            add_to_window(state, value, None)
+        else:
+            add_sample(state, value - state["last"])
+            add_to_window(state, value, value - state["last"])
+        state["last"] = value
+
+    state["count"] += 1
+
+# Adds many values to a state at once, in order, like calling
+# add_value_to_state for each of them
+# The statistics and sketch are updated with add_samples, which is much faster
+#   for large pushes.
+def add_values_to_state(state, tracker_type, values):
+    if len(values) == 0:
+        return
+
+    if tracker_type == "normal":
+        state["sum"] = sum(values, state["sum"])
+        samples = values
+
+    else:
+        # The first sample is the interval since the last date of the state
+        previous = [] if state["last"] is None else [state["last"]]
+        dates = previous + list(values)
+        samples = array.array("q", map(operator.sub, dates[1:], dates[:-1]))
+
+        if state["first"] is None:
+            state["first"] = values[0]
+        state["last"] = values[-1]
+
+    add_samples(state, samples)
+
+    if state["mode"] is not None and state["mode"]["type"] == "time":
+        add_dates_to_window(state, values)
+
+    elif state["mode"] is not None:
+        # The first date of a tracker doesn't have a sample
+        window_samples = [None] * (len(values) - len(samples)) + list(samples)
+
+        for value, sample in zip(values, window_samples):
+            add_to_window(state, value, sample)
+
+    state["count"] += len(values)
+
+# Adds one entry (a line from the tracker file, or a pushed value) to a state
+def add_to_state(state, tracker_type, entry):
+    if tracker_type == "normal":
+        add_value_to_state(state, tracker_type, float(entry))
+    else:
+        add_value_to_state(state, tracker_type, date_to_epoch(entry, state_unit(state)))
+
+# Average modes
+# By default, the average covers every entry of a tracker. A tracker can
+# instead be created with a mode (stored in its state as "mode"):
+# - {"type": "last", "size": N}: the average of the last N samples
+#   (values, or intervals for date trackers), kept in a ring buffer with their
+#   sum ("window_sum")
+# - {"type": "time", "seconds": T}: date trackers only, the average interval
+#   between the entries from the last T seconds before the latest entry
+# - {"type": "ewma", "alpha": A}: an exponentially weighted moving average of
+#   the samples, where each new sample has a weight of A
+# All of them are updated on every push without reading older entries. A Store
+# keeps the window itself outside of the state (see "Windows").
+
+# Adds a value (and its sample: the value itself, or the interval since the
+# previous date, or None for the first date) to the window of a state
+def add_to_window(state, value, sample):
+    mode = state["mode"]
+
+    if mode is None:
+        return
+
+    if mode["type"] == "time":
+        window = state["window"]
+        window.append(value)
+
+        # Drop the entries that are now too old
+        oldest = 0
+        while window[oldest] < value - mode["seconds"] * state_unit(state):
+            oldest += 1
+        del window[:oldest]
+
+        return
+
+    if sample is None:
+        return
+
+    if mode["type"] == "ewma":
+        if state["ewma"] is None:
+            state["ewma"] = sample
+        else:
+            state["ewma"] = mode["alpha"] * sample + (1 - mode["alpha"]) * state["ewma"]
+
+    # mode["type"] == "last": the ring buffer replaces its oldest sample once
+    #   it's full
+    elif len(state["window"]) < mode["size"]:
+        state["window_sum"] = window_sum(state) + sample
+        state["window"].append(sample)
+
+    else:
+        position = state["window_position"]
+
+        state["window_sum"] = window_sum(state) + sample - state["window"][position]
+        state["window"][position] = sample
+        state["window_position"] = (position + 1) % mode["size"]
+
+        # The sum is added up again once per turn of the ring buffer, so that
+        #   rounding errors don't pile up
+        if state["window_position"] == 0:
+            state["window_sum"] = math.fsum(state["window"])
+
+# Adds sorted dates, all later than the window of a "time" mode, like calling
+# add_to_window for each of them
+# Both the window and the dates are sorted, so the dates that stay are found
+#   with a binary search instead of going through the window.
+def add_dates_to_window(state, dates):
+    import bisect
+
+    window = state["window"]
+    oldest = dates[-1] - state["mode"]["seconds"] * state_unit(state)
+
+    del window[:bisect.bisect_left(window, oldest)]
+    window.extend(dates[bisect.bisect_left(dates, oldest):])
+
+# Returns the sum of the ring buffer of a state, which states from older
+# versions don't have yet
+def window_sum(state):
+    if "window_sum" not in state:
+        state["window_sum"] = math.fsum(state["window"])
+
+    return state["window_sum"]
+
+# Builds the window of a state from all of the values and samples at once
+def fill_window(state, values, samples):
+    mode = state["mode"]
+
+    if mode is None:
+        return
+
+    if mode["type"] == "time":
+        if len(values) > 0:
+            state["window"] = [value for value in values if value >= values[-1] - mode["seconds"] * state_unit(state)]
+
+    elif mode["type"] == "last":
+        # The oldest sample is first, which is where the ring buffer continues
+        state["window"] = list(samples[len(samples) - mode["size"]:]) if len(samples) > mode["size"] else list(samples)
+        state["window_position"] = 0
+        state["window_sum"] = math.fsum(state["window"])
+
+    else:
+        for sample in samples:
+            add_to_window(state, None, sample)
+
+# Returns the average described by a state, or None if there aren't enough
+# entries to have one (no values, or fewer than two dates)
+def state_average(state, tracker_type):
+    if state.get("mode") is not None:
+        return window_average(state, tracker_type)
+
+    if tracker_type == "normal":
+        if state["count"] == 0:
+            return None
+
+        average = state["sum"] * 100 / state["count"]
+        average = round(average)
+        return average / 100
+
+    if state["count"] < 2:
+        return None
+
+    return round_seconds((state["last"] - state["first"]) / (state["count"] - 1) / state_unit(state), state_unit(state))
+
+def window_average(state, tracker_type):
+    mode = state["mode"]
+    window = state["window"]
+
+    if mode["type"] == "ewma":
+        average = state["ewma"]
+
+    elif mode["type"] == "last":
+        average = window_sum(state) / len(window) if window else None
+
+    else:
+        average = (window[-1] - window[0]) / (len(window) - 1) if len(window) > 1 else None
+
+    if average is None:
+        return None
+
+    # Rounded the same way as the average of every entry
+    if tracker_type == "date":
+        return round_seconds(average / state_unit(state), state_unit(state))
+
+    return round(average * 100) / 100
+
+# Rounds a number of seconds of a date tracker (an average or a statistic of
+# its intervals) the way it's printed: to whole seconds, or to milliseconds if
+# its unit is milliseconds (see "Dates")
+def round_seconds(seconds, unit):
+    if unit == 1:
+        return round(seconds)
+
+    return round(seconds, 3)
+
+# Describes a mode for "avg info"
+def describe_mode(mode, tracker_type):
+    samples = "intervals" if tracker_type == "date" else "values"
+
+    if mode["type"] == "last":
+        return f"mean of the last {mode['size']} {samples}"
+
+    if mode["type"] == "time":
+        return f"mean interval over the last {mode['seconds']} seconds"
+
+    return f"exponentially weighted mean of the {samples} (alpha {mode['alpha']})"
+
+# Streaming statistics
+# Besides the average, the state keeps statistics about the samples of a
+# tracker: its values (normal trackers) or the intervals between its entries
+# (date trackers). They're updated on every push, so reading them never
+# depends on how many entries the tracker has.
+# - mean and m2 are updated with Welford's algorithm, for the standard deviation
+# - min and max are the smallest and largest samples, and max_count is how
+#   many samples are equal to the max, so that taking samples out (see
+#   "Sorted dates") knows if the max is still there. States from before it was
+#   kept don't have it until a new max is added, and are treated as if no
+#   sample was equal to the max.
+# - sketch is a quantile sketch for the median and percentiles (see below)
+
+def add_sample(state, sample):
+    state["samples"] += 1
+
+    delta = sample - state["mean"]
+    state["mean"] += delta / state["samples"]
+    state["m2"] += delta * (sample - state["mean"])
+
+    if state["min"] is None or sample < state["min"]:
+        state["min"] = sample
+    if state["max"] is None or sample > state["max"]:
+        state["max"] = sample
+        state["max_count"] = 1
+    elif sample == state["max"] and "max_count" in state:
+        state["max_count"] += 1
+
+    sketch_add(state["sketch"], sample)
+
+# Adds many samples at once, for rebuilding a state or a large push
+# With NumPy, the statistics and sketch buckets of all samples are computed
+#   with array operations, and then merged into the state (the mean and m2
+#   with Chan et al.'s formula for combining two groups of samples)
+def add_samples(state, samples):
+    if len(samples) == 0:
+        return
+
+    if len(samples) < NUMPY_MINIMUM or import_numpy() is None:
+        for sample in samples:
+            add_sample(state, sample)
+        return
+
+    samples = numpy.asarray(samples, dtype=numpy.float64)
+    mean = float(samples.mean())
+    m2 = float(((samples - mean) ** 2).sum())
+
+    count = state["samples"] + len(samples)
+    delta = mean - state["mean"]
+
+    state["m2"] += m2 + delta * delta * state["samples"] * len(samples) / count
+    state["mean"] += delta * len(samples) / count
+    state["samples"] = count
+
+    minimum = float(samples.min())
+    maximum = float(samples.max())
+    state["min"] = minimum if state["min"] is None else min(state["min"], minimum)
+
+    if state["max"] is None or maximum > state["max"]:
+        state["max"] = maximum
+        state["max_count"] = int((samples == maximum).sum())
+    elif maximum == state["max"] and "max_count" in state:
+        state["max_count"] += int((samples == maximum).sum())
+
+    sketch_add_array(state["sketch"], samples)
+
+# Takes samples that were added before back out of the mean, m2 and sketch of a
+# state, when the intervals of a date tracker change (see "Sorted dates")
+# The mean and m2 are reversed with the same formula as add_samples, solved for
+#   the samples that stay. The min and max are left to the caller.
+def remove_samples(state, samples):
+    if len(samples) == 0:
+        return
+
+    # Large groups are handled with NumPy, like in add_samples
+    if len(samples) >= NUMPY_MINIMUM and import_numpy() is not None:
+        samples = numpy.asarray(samples, dtype=numpy.float64)
+        mean = float(samples.mean())
+        m2 = float(((samples - mean) ** 2).sum())
+
+        sketch_add_array(state["sketch"], samples, -1)
+
+    else:
+        mean = sum(samples) / len(samples)
+        m2 = sum((sample - mean) ** 2 for sample in samples)
+
+        for sample in samples:
+            sketch_add(state["sketch"], sample, -1)
+
+    count = state["samples"] - len(samples)
+
+    if count == 0:
+        state["samples"] = 0
+        state["mean"] = 0
+        state["m2"] = 0
+        return
+
+    remaining_mean = (state["mean"] * state["samples"] - mean * len(samples)) / count
+    delta = mean - remaining_mean
+
+    # Rounding errors can't make it negative
+    state["m2"] = max(state["m2"] - m2 - delta * delta * count * len(samples) / state["samples"], 0)
+    state["mean"] = remaining_mean
+    state["samples"] = count
+
+# Returns a new state with the statistics of the samples of all of these states
+# together, for group queries
+# The mean and m2 are combined with the same formula as add_samples, and the
+#   sketches by adding their bucket counts.
+# The intervals of date trackers in seconds and in milliseconds can't be
+#   combined, since the sketches don't have the same buckets.
+def merge_statistics(states):
+    units = {state_unit(state) for state in states if state["samples"] > 0}
+
+    if len(units) > 1:
+        raise AvgError("The statistics of trackers in seconds and in milliseconds can't be combined.")
+
+    merged = new_state(unit=units.pop() if units else 1)
+    sketch = merged["sketch"]
+
+    for state in states:
+        if state["samples"] == 0:
+            continue
+
+        count = merged["samples"] + state["samples"]
+        delta = state["mean"] - merged["mean"]
+
+        merged["m2"] += state["m2"] + delta * delta * merged["samples"] * state["samples"] / count
+        merged["mean"] += delta * state["samples"] / count
+        merged["samples"] = count
+
+        merged["min"] = state["min"] if merged["min"] is None else min(merged["min"], state["min"])
+        merged["max"] = state["max"] if merged["max"] is None else max(merged["max"], state["max"])
+
+        sketch["zero"] += state["sketch"]["zero"]
+
+        for store in ["positive", "negative"]:
+            for index, bucket_count in state["sketch"][store].items():
+                sketch[store][index] = sketch[store].get(index, 0) + bucket_count
+
+    return merged
+
+# Returns a statistic of a state: "median", "p95", "p99", "stddev", "min" or
+# "max", or None if the tracker has no samples yet
+def state_statistic(state, statistic):
+    if state["samples"] == 0:
+        return None
+
+    if statistic == "stddev":
+        return math.sqrt(state["m2"] / state["samples"])
+
+    if statistic in ["min", "max"]:
+        return state[statistic]
+
+    quantile = 0.5 if statistic == "median" else int(statistic[1:]) / 100
+    value = sketch_quantile(state["sketch"], quantile)
+
+    # The sketch only knows the bucket, so keep the result inside the range
+    #   of real samples
+    return min(max(value, state["min"]), state["max"])
+
+# The statistics that "avg get" can print
+STATISTICS = ["median", "p95", "p99", "stddev", "min", "max"]
+
+# Quantile sketch
+# The sketch (like DDSketch) puts every sample into a bucket whose bounds grow
+# geometrically by SKETCH_GAMMA, counting how many samples fell into each one.
+# Quantiles are interpolated between the two samples around their rank, like
+# the default (linear) method of numpy.quantile, and every sample is known to
+# within SKETCH_ACCURACY (1%) of its real value. The size of a sketch only
+# depends on the range of the samples, and two sketches can be
+# merged by adding their counts.
+# Buckets are stored with string keys, since the sketch is saved as JSON.
+
+SKETCH_ACCURACY = 0.01
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_LOG_GAMMA = math.log(SKETCH_GAMMA)
+
+# Samples closer to zero than this are counted as zero
+SKETCH_ZERO = 1e-9
+
+def new_sketch():
+    return {"positive": {}, "negative": {}, "zero": 0}
+
+def sketch_add(sketch, sample, count=1):
+    if abs(sample) < SKETCH_ZERO:
+        sketch["zero"] += count
+        return
+
+    store = sketch["positive"] if sample > 0 else sketch["negative"]
+    index = f"{math.ceil(math.log(abs(sample)) / SKETCH_LOG_GAMMA)}"
+    store[index] = store.get(index, 0) + count
+
+# Adds every sample of a NumPy array to a sketch at once, count times each
+def sketch_add_array(sketch, samples, count=1):
+    sketch["zero"] += count * int((numpy.abs(samples) < SKETCH_ZERO).sum())
+
+    for store, selected in [("positive", samples[samples >= SKETCH_ZERO]), ("negative", -samples[samples <= -SKETCH_ZERO])]:
+        indexes, counts = numpy.unique(numpy.ceil(numpy.log(selected) / SKETCH_LOG_GAMMA).astype(numpy.int64), return_counts=True)
+
+        buckets = sketch[store]
+
+        for index, bucket_count in zip(indexes.tolist(), counts.tolist()):
+            buckets[f"{index}"] = buckets.get(f"{index}", 0) + count * bucket_count
+
+def sketch_quantile(sketch, quantile):
+    # Every bucket is represented by the value in the middle of its bounds
+    buckets = []
+
+    for index, count in sketch["negative"].items():
+        buckets.append((-2 * SKETCH_GAMMA ** int(index) / (SKETCH_GAMMA + 1), count))
+
+    buckets.append((0, sketch["zero"]))
+
+    for index, count in sketch["positive"].items():
+        buckets.append((2 * SKETCH_GAMMA ** int(index) / (SKETCH_GAMMA + 1), count))
+
+    buckets = [(value, count) for value, count in sorted(buckets) if count > 0]
+
+    # The quantile is between the samples at these two ranks
+    rank = quantile * (sum(count for value, count in buckets) - 1)
+    lower = math.floor(rank)
+    below = sketch_sample(buckets, lower)
+
+    return below + (rank - lower) * (sketch_sample(buckets, lower + 1) - below)
+
+# Returns the sample at a rank (0 for the smallest) of sorted (value, count)
+# buckets, or the largest one if there aren't that many
+def sketch_sample(buckets, rank):
+    seen = 0
+
+    for value, count in buckets:
+        seen += count
+        if seen > rank:
+            return value
+
+    return buckets[-1][0]
+
+# Binary trackers
+# A tracker file can also be stored in a binary format (see "avg convert").
+# It starts with a fixed-size header:
+#   magic (4 bytes), type (0 = normal, 1 = date), unit (0 = seconds,
+#   1 = milliseconds, see "Dates"), 2 bytes of padding,
+#   count, sum, first, last, average, description length,
+#   then the UTF-8 description, padded with zeros to BINARY_HEADER_SIZE bytes
+# The header is followed by the entries, packed as little-endian float64
+# values (normal trackers) or int64 seconds since the epoch (date trackers).
+# They can be read straight into an array without parsing anything.
+BINARY_MAGIC = b"AVGB"
+BINARY_HEADER = struct.Struct("<4sBB2xqdqqdH")
+BINARY_HEADER_SIZE = 1024
+BINARY_DESCRIPTION_SIZE = BINARY_HEADER_SIZE - BINARY_HEADER.size
+
+# array typecodes of the packed entries
+BINARY_TYPECODES = {"normal": "d", "date": "q"}
+
+
+def read_binary_header(tracker_file):
+    tracker_file.seek(0)
+    data = tracker_file.read(BINARY_HEADER_SIZE)
+
+    magic, type_number, unit_number, count, value_sum, first, last, average, description_length = BINARY_HEADER.unpack_from(data)
+    description = data[BINARY_HEADER.size:BINARY_HEADER.size + description_length].decode()
+
+    return {
+        "type": "date" if type_number == 1 else "normal",
+        "unit": MILLISECONDS if unit_number == 1 else 1,
+        "count": count,
+        "sum": value_sum,
+        "first": first,
+        "last": last,
+        "average": average,
+        "description": description
+    }
+
+def pack_binary_header(tracker_type, description, state):
+    description = description.encode()
+    average = state_average(state, tracker_type)
+
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC,
+        1 if tracker_type == "date" else 0,
+        1 if state_unit(state) == MILLISECONDS else 0,
+        state["count"],
+        state["sum"],
+        state["first"] or 0,
+        state["last"] or 0,
+        0 if average is None else average,
+        len(description)
+    )
+
+    return (header + description).ljust(BINARY_HEADER_SIZE, b"\0")
+
+# Converts seconds since the epoch (or units) back to "YYYY/MM/DD/HH/MM", with
+# "/SS" if the seconds aren't 0 and ".mmm" if the fraction isn't 0
+# The year is always padded to 4 digits, which "%Y" doesn't do everywhere.
+def epoch_to_date(epoch, unit=1):
+    epoch, fraction = divmod(epoch, unit)
+
+    moment = time.gmtime(epoch)
+    date = f"{moment.tm_year:04}/{moment.tm_mon:02}/{moment.tm_mday:02}/{moment.tm_hour:02}/{moment.tm_min:02}"
+
+    if fraction:
+        return f"{date}/{moment.tm_sec:02}.{fraction * 1000 // unit:03}"
+
+    if epoch % 60:
+        return f"{date}/{moment.tm_sec:02}"
+
+    return date
+
+# Returns the lines of a text date tracker for these seconds since the epoch
+# (or units), each one like epoch_to_date, followed by a newline, as bytes
+# With NumPy, the digits of every date are computed at the same time, with the
+#   civil_from_days algorithm (the inverse of days_from_civil, see
+#   dates_to_epochs), and the "/SS" of the dates whose seconds are 0 (and the
+#   ".mmm" of the ones whose fraction is 0) is masked out.
+def epochs_to_lines(epochs, unit=1):
+    if len(epochs) < NUMPY_MINIMUM or import_numpy() is None:
+        return "".join(f"{epoch_to_date(epoch, unit)}\n" for epoch in epochs).encode()
+
+    epochs, fraction = numpy.divmod(numpy.asarray(epochs, dtype=numpy.int64), unit)
+    milliseconds = fraction * 1000 // unit
+    days, seconds = numpy.divmod(epochs, 86400)
+
+    days = days + 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_from_march = (5 * day_of_year + 2) // 153
+
+    day = day_of_year - (153 * month_from_march + 2) // 5 + 1
+    month = numpy.where(month_from_march < 10, month_from_march + 3, month_from_march - 9)
+    year = year_of_era + era * 400 + (month <= 2)
+
+    hour = seconds // 3600
+    minute = seconds // 60 % 60
+    second = seconds % 60
+
+    # "YYYY/MM/DD/HH/MM/SS.mmm\n", one row per date
+    columns = [
+        year // 1000, year // 100 % 10, year // 10 % 10, year % 10, "/",
+        month // 10, month % 10, "/", day // 10, day % 10, "/",
+        hour // 10, hour % 10, "/", minute // 10, minute % 10, "/",
+        second // 10, second % 10, ".",
+        milliseconds // 100, milliseconds // 10 % 10, milliseconds % 10, "\n"
+    ]
+
+    characters = numpy.empty((len(days), len(columns)), dtype=numpy.uint8)
+
+    for number, column in enumerate(columns):
+        characters[:, number] = ord(column) if isinstance(column, str) else column + ord("0")
+
+    kept = numpy.ones(characters.shape, dtype=bool)
+    kept[:, 16:19] = ((second != 0) | (fraction != 0))[:, None]
+    kept[:, 19:23] = (fraction != 0)[:, None]
+
+    return characters[kept].tobytes()
+
+# The average of a binary tracker, written the same way as in a text tracker
+def format_binary_average(header):
+    if header["count"] == 0 or (header["type"] == "date" and header["count"] < 2):
+        return "0"
+
+    if header["type"] == "date" and header["unit"] == 1:
+        return f"{int(header['average'])}"
+
+    return f"{header['average']}"
+
+# Returns the contents of a text tracker file with these entries
+# values are numbers, like the ones read_values returns
+def text_tracker_data(tracker_type, description, values, state):
+    average = state_average(state, tracker_type)
+    lines = [description, f"{0 if average is None else average}".ljust(AVERAGE_WIDTH)]
+
+    if tracker_type == "date":
+        lines.append("date")
+        lines.extend(epoch_to_date(value, state_unit(state)) for value in values)
+    else:
+        lines.extend(f"{value}" for value in values)
+
+    return "".join(f"{line}\n" for line in lines).encode()
+
+# Returns the last line of a text file by reading backwards from the end
+def read_last_line(tracker_file):
+    end = tracker_file.seek(0, os.SEEK_END)
+    position = end
+    data = b""
+
+    # Stop once there is a newline before the last line, ignoring the one
+    #   that ends the file
+    while position > 0 and data.rstrip(b"\n").count(b"\n") == 0:
+        step = min(4096, position)
+        position -= step
+
+        tracker_file.seek(position)
+        data = tracker_file.read(step) + data
+
+    return data.rstrip(b"\n").split(b"\n")[-1].decode()
+
+# Converts a list of "YYYY/MM/DD/HH/MM" (or "YYYY/MM/DD/HH/MM/SS") lines to an
+# array of seconds since the epoch (or units), like date_to_epoch
+def dates_to_epochs(lines, unit=1):
+    epochs = array.array("q")
+
+    if not lines:
+        return epochs
+
+    add_count("dates_parsed", len(lines))
+
+    # With NumPy, the digits of every date are converted at the same time
+    # The number of days since 1970 is computed with the days_from_civil
+    #   algorithm (http://howardhinnant.github.io/date_algorithms.html)
+    if len(lines) >= NUMPY_MINIMUM and import_numpy() is not None:
+        # Shorter lines are padded with zero bytes
+        width = 19 if unit == 1 else 23
+        digits = numpy.array(lines, dtype=f"S{width}").view(numpy.uint8).reshape(-1, width).astype(numpy.int64) - ord("0")
+
+        year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+        month = digits[:, 5] * 10 + digits[:, 6]
+        day = digits[:, 8] * 10 + digits[:, 9]
+        hour = digits[:, 11] * 10 + digits[:, 12]
+        minute = digits[:, 14] * 10 + digits[:, 15]
+        second = numpy.where(digits[:, 16] == ord("/") - ord("0"), digits[:, 17] * 10 + digits[:, 18], 0)
+
+        year = year - (month <= 2)
+        era = year // 400
+        year_of_era = year - era * 400
+        day_of_year = (153 * (month + numpy.where(month > 2, -3, 9)) + 2) // 5 + day - 1
+        day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+        days = era * 146097 + day_of_era - 719468
+
+        numbers = days * 86400 + hour * 3600 + minute * 60 + second
+
+        if unit != 1:
+            # The padding isn't a digit, and counts as a 0
+            fraction = numpy.where((digits[:, 20:] >= 0) & (digits[:, 20:] <= 9), digits[:, 20:], 0)
+            numbers = numbers * unit + (fraction[:, 0] * 100 + fraction[:, 1] * 10 + fraction[:, 2]) * unit // 1000
+
+        epochs.frombytes(numbers.astype(numpy.int64).tobytes())
+        return epochs
+
+    # Without NumPy, the start of each day is only computed once, since
+    #   entries of date trackers usually share days with their neighbours
+    day_starts = {}
+
+    for line in lines:
+        day = line[0:10]
+
+        if day not in day_starts:
+            day_starts[day] = date_to_epoch(f"{day}/00/00")
+
+        epoch = day_starts[day] + int(line[11:13]) * 3600 + int(line[14:16]) * 60 + (int(line[17:19]) if len(line) > 16 else 0)
+        epochs.append(epoch if unit == 1 else epoch * unit + fraction_to_units(line[20:], unit))
+
+    return epochs
+
+# Builds the state of a tracker from all of its values at once
+# The sum is taken in file order, the same way push adds values one by one
+def state_from_values(tracker_type, values, mode=None, unit=1):
+    state = new_state(mode, unit)
+    state["count"] = len(values)
+
+    if tracker_type == "normal":
+        state["sum"] = sum(values, 0)
+        samples = values
+
+    else:
+        if values:
+            state["first"] = values[0]
+            state["last"] = values[-1]
+
+        # The samples of a date tracker are its intervals
+        if import_numpy() is not None:
+            samples = numpy.diff(numpy.frombuffer(values, dtype=numpy.int64)).tolist()
+        else:
+            samples = array.array("q", map(operator.sub, values[1:], values[:-1]))
+
+    add_samples(state, samples)
+    fill_window(state, values, samples)
+
+    return state
+
+# Date interval statistics
+# Returns the mean, median, minimum, maximum and (population) standard
+# deviation of the intervals between adjacent entries of a date tracker, in
+# seconds, or None if there are fewer than two entries.
+# epochs is an array of seconds since the epoch. The intervals are computed
+# with one vectorized subtraction, using NumPy if it's installed.
+def interval_statistics(epochs):
+    if len(epochs) < 2:
+        return None
+
+    if import_numpy() is not None:
+        intervals = numpy.diff(numpy.frombuffer(epochs, dtype=numpy.int64))
+
+        return {
+            "mean": float(intervals.mean()),
+            "median": float(numpy.median(intervals)),
+            "min": int(intervals.min()),
+            "max": int(intervals.max()),
+            "stddev": float(intervals.std())
+        }
+
+    intervals = array.array("q", map(operator.sub, epochs[1:], epochs[:-1]))
+    count = len(intervals)
+
+    # The intervals add up to last - first
+    mean = (epochs[-1] - epochs[0]) / count
+
+    ordered = sorted(intervals)
+    if count % 2:
+        median = ordered[count // 2]
+    else:
+        median = (ordered[count // 2 - 1] + ordered[count // 2]) / 2
+
+    variance = sum((interval - mean) ** 2 for interval in intervals) / count
+
+    return {
+        "mean": mean,
+        "median": median,
+        "min": ordered[0],
+        "max": ordered[-1],
+        "stddev": math.sqrt(variance)
+    }
+
+# Time ranges
+# "avg get ... --since/--until" and "avg series" only read the entries from a
+# range of times. The time of an entry of a date tracker is the entry itself.
+# Normal trackers record the time every value was pushed in config/avg/times,
+# as int64 seconds (one per entry, in the same order as the entries), in local
+# time like the "now" of date trackers. Values pushed by older versions of
+# kvrg-avg get a time of 0, which range queries ignore.
+# Both are sorted, so the range is found with a binary search:
+# - binary trackers and the times files have fixed-size records, so any
+#   entry can be read directly
+# - text trackers have a sparse index in config/avg/index: the time and byte
+#   offset of every INDEX_INTERVAL-th entry, so a range query only reads the
+#   lines from the closest indexed entry on. It's kept up to date by push, and
+#   rebuilt by the next range query whenever it doesn't match the tracker.
+
+INDEX_INTERVAL = 256
+INDEX_RECORD = struct.Struct("<qq")
+
+# Times that are never reached
+END_OF_TIME = 2 ** 62
+
+# The current local time, in seconds since the epoch (or units), the same as
+# parse_date of "now"
+def local_time(unit=1):
+    now = time.time()
+    return int((now + time.localtime(now).tm_gmtoff) * unit)
+
+# Returns the first position in 0 .. count - 1 whose key (given by key_at)
+# is at least key, or more than key with right=True, or count if there isn't one
+# The keys must be sorted.
+def search_sorted(count, key_at, key, right=False):
+    low = 0
+    high = count
+
+    while low < high:
+        middle = (low + high) // 2
+        middle_key = key_at(middle)
+
+        if middle_key < key or (right and middle_key == key):
+            low = middle + 1
+        else:
+            high = middle
+
+    return low
+
+# Returns the int64 at an offset of packed little-endian data
+def read_packed(data, offset):
+    return struct.unpack_from("<q", data, offset)[0]
+
+# Converts the --since and --until of range queries (a date, see "Dates", or a
+# Unix timestamp) to seconds since the epoch (or units) in local time, like
+# the entries
+# A number is a real Unix timestamp, the same as "@<timestamp>".
+def to_epoch(moment, unit=1):
+    if isinstance(moment, str):
+        return check_values("date", [moment], unit)[0]
+
+    try:
+        epoch = timestamp_to_local(moment, unit)
+    except (ValueError, OverflowError, OSError):
+        epoch = None
+
+    if epoch is None:
+        raise AvgError(f"Value '{moment}' is invalid.")
+
+    return epoch
+
+# The sizes of buckets that "avg series" accepts by name, in seconds
+BUCKETS = {"minute": 60, "hour": 3600, "day": 86400, "week": 604800}
+
+# Compaction
+# "avg compact" folds the oldest entries of a tracker into its summary: the
+# state of those entries alone, with the number of entries it covers. Only the
+# newer entries are still stored one by one. A state is rebuilt from the
+# summary and the stored entries (see Store.state_from_entries), so the average
+# and statistics stay the same; only range queries, "avg series" and
+# "avg intervals" lose the compacted entries.
+# Three keys of the state are about compaction (states from older versions
+# don't have them yet):
+# - "compacted": the number of entries in the summary
+# - "older_than": the automatic policy, in seconds (or None): push compacts
+#   the entries that are older than this
+# - "kept": the number of entries that were stored after the last compaction
+
+# Push compacts automatically once a tracker stores at least this many entries,
+# and twice as many as after the last compaction, so each entry is only
+# rewritten a few times
+COMPACT_MINIMUM = 1000
+
+# The number of entries of a state that are stored one by one
+def stored_count(state):
+    return state["count"] - state.get("compacted", 0)
+
+# Sorted dates
+# The entries of a date tracker are always sorted, so that no interval is
+# negative and range queries can search them (see "Time ranges"). Dates are
+# sorted when they're pushed, and usually just appended after the last entry.
+# Earlier dates (e.g. when backfilling) are merged into the entries that are
+# later than them instead: only those entries are read (from the end of the
+# tracker) and rewritten, and the state is updated by taking their intervals
+# out and putting the new ones in, so the tracker is never sorted again from
+# the start.
+# Dates can't be merged into compacted entries, since the summary doesn't know
+# where they were. With "avg push --unique", dates that are already entries
+# (or pushed twice) are skipped.
+
+# Sorts pushed dates (and the entries they're written as) by date, and drops
+# the repeated ones if unique
+def sort_dates(dates, entries, unique):
+    pairs = sorted(zip(dates, entries), key=operator.itemgetter(0))
+
+    if unique:
+        pairs = [pair for number, pair in enumerate(pairs) if number == 0 or pair[0] != pairs[number - 1][0]]
+
+    return array.array("q", (date for date, entry in pairs)), [entry for date, entry in pairs]
+
+# Updates the state of a date tracker after later (its entries after previous,
+# which is None if there's no entry before them) were replaced by merged: the
+# same entries with the new dates merged in
+# Splitting intervals never makes the smallest one larger, so the min stays
+#   right. If every interval that was equal to the max is split, the next
+#   largest isn't known: earlier_max is called to get the largest of the
+#   intervals before previous and how many of them are equal to it (or
+#   (None, 0)), which reads every entry but is rare.
+# Returns False if the state can't be updated and has to be rebuilt from every
+#   entry, since an exponentially weighted mean depends on every interval.
+def merge_into_state(state, previous, later, dates, merged, earlier_max):
+    mode = state["mode"]
+
+    if mode is not None and mode["type"] == "ewma":
+        return False
+
+    before = list(later) if previous is None else [previous] + list(later)
+    after = merged if previous is None else [previous] + merged
+
+    removed = list(map(operator.sub, before[1:], before[:-1]))
+    added = list(map(operator.sub, after[1:], after[:-1]))
+
+    split = False
+
+    if removed and max(removed) == state["max"]:
+        state["max_count"] = state.get("max_count", 0) - removed.count(state["max"])
+        split = state["max_count"] <= 0
+
+    remove_samples(state, removed)
+
+    if split:
+        state["max"], state["max_count"] = earlier_max()
+
+    add_samples(state, added)
+
+    if mode is not None and mode["type"] == "last":
+        # The removed intervals were the latest ones in the ring buffer, so it
+        #   goes back by as many, and the new ones are added like pushed ones.
+        #   Once it's full, the samples before its position are the latest ones,
+        #   and they're replaced (and taken out of the sum) by add_to_window.
+        window = state["window"]
+
+        if len(window) < mode["size"]:
+            kept = max(len(window) - len(removed), 0)
+
+            state["window_sum"] = window_sum(state) - math.fsum(removed[len(removed) - (len(window) - kept):])
+            del window[kept:]
+
+        else:
+            state["window_position"] = (state["window_position"] - len(removed)) % mode["size"]
+
+        for sample in added:
+            add_to_window(state, None, sample)
+
+    elif mode is not None and mode["type"] == "time":
+        window = sorted(itertools.chain(state["window"], dates))
+        state["window"] = [value for value in window if value >= merged[-1] - mode["seconds"] * state_unit(state)]
+
+    if previous is None:
+        state["first"] = merged[0]
+    state["last"] = merged[-1]
+    state["count"] += len(dates)
+
+    return True
+
+# Groups
+# "avg get" can combine a group of trackers into one answer: the trackers whose
+# names match a glob (e.g. "latency-*"), and/or that were created with a tag
+# (see "avg create --tag"). Their states are merged instead of reading any
+# entries, so every value counts once no matter which tracker it's in: the
+# average of a group is the sum of all of its values over their number (or
+# the mean of all of its intervals), not the average of the averages.
+# The tags of a tracker are kept as empty files in config/avg/tags/<tag>, so
+# the trackers with a tag are listed in one step.
+
+# Returns True if a name is a glob pattern rather than a tracker name
+def is_glob(name):
+    return any(character in name for character in "*?[")
+
+# Returns the average of every entry of several trackers together, from their
+# states, or None if they don't have enough entries
+# Average modes are ignored, since a window can't be merged with another one.
+def merged_average(states, tracker_type):
+    if tracker_type == "normal":
+        count = sum(state["count"] for state in states)
+
+        if count == 0:
+            return None
+
+        return round(sum(state["sum"] for state in states) * 100 / count) / 100
+
+    # The intervals of each tracker add up to its last date - its first date,
+    #   in the smallest unit of the group
+    dated = [state for state in states if state["count"] > 1]
+    intervals = sum(state["count"] - 1 for state in dated)
+
+    if intervals == 0:
+        return None
+
+    unit = max(state_unit(state) for state in dated)
+    total = sum((state["last"] - state["first"]) * (unit // state_unit(state)) for state in dated)
+
+    return round_seconds(total / intervals / unit, unit)
+
+# Errors
+# Anything the caller got wrong (a tracker that doesn't exist, a value that
+# isn't a number, ...) raises an AvgError. Its message is what the avg command
+# prints before exiting with status 1.
+class AvgError(Exception):
+    pass
+
+# The attributes that "avg get" and Tracker.get return
+ATTRIBUTES = ["description", "average", "type", "ETA", "count"] + STATISTICS
+
+# The attributes that can be computed for a range of times or a group of
+# trackers
+RANGE_ATTRIBUTES = ["average", "count"] + STATISTICS
+
+# Makes sure every value can be pushed to a tracker of the given type, and
+# returns them as numbers: floats for normal trackers, and seconds since the
+# epoch for date trackers (see parse_date), so they're only parsed once
+# Values of normal trackers are numbers (or strings of numbers), and values of
+#   date trackers are dates (see "Dates")
+def check_values(tracker_type, values, unit=1):
+    # Makes sure all values are numbers if it's a normal tracker
+    # float() also reads "nan" and "inf", which would make every statistic
+    #   of the tracker nan or inf from then on, so they aren't numbers here.
+    if tracker_type == "normal":
+        numbers = array.array("d")
+
+        for argument in values:
+            try:
+                number = float(argument)
+            except (TypeError, ValueError):
+                raise AvgError(f"Value '{argument}' is not a number.")
+
+            if not math.isfinite(number):
+                raise AvgError(f"Value '{argument}' is not a number.")
+
+            numbers.append(number)
+
+        return numbers
+
+    add_count("dates_checked", len(values))
+
+    epochs = array.array("q")
+
+    # Makes sure all values are dates (or "now") if it's a date tracker
+    for argument in values:
+        epoch = parse_date(argument, unit)
+
+        if epoch is None:
+            raise AvgError(f"Value '{argument}' is invalid.")
+
+        epochs.append(epoch)
+
+    return epochs
+
+# Returns the line that a checked value is written as in a tracker file, given
+# the number check_values returned for it
+# Dates are written like epoch_to_date does, which most of them already are.
+def format_entry(tracker_type, argument, number, unit=1):
+    if tracker_type == "normal":
+        return f"{argument}"
+
+    if len(argument) == 16 and argument[4] == "/":
+        return argument
+
+    return epoch_to_date(number, unit)
+
+# Returns a statistic (see state_statistic) as the string that "avg get" prints,
+# rounded the same way as the average
+# unit is the unit of the intervals of a date tracker (see state_unit).
+def format_statistic(value, tracker_type, unit=1):
+    if value is None:
+        return "0"
+
+    if tracker_type == "date":
+        return f"{round_seconds(value / unit, unit)}"
+
+    return f"{round(value * 100) / 100}"
+
+# The ETA of a date tracker with count entries: the date of its last entry (in
+# seconds since the epoch) plus its average interval, as "YYYY-MM-DD HH:MM:SS",
+# or "0" if it doesn't have any intervals yet
+# Store.read_tracker puts it in the header, so reading it never parses a date.
+def estimate_ETA(count, last, average):
+    if count < 2:
+        return "0"
+
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(last + int(float(average))))
+
+# Average intervals that were already made human-readable, by number of seconds
+# Trackers often share an average (e.g. 0, or a daily habit), so "avg list"
+#   formats each one once.
+humanized_durations = {}
+
+# Converts a number of seconds to the largest two units, e.g. "21 minutes and
+# 42 seconds" instead of 1302 (a month is 30 days)
+# Fractions of a second (see "Dates") are only shown under a minute.
+def humanize_duration(seconds):
+    if seconds in humanized_durations:
+        return humanized_durations[seconds]
+
+    minutes = int(seconds) // 60
+    hours = minutes // 60
+    days = hours // 24
+    months = days // 30
+    years = months // 12
+
+    if minutes == 0:
+        output = f"{seconds}"
+    elif hours == 0:
+        output = f"{minutes} minutes and {int(seconds) - minutes * 60} seconds"
+    elif days == 0:
+        output = f"{hours} hours and {minutes - hours * 60} minutes"
+    elif months == 0:
+        output = f"{days} days and {hours - days * 24} hours"
+    elif years == 0:
+        output = f"{months} months and {days - months * 30} days"
+    else:
+        output = f"{years} years and {months - years * 12} months"
+
+    humanized_durations[seconds] = output
+    return output
+
+# Returns [function(item) for item in items], reading trackers in parallel,
+# which helps when every file access is slow (e.g. on a network file system)
+# The results are in the same order as the items. One item (or jobs=1) is
+#   handled without starting any threads.
+def map_in_parallel(function, items, jobs=None):
+    if len(items) < 2 or jobs == 1:
+        return [function(item) for item in items]
+
+    import concurrent.futures
+
+    with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+        return list(pool.map(function, items))
+
+# The lock returned by Store.lock
+# This is a class rather than a contextlib.contextmanager because importing
+#   contextlib takes longer than a push
+class TrackerLock:
+    def __init__(self, path):
+        self.path = path
+
+    def __enter__(self):
+        self.lock_file = open(self.path, "a")
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+
+    def __exit__(self, *exception):
+        fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+        self.lock_file.close()
+
+# Numbers the temporary files of this process, see Store.write_file_atomically
+temporary_counter = itertools.count()
+
+# Windows
+# The window of a "last" or "time" average mode (see "Average modes") can hold
+# millions of samples, so a Store doesn't keep it in the state file, which
+# every push rewrites. It's in config/avg/windows/<name> instead: a stamp,
+# followed by the records packed like the entries of a binary tracker
+# (little-endian int64 for dates and intervals, float64 for values). In its
+# place, the state file has {"typecode", "stamp", "start", "length"}: the
+# window is the records from start to length, and the ones before start were
+# dropped (see add_to_window) but stay in the file until they're most of it.
+# A push only reads and writes the records it changes (e.g. the sample at
+# window_position * 8 in a ring buffer), and "avg list" and "avg get" don't
+# read the window at all, so none of them depend on its size.
+# The file gets a new stamp before any of its records change, and the state is
+# saved after that: a state whose stamp isn't the one in its window file was
+# left behind by an interrupted push, and is rebuilt from the entries (see
+# Store.load_state).
+WINDOW_STAMP = struct.Struct("<Q")
+
+# A window file is only written again without its dropped records once it has
+# at least this many
+WINDOW_DROPPED_MINIMUM = 4096
+
+# How many records a window file reads at once, since the records that push
+# reads are usually next to each other
+WINDOW_BLOCK = 4096
+
+# The modes whose window is kept in a WindowFile
+WINDOW_MODES = ["last", "time"]
+
+# The window of a state in a window file, which add_to_window and the other
+# functions of "Average modes" use like a list: its records can be read,
+# changed, appended, iterated over and deleted from the start or the end
+# Changes stay in memory until save writes them.
+class WindowFile:
+    def __init__(self, path, typecode, stamp=None, start=0, length=0):
+        self.path = path
+        self.typecode = typecode
+        self.stamp = stamp
+        self.start = start
+        self.length = length
+
+        # The records that were changed or appended, by number, or all of the
+        #   records if the whole file has to be written again
+        self.changes = {}
+        self.records = None
+
+        # The last block of records read from the file, and the number of the
+        #   first one
+        self.block = None
+        self.block_start = 0
+
+    # The part of the state that's saved instead of the window
+    def descriptor(self):
+        return {"typecode": self.typecode, "stamp": self.stamp, "start": self.start, "length": self.length}
+
+    def __len__(self):
+        return self.length - self.start
+
+    # Returns the record number of an index of the window
+    def number(self, index):
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError("window index out of range")
+
+        return self.start + index
+
+    def __getitem__(self, index):
+        number = self.number(index)
+
+        if self.records is not None:
+            return self.records[number]
+
+        if number in self.changes:
+            return self.changes[number]
+
+        if self.block is None or not self.block_start <= number < self.block_start + len(self.block):
+            self.block = self.read(number, min(number + WINDOW_BLOCK, self.length))
+            self.block_start = number
+
+        return self.block[number - self.block_start]
+
+    def __setitem__(self, index, value):
+        number = self.number(index)
+
+        if self.records is not None:
+            self.records[number] = value
+        else:
+            self.changes[number] = value
+
+    def append(self, value):
+        if self.records is not None:
+            self.records.append(value)
+        else:
+            self.changes[self.length] = value
+
+        self.length += 1
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    # Deletes the records of window[:index.stop] (which are only dropped, see
+    # "Windows"), or of window[index.start:]
+    def __delitem__(self, index):
+        start, stop, step = index.indices(len(self))
+
+        if index.stop is not None:
+            self.start += stop
+            return
+
+        self.length = self.start + start
+        self.changes = {number: value for number, value in self.changes.items() if number < self.length}
+
+        if self.records is not None:
+            del self.records[self.length:]
+
+    def __iter__(self):
+        if self.records is not None:
+            return iter(self.records[self.start:self.length])
+
+        values = self.read(self.start, self.length)
+
+        for number, value in self.changes.items():
+            if number >= self.start:
+                values[number - self.start] = value
+
+        return iter(values)
+
+    # Returns the records from first to last - 1 as an array, with the ones that
+    # aren't in the file yet as 0
+    def read(self, first, last):
+        with open(self.path, "rb") as window_file:
+            window_file.seek(WINDOW_STAMP.size + first * 8)
+            values = array.array(self.typecode, window_file.read((last - first) * 8))
+
+        if sys.byteorder == "big":
+            values.byteswap()
+
+        values.extend([0] * (last - first - len(values)))
+
+        return values
+
+    # Returns True if the window file has the stamp of the state
+    def matches(self):
+        try:
+            with open(self.path, "rb") as window_file:
+                data = window_file.read(WINDOW_STAMP.size)
+
+        except FileNotFoundError:
+            return False
+
+        return len(data) == WINDOW_STAMP.size and WINDOW_STAMP.unpack(data)[0] == self.stamp
+
+    # Replaces every record, so that save writes the whole file again
+    def replace(self, values):
+        self.records = array.array(self.typecode, values)
+        self.start = 0
+        self.length = len(self.records)
+        self.changes = {}
+        self.block = None
+
+    # Writes the changes into the window file, with a new stamp
+    # write_file_atomically is the one of the Store, for writing the whole file.
+    def save(self, write_file_atomically):
+        if self.records is None and self.start >= WINDOW_DROPPED_MINIMUM and self.start > len(self):
+            self.replace(list(self))
+
+        if self.records is None and not self.changes:
+            return
+
+        self.stamp = int.from_bytes(os.urandom(WINDOW_STAMP.size), "little")
+        self.block = None
+
+        if self.records is not None:
+            records = array.array(self.typecode, self.records)
+
+            if sys.byteorder == "big":
+                records.byteswap()
+
+            write_file_atomically(self.path, WINDOW_STAMP.pack(self.stamp) + records.tobytes())
+            self.records = None
+            return
+
+        with open(self.path, "r+b") as window_file:
+            window_file.write(WINDOW_STAMP.pack(self.stamp))
+
+            # Records next to each other are written at once
+            numbers = sorted(self.changes)
+
+            for offset, run in itertools.groupby(enumerate(numbers), lambda pair: pair[1] - pair[0]):
+                run = [number for position, number in run]
+                values = array.array(self.typecode, (self.changes[number] for number in run))
+
+                if sys.byteorder == "big":
+                    values.byteswap()
+
+                window_file.seek(WINDOW_STAMP.size + run[0] * 8)
+                window_file.write(values.tobytes())
+
+        self.changes = {}
+
+# Returns a state with its window as a list (see "Windows"), e.g. to move it
+# into another store
+def detach_window(state):
+    if isinstance(state["window"], WindowFile):
+        return dict(state, window=list(state["window"]))
+
+    return state
+
+# Store
+# A Store is a directory of trackers (config/avg for the avg command), with a
+# "trackers" directory for the tracker files, a "state" directory for their
+# running aggregates, a "locks" directory for their lock files, "times" and
+# "index" directories for range queries (see "Time ranges") and a "windows"
+# directory for the windows of average modes (see "Windows"). It can be
+# used from other Python programs to record values without starting a new avg
+# process every time:
+#
+#   store = Store(f"{os.environ['HOME']}/.config/avg")
+#   store.create("latency")
+#   store.tracker("latency").push([12.5, 13])
+#   store.tracker("latency").get("average")
+#
+# Nothing here prints or exits; errors raise AvgError.
+#
+# With cache=True, headers and states are kept in memory (like "avg serve"
+# does), so nothing else may change the trackers while the store is in use.
+class Store:
+    def __init__(self, directory, cache=False):
+        self.directory = directory
+
+        # Create the directories that don't exist yet
+        for subdirectory in ["trackers", "state", "locks", "times", "index", "summaries", "tags", "windows"]:
+            if not os.path.isdir(f"{directory}/{subdirectory}"):
+                os.makedirs(f"{directory}/{subdirectory}", exist_ok=True)
+
+        # tracker_cache maps every tracker name to its header (see
+        #   read_tracker), or to None if it hasn't been loaded yet.
+        #   state_cache maps names to states. Without a cache both are None
+        #   and everything is read from disk.
+        self.tracker_cache = None
+        self.state_cache = None
+
+        if cache:
+            self.tracker_cache = dict.fromkeys(os.listdir(f"{directory}/trackers"))
+            self.state_cache = {}
+
+    # Tracker files don't stay open, but a database does (see SQLiteStore)
+    def close(self):
+        pass
+
+    def tracker_path(self, name):
+        return f"{self.directory}/trackers/{name}"
+
+    def state_path(self, name):
+        return f"{self.directory}/state/{name}"
+
+    def window_path(self, name):
+        return f"{self.directory}/windows/{name}"
+
+    def names(self):
+        if self.tracker_cache is not None:
+            return list(self.tracker_cache)
+
+        return os.listdir(f"{self.directory}/trackers")
+
+    def exists(self, name):
+        if self.tracker_cache is not None:
+            return name in self.tracker_cache
+
+        return name in os.listdir(f"{self.directory}/trackers")
+
+    # Returns True if the config file asks "avg list" to show the ETA of date
+    # trackers instead of their average
+    def read_config(self):
+        if os.path.isfile(f"{self.directory}/config"):
+            with open(f"{self.directory}/config", "r") as config_file:
+                if "ETA\n" in config_file.readlines():
+                    return True
+
+        return False
+
+    # Returns the tracker called name
+    def tracker(self, name):
+        if not self.exists(name):
+            raise AvgError(f"Tracker with name '{name}' does not exist.")
+
+        return Tracker(self, name)
+
+    # Creates a tracker and returns it
+    # tracker_type is "normal" or "date", mode is an average mode (see
+    #   "Average modes"), or None to average every entry, tags are the tags of
+    #   the tracker for group queries (see "Groups") and unit is MILLISECONDS
+    #   for a date tracker in milliseconds (see "Dates")
+    def create(self, name, description=None, tracker_type="normal", mode=None, tags=(), unit=1):
+        self.check_new_tracker(name, tracker_type, mode, tags, unit)
+
+        if description is None:
+            description = "This tracker does not have a description."
+
+        with self.lock(name):
+            # "x" fails if another process made the tracker in the meantime
+            try:
+                tracker_file = open(self.tracker_path(name), "x")
+
+            except FileExistsError:
+                raise AvgError(f"Tracker with name '{name}' already exists.")
+
+            with tracker_file:
+                average = "0".ljust(AVERAGE_WIDTH)
+
+                if tracker_type == "date":
+                    tracker_file.write(f"{description}\n{average}\ndate\n")
+
+                else:
+                    tracker_file.write(f"{description}\n{average}\n")
+
+            self.write_state(name, new_state(mode, unit))
+            self.write_tags(name, tags)
+            self.invalidate_tracker(name)
+
+        return Tracker(self, name)
+
+    # Makes sure a tracker can be created with these arguments
+    def check_new_tracker(self, name, tracker_type, mode, tags, unit):
+        if self.exists(name):
+            raise AvgError(f"Tracker with name '{name}' already exists.")
+
+        if tracker_type not in ["normal", "date"]:
+            raise AvgError(f"No such tracker type, '{tracker_type}'.")
+
+        if mode is not None and mode["type"] == "time" and tracker_type != "date":
+            raise AvgError("--window-time can only be used with date trackers.")
+
+        if unit != 1 and tracker_type != "date":
+            raise AvgError("--milliseconds can only be used with date trackers.")
+
+        # Tags are directory names
+        for tag in tags:
+            if tag in ["", ".", ".."] or "/" in tag:
+                raise AvgError(f"'{tag}' can't be used as a tag.")
+
+    def delete(self, name):
+        with self.lock(name):
+            # Removes the tracker file
+            try:
+                os.remove(self.tracker_path(name))
+
+            # Tracker does not exist
+            except FileNotFoundError:
+                raise AvgError(f"There is no such tracker '{name}'.")
+
+            # Removes the state, times, index, summary and window files, if the
+            #   tracker has them
+            for path in [self.state_path(name), self.times_path(name), self.index_path(name), self.summary_path(name), self.window_path(name)]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+            self.write_tags(name, [])
+            self.forget_tracker(name)
+
+    # Returns the header of every tracker (see read_tracker), with its "name"
+    # jobs is the number of trackers that are read at the same time; by
+    #   default, that's decided by concurrent.futures
+    def list(self, jobs=None):
+        return map_in_parallel(lambda name: dict(self.read_tracker(name), name=name), self.names(), jobs)
+
+    # Returns one attribute of each of the trackers called names, in the same
+    # order, as the strings "avg get" prints (see Tracker.get)
+    def get(self, attribute, names, jobs=None, since=None, until=None):
+        if attribute not in ATTRIBUTES:
+            raise AvgError(f"No such attribute, '{attribute}'.")
+
+        existing_names = set(self.names())
+
+        for name in names:
+            if name not in existing_names:
+                raise AvgError(f"Tracker with name '{name}' does not exist.")
+
+        return map_in_parallel(lambda name: Tracker(self, name).get(attribute, since, until), names, jobs)
+
+    # Groups (see "Groups")
+
+    def read_tags(self, name):
+        return sorted(tag for tag in os.listdir(f"{self.directory}/tags") if os.path.exists(f"{self.directory}/tags/{tag}/{name}"))
+
+    # Replaces the tags of a tracker
+    def write_tags(self, name, tags):
+        for tag in os.listdir(f"{self.directory}/tags"):
+            if tag not in tags:
+                try:
+                    os.remove(f"{self.directory}/tags/{tag}/{name}")
+                except FileNotFoundError:
+                    pass
+
+        for tag in tags:
+            os.makedirs(f"{self.directory}/tags/{tag}", exist_ok=True)
+            open(f"{self.directory}/tags/{tag}/{name}", "w").close()
+
+    # Returns the names of the trackers with a tag
+    def tagged(self, tag):
+        try:
+            tagged = os.listdir(f"{self.directory}/tags/{tag}")
+        except FileNotFoundError:
+            return []
+
+        # A tracker could have been deleted after its tags were listed
+        names = set(self.names())
+
+        return [name for name in tagged if name in names]
+
+    # Returns the names of the trackers in a group: the ones whose names match
+    # pattern (a glob, or None for every tracker) and that have tag (unless
+    # it's None), sorted
+    def group(self, pattern=None, tag=None):
+        import fnmatch
+
+        names = self.names() if tag is None else self.tagged(tag)
+
+        if pattern is not None:
+            names = fnmatch.filter(names, pattern)
+
+        if not names:
+            tagged = "" if tag is None else f" tagged '{tag}'"
+            raise AvgError(f"No trackers{tagged} match '{pattern or '*'}'.")
+
+        return sorted(names)
+
+    # Returns the type and state of each of the trackers called names
+    def read_states(self, names, jobs=None):
+        return map_in_parallel(lambda name: (self.read_tracker_type(name), self.load_state(name)), names, jobs)
+
+    # Returns one of RANGE_ATTRIBUTES of a group of trackers (see Store.group)
+    # taken together, as the string "avg get" prints
+    # With since or until (see Tracker.range), only the entries from that range
+    #   of times are read; otherwise only the states are.
+    def get_group(self, attribute, pattern=None, tag=None, jobs=None, since=None, until=None):
+        if attribute not in RANGE_ATTRIBUTES:
+            raise AvgError(f"The {attribute} of a group of trackers isn't available.")
+
+        names = self.group(pattern, tag)
+
+        if since is None and until is None:
+            members = self.read_states(names, jobs)
+
+        else:
+            def read_range_state(name):
+                tracker_type = self.read_tracker_type(name)
+                unit = self.read_unit(name) if tracker_type == "date" else 1
+
+                return tracker_type, state_from_values(tracker_type, Tracker(self, name).range(since, until), unit=unit)
+
+            members = map_in_parallel(read_range_state, names, jobs)
+
+        types = {tracker_type for tracker_type, state in members}
+
+        if len(types) > 1:
+            raise AvgError("A group can't have both normal and date trackers.")
+
+        tracker_type = types.pop()
+        states = [state for tracker_type, state in members]
+
+        if attribute == "count":
+            return f"{sum(state['count'] for state in states)}"
+
+        if attribute == "average":
+            average = merged_average(states, tracker_type)
+            return "0" if average is None else f"{average}"
+
+        merged = merge_statistics(states)
+
+        return format_statistic(state_statistic(merged, attribute), tracker_type, state_unit(merged))
+
+    # Returns "binary" or "text"
+    def tracker_format(self, name):
+        with open(self.tracker_path(name), "rb") as tracker_file:
+            if tracker_file.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+                return "binary"
+
+            return "text"
+    # Returns what the read commands need to know about a tracker:
+    # its description, average (as it's written in the file), type, number of
+    # entries and last entry
+    def read_tracker(self, name):
+        if self.tracker_cache is not None and self.tracker_cache.get(name) is not None:
+            return self.tracker_cache[name]
+
+        if self.tracker_format(name) == "binary":
+            with open(self.tracker_path(name), "rb") as tracker_file:
+                binary_header = read_binary_header(tracker_file)
+
+                last = None
+                if binary_header["count"] > 0:
+                    tracker_file.seek(-8, os.SEEK_END)
+                    last = array.array(BINARY_TYPECODES[binary_header["type"]], tracker_file.read(8))
+                    if sys.byteorder == "big":
+                        last.byteswap()
+                    last = last[0]
+
+            ETA = None
+
+            if binary_header["type"] == "date":
+                ETA = estimate_ETA(binary_header["count"], None if last is None else last // binary_header["unit"], format_binary_average(binary_header))
+
+            if last is not None and binary_header["type"] == "date":
+                last = epoch_to_date(last, binary_header["unit"])
+            elif last is not None:
+                last = f"{last}"
+
+            header = {
+                "description": binary_header["description"],
+                "average": format_binary_average(binary_header),
+                "type": binary_header["type"],
+                "count": binary_header["count"],
+                "last": last,
+                "ETA": ETA
+            }
+
+        # Text trackers: only the first three lines and the last line are read
+        # The number of entries comes from the state file; trackers from older
+        #   versions without one are read completely
+        else:
+            state = self.read_state(name)
+
+            with open(self.tracker_path(name), "rb") as tracker_file:
+                if state is None:
+                    tracker_lines = tracker_file.read().decode().splitlines()
+                else:
+                    tracker_lines = [tracker_file.readline().decode() for line in range(3)]
+
+                if len(tracker_lines) > 2 and tracker_lines[2].strip() == "date":
+                    tracker_type = "date"
+                else:
+                    tracker_type = "normal"
+
+                if state is None:
+                    count = len(tracker_lines) - (3 if tracker_type == "date" else 2)
+                    last = tracker_lines[-1] if count > 0 else None
+
+                    summary = self.read_summary(name)
+                    if summary is not None:
+                        count += summary["compacted"]
+                else:
+                    count = state["count"]
+                    last = read_last_line(tracker_file) if count > 0 else None
+
+            header = {
+                "description": tracker_lines[0].strip(),
+                "average": tracker_lines[1].strip(),
+                "type": tracker_type,
+                "count": count,
+                "last": None if last is None else last.strip(),
+                "ETA": None
+            }
+
+            # The state has the last date as a number already
+            if tracker_type == "date":
+                if state is not None:
+                    last_epoch = None if state["last"] is None else state["last"] // state_unit(state)
+                elif count > 1:
+                    last_epoch = date_to_epoch(header["last"])
+                else:
+                    last_epoch = None
+
+                header["ETA"] = estimate_ETA(count, last_epoch, header["average"])
+
+        if self.tracker_cache is not None:
+            self.tracker_cache[name] = header
+
+        return header
+
+    # Updates the cached header of a tracker after a push
+    def update_cached_tracker(self, name, state, last, average):
+        if self.tracker_cache is None or self.tracker_cache.get(name) is None:
+            return
+
+        header = self.tracker_cache[name]
+        header["count"] = state["count"]
+        header["last"] = last
+
+        if average is not None:
+            header["average"] = f"{average}"
+
+        if header["type"] == "date":
+            header["ETA"] = estimate_ETA(state["count"], state["last"] // state_unit(state), header["average"])
+
+    # Makes the daemon reload a tracker from disk the next time it's needed
+    def invalidate_tracker(self, name):
+        if self.tracker_cache is not None:
+            self.tracker_cache[name] = None
+            self.state_cache.pop(name, None)
+
+    # Removes a deleted tracker from the daemon cache
+    def forget_tracker(self, name):
+        if self.tracker_cache is not None:
+            self.tracker_cache.pop(name, None)
+            self.state_cache.pop(name, None)
+
+    def read_state(self, name):
+        if self.state_cache is not None and name in self.state_cache:
+            return self.state_cache[name]
+
+        import json
+
+        try:
+            with open(self.state_path(name), "r") as state_file:
+                state = json.load(state_file)
+
+        # Trackers made by older versions of kvrg-avg don't have a state file
+        except (FileNotFoundError, ValueError):
+            return None
+
+        add_count("states_read")
+
+        if state.get("version") != STATE_VERSION:
+            return None
+
+        # The window is in its own file (see "Windows")
+        if isinstance(state["window"], dict):
+            state["window"] = self.open_window(name, **state["window"])
+
+        if self.state_cache is not None:
+            self.state_cache[name] = state
+
+        return state
+
+    # Returns the window of a tracker's state (see "Windows")
+    def open_window(self, name, typecode, stamp=None, start=0, length=0):
+        return WindowFile(self.window_path(name), typecode, stamp, start, length)
+
+    # Saves the window of a state (see "Windows"), and returns the state the way
+    # it's saved, with the descriptor of the window in its place
+    # A window that's still a list (from a state that was just built, or from an
+    #   older version) gets a window file.
+    def save_window(self, name, state):
+        window = state["window"]
+
+        if state["mode"] is None or state["mode"]["type"] not in WINDOW_MODES:
+            return state
+
+        if not isinstance(window, WindowFile):
+            date_window = state["mode"]["type"] == "time" or self.read_tracker_type(name) == "date"
+
+            state["window"] = self.open_window(name, "q" if date_window else "d")
+            state["window"].replace(window)
+            window = state["window"]
+
+        window.save(self.write_file_atomically)
+
+        return dict(state, window=window.descriptor())
+
+    # Returns the average mode of a tracker, even if its state is out of date
+    # The mode is the only part of the state that can't be rebuilt from entries
+    def read_mode(self, name):
+        import json
+
+        try:
+            with open(self.state_path(name), "r") as state_file:
+                return json.load(state_file).get("mode")
+
+        except (FileNotFoundError, ValueError):
+            return None
+
+    # Returns the unit of the dates of a date tracker (see state_unit), even if
+    #   its state is out of date
+    # Binary trackers have it in their header. Like the mode, it can't be rebuilt
+    #   from the entries of a text tracker.
+    def read_unit(self, name):
+        import json
+
+        if self.tracker_format(name) == "binary":
+            with open(self.tracker_path(name), "rb") as tracker_file:
+                return read_binary_header(tracker_file)["unit"]
+
+        try:
+            with open(self.state_path(name), "r") as state_file:
+                return state_unit(json.load(state_file))
+
+        except (FileNotFoundError, ValueError):
+            return 1
+
+    # Saves the state of a tracker
+    # The state also records the size of the tracker file it describes. Entries
+    #   are only ever appended to tracker files, so if a push was interrupted
+    #   after appending, the entries after that size are the ones the state is
+    #   missing (see load_state).
+    # size is the size of the tracker file, if it's about to change (see
+    #   replace_later_entries).
+    def write_state(self, name, state, size=None):
+        import json
+
+        state["size"] = os.path.getsize(self.tracker_path(name)) if size is None else size
+        add_count("states_written")
+
+        self.write_file_atomically(self.state_path(name), json.dumps(self.save_window(name, state)).encode())
+
+        if self.state_cache is not None:
+            self.state_cache[name] = state
+
+    # Crash safety
+    # Files that are rewritten (states, converted trackers, text trackers getting
+    # a padded average line) are written to a temporary file in config/avg first,
+    # which then replaces the real file. A crash leaves either the old file or the
+    # new one, never a truncated one. The temporary file isn't fsync'ed: if the
+    # system loses power and a state file comes back empty, it's rebuilt from the
+    # tracker file.
+    # Temporary files are named after the process and a counter, and created
+    #   with O_EXCL like tempfile.mkstemp does (importing tempfile takes longer
+    #   than a push)
+    def write_file_atomically(self, path, data):
+        while True:
+            temporary_path = f"{self.directory}/.tmp-{os.getpid()}-{next(temporary_counter)}"
+
+            try:
+                temporary_descriptor = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+                break
+
+            # Left behind by an earlier process with the same ID
+            except FileExistsError:
+                continue
+
+        try:
+            with os.fdopen(temporary_descriptor, "wb") as temporary_file:
+                temporary_file.write(data)
+
+            os.replace(temporary_path, path)
+
+        except BaseException:
+            os.remove(temporary_path)
+            raise
+
+    # Every command that changes a tracker holds an exclusive flock on its file
+    # in config/avg/locks, so that two pushes (e.g. from parallel cron jobs) can't
+    # interleave and lose entries. Commands that only read don't lock.
+    # Use it as "with store.lock(name):"
+    def lock(self, name):
+        return TrackerLock(f"{self.directory}/locks/{name}")
+
+    # Reads only the start of a tracker file to find its type
+    def read_tracker_type(self, name):
+        if self.tracker_cache is not None:
+            return self.read_tracker(name)["type"]
+
+        with open(self.tracker_path(name), "rb") as tracker_file:
+            if tracker_file.read(len(BINARY_MAGIC)) == BINARY_MAGIC:
+                return read_binary_header(tracker_file)["type"]
+
+            tracker_file.seek(0)
+            tracker_file.readline()
+            tracker_file.readline()
+
+            if tracker_file.readline().strip() == b"date":
+                return "date"
+
+            return "normal"
+
+    # Writes the average into the second line of a text tracker file
+    # If the line already has the padded width, only those bytes are overwritten.
+    # Otherwise (a file from an older version, or a very long average), the file
+    # is rewritten once with the padded line.
+    def write_average(self, name, average):
+        line = f"{average}".ljust(AVERAGE_WIDTH) + "\n"
+        line = line.encode()
+
+        with open(self.tracker_path(name), "r+b") as tracker_file:
+            description = tracker_file.readline()
+            current = tracker_file.readline()
+
+            if len(current) == len(line) == AVERAGE_WIDTH + 1:
+                tracker_file.seek(len(description))
+                tracker_file.write(line)
+                return
+
+            rest = tracker_file.read()
+
+        self.write_file_atomically(self.tracker_path(name), description + line + rest)
+
+        # Every entry moved
+        self.remove_index(name)
+
+    # Writes the average of a tracker after its state changed
+    # Text trackers only store the average; binary trackers store the whole state
+    #   in their header
+    # A text date tracker keeps its old average if it has fewer than two entries
+    def write_header(self, name, tracker_type, state):
+        if self.tracker_format(name) == "binary":
+            with open(self.tracker_path(name), "r+b") as tracker_file:
+                description = read_binary_header(tracker_file)["description"]
+
+                tracker_file.seek(0)
+                tracker_file.write(pack_binary_header(tracker_type, description, state))
+            return
+
+        average = state_average(state, tracker_type)
+        if average is not None:
+            self.write_average(name, average)
+
+    # Appends entries (the pushed values as they're written to text trackers) to
+    # a tracker file with a single write
+    # values are the same entries as numbers (floats or epochs), for binary
+    #   trackers and the index.
+    # count is the number of entries the tracker had before. The times (normal
+    #   trackers) and index (text trackers) of the new entries are recorded too.
+    def append_entries(self, name, tracker_type, entries, values, count):
+        times = None
+        if tracker_type == "normal":
+            times = self.append_times(name, count, len(entries))
+
+        if self.tracker_format(name) == "binary":
+            values = array.array(BINARY_TYPECODES[tracker_type], values)
+
+            if sys.byteorder == "big":
+                values.byteswap()
+
+            with open(self.tracker_path(name), "ab") as tracker_file:
+                tracker_file.write(values.tobytes())
+            return
+
+        data = "".join(f"{entry}\n" for entry in entries).encode()
+
+        with open(self.tracker_path(name), "ab") as tracker_file:
+            offset = tracker_file.seek(0, os.SEEK_END)
+            tracker_file.write(data)
+
+        self.append_index(name, tracker_type, values, count, offset, times, data)
+
+    # Returns every entry of a tracker as numbers: floats for normal trackers and
+    # seconds since the epoch for date trackers
+    # Binary trackers are memory-mapped and copied into an array in one go
+    def read_values(self, name, tracker_type):
+        path = self.tracker_path(name)
+
+        if self.tracker_format(name) == "binary":
+            values = array.array(BINARY_TYPECODES[tracker_type])
+
+            if os.path.getsize(path) > BINARY_HEADER_SIZE:
+                with open(path, "rb") as tracker_file:
+                    with mmap.mmap(tracker_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        values.frombytes(memoryview(mapped)[BINARY_HEADER_SIZE:])
+
+            if sys.byteorder == "big":
+                values.byteswap()
+
+            add_count("entries_read", len(values))
+
+            return values
+
+        with open(path, "r") as tracker_file:
+            lines = tracker_file.read().split("\n")
+
+        # Entries start on the third line of normal trackers and the fourth
+        #   line of date trackers
+        lines = [line.strip() for line in lines[3 if tracker_type == "date" else 2:]]
+        lines = [line for line in lines if line]
+
+        add_count("entries_read", len(lines))
+        add_count("lines_parsed", len(lines))
+
+        # Every line is parsed exactly once
+        if tracker_type == "normal":
+            return array.array("d", map(float, lines))
+
+        return dates_to_epochs(lines, self.read_unit(name))
+    # Time ranges (see "Time ranges")
+
+    def times_path(self, name):
+        return f"{self.directory}/times/{name}"
+
+    def index_path(self, name):
+        return f"{self.directory}/index/{name}"
+
+    # Makes the next range query rebuild the index of a tracker, after its
+    # entries moved
+    def remove_index(self, name):
+        try:
+            os.remove(self.index_path(name))
+        except FileNotFoundError:
+            pass
+
+    # Records the time of number new values of a normal tracker that has count
+    # entries, and returns those times
+    # Entries that are missing a time (values pushed by older versions, or a
+    #   push that was interrupted) get the last recorded time, or 0. Times never
+    #   decrease, even if the clock goes back.
+    # This must only be called while holding the tracker's lock
+    def append_times(self, name, count, number):
+        with open(self.times_path(name), "a+b") as times_file:
+            recorded = times_file.seek(0, os.SEEK_END) // 8
+
+            last = 0
+            if recorded > 0:
+                times_file.seek((min(recorded, count) - 1) * 8)
+                last = read_packed(times_file.read(8), 0)
+
+            if recorded > count:
+                times_file.truncate(count * 8)
+
+            now = max(local_time(), last)
+            times = array.array("q", [last] * (count - recorded) + [now] * number)
+            new_times = times[len(times) - number:]
+
+            if sys.byteorder == "big":
+                times.byteswap()
+
+            times_file.write(times.tobytes())
+
+        return new_times
+
+    # Returns the times of entries first .. last - 1 of a normal tracker with
+    # count entries, filling in missing ones like append_times does
+    def read_times(self, name, count, first=0, last=None):
+        last = count if last is None else last
+        times = array.array("q")
+        recorded = 0
+
+        if last <= first:
+            return times
+
+        try:
+            with open(self.times_path(name), "rb") as times_file:
+                recorded = min(times_file.seek(0, os.SEEK_END) // 8, count)
+
+                # If the range starts after the recorded times, only the last
+                #   one is read, for the filling
+                if recorded > 0:
+                    start = min(first, recorded - 1)
+
+                    times_file.seek(start * 8)
+                    times.frombytes(times_file.read((max(min(last, recorded), start + 1) - start) * 8))
+
+        except FileNotFoundError:
+            pass
+
+        if sys.byteorder == "big":
+            times.byteswap()
+
+        filling = times[-1] if times else 0
+
+        if first >= recorded:
+            del times[:]
+
+        times.extend([filling] * (last - first - len(times)))
+
+        return times
+
+    # Finds the first and last entries of a normal tracker with count entries
+    # that were pushed from since to until
+    def search_times(self, name, count, since, until):
+        try:
+            times_file = open(self.times_path(name), "rb")
+
+        except FileNotFoundError:
+            return count, count
+
+        with times_file:
+            recorded = min(os.fstat(times_file.fileno()).st_size // 8, count)
+
+            # Without any times, every entry has a time of 0
+            if recorded == 0:
+                return count, count
+
+            with mmap.mmap(times_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                # Entries without a time of their own have the last one
+                key_at = lambda number: read_packed(mapped, min(number, recorded - 1) * 8)
+
+                return search_sorted(count, key_at, since), search_sorted(count, key_at, until, right=True)
+
+    # Returns the sparse index of a text tracker with count entries, as
+    # packed INDEX_RECORDs, building it first if it doesn't match the tracker
+    def read_index(self, name, tracker_type, count):
+        records = (count + INDEX_INTERVAL - 1) // INDEX_INTERVAL
+
+        try:
+            with open(self.index_path(name), "rb") as index_file:
+                index = index_file.read()
+
+            if len(index) == records * INDEX_RECORD.size:
+                return index
+
+        except FileNotFoundError:
+            pass
+
+        with self.lock(name):
+            times = self.read_times(name, count) if tracker_type == "normal" else None
+            unit = self.read_unit(name) if tracker_type == "date" else 1
+            index = bytearray()
+            number = 0
+
+            with open(self.tracker_path(name), "rb") as tracker_file:
+                # Skip the header lines
+                for line in range(3 if tracker_type == "date" else 2):
+                    tracker_file.readline()
+
+                offset = tracker_file.tell()
+
+                for line in tracker_file:
+                    if line.strip():
+                        if number % INDEX_INTERVAL == 0:
+                            moment = date_to_epoch(line.decode().strip(), unit) if times is None else times[min(number, count - 1)]
+                            index += INDEX_RECORD.pack(moment, offset)
+
+                        number += 1
+
+                    offset += len(line)
+
+            self.write_file_atomically(self.index_path(name), bytes(index))
+
+        return bytes(index)
+
+    # Adds the new entries of a text tracker to its index
+    # entries (the lines of data) start at byte offset of the tracker file,
+    #   and the tracker had count entries before them. An index that doesn't
+    #   match the tracker is left alone for read_index to rebuild.
+    def append_index(self, name, tracker_type, values, count, offset, times, data):
+        try:
+            if os.path.getsize(self.index_path(name)) != (count + INDEX_INTERVAL - 1) // INDEX_INTERVAL * INDEX_RECORD.size:
+                return
+
+        except FileNotFoundError:
+            if count > 0:
+                return
+
+        # Only every INDEX_INTERVAL-th entry is indexed
+        numbers = range(-count % INDEX_INTERVAL, len(values), INDEX_INTERVAL)
+
+        if not numbers:
+            return
+
+        # Entry number starts after the lengths of the entries before it, and
+        #   one newline for each of them
+        lengths = list(itertools.accumulate(map(len, data.split(b"\n")), initial=offset))
+        records = bytearray()
+
+        for number in numbers:
+            moment = values[number] if tracker_type == "date" else times[number]
+            records += INDEX_RECORD.pack(moment, lengths[number] + number)
+
+        if records:
+            with open(self.index_path(name), "ab") as index_file:
+                index_file.write(records)
+
+    # Returns entries first .. last - 1 of a tracker as numbers (like
+    # read_values)
+    def read_entries(self, name, tracker_type, first, last, count):
+        values = array.array(BINARY_TYPECODES[tracker_type])
+
+        if last <= first:
+            return values
+
+        if self.tracker_format(name) == "binary":
+            with open(self.tracker_path(name), "rb") as tracker_file:
+                tracker_file.seek(BINARY_HEADER_SIZE + first * 8)
+                values.frombytes(tracker_file.read((last - first) * 8))
+
+            if sys.byteorder == "big":
+                values.byteswap()
+
+            return values
+
+        # Start from the closest indexed entry
+        index = self.read_index(name, tracker_type, count)
+        moment, offset = INDEX_RECORD.unpack_from(index, first // INDEX_INTERVAL * INDEX_RECORD.size)
+        number = first // INDEX_INTERVAL * INDEX_INTERVAL
+
+        lines = []
+
+        with open(self.tracker_path(name), "rb") as tracker_file:
+            tracker_file.seek(offset)
+
+            for line in tracker_file:
+                line = line.strip()
+
+                if not line:
+                    continue
+
+                if number >= first:
+                    lines.append(line.decode())
+
+                number += 1
+
+                if number == last:
+                    break
+
+        add_count("lines_parsed", len(lines))
+
+        if tracker_type == "normal":
+            values.extend(map(float, lines))
+            return values
+
+        return dates_to_epochs(lines, self.read_unit(name))
+
+    # Returns the times and values of the entries of a tracker from since to
+    # until (seconds since the epoch, both included; None for no limit), as
+    # two arrays
+    def read_range(self, name, tracker_type, since=None, until=None):
+        since = 1 if since is None else max(since, 1)
+        until = END_OF_TIME if until is None else until
+
+        count = stored_count(self.load_state(name))
+
+        if count == 0:
+            return array.array("q"), array.array(BINARY_TYPECODES[tracker_type])
+
+        # The values of normal trackers are found by their times
+        if tracker_type == "normal":
+            first, last = self.search_times(name, count, since, until)
+
+            return self.read_times(name, count, first, last), self.read_entries(name, tracker_type, first, last, count)
+
+        # The entries of binary date trackers are searched in place
+        if self.tracker_format(name) == "binary":
+            with open(self.tracker_path(name), "rb") as tracker_file:
+                with mmap.mmap(tracker_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    key_at = lambda number: read_packed(mapped, BINARY_HEADER_SIZE + number * 8)
+
+                    first = search_sorted(count, key_at, since)
+                    last = search_sorted(count, key_at, until, right=True)
+
+            values = self.read_entries(name, tracker_type, first, last, count)
+            return values, values
+
+        # Text date trackers: the index narrows the range down to
+        #   INDEX_INTERVAL entries on each side
+        index = self.read_index(name, tracker_type, count)
+        records = len(index) // INDEX_RECORD.size
+        key_at = lambda record: read_packed(index, record * INDEX_RECORD.size)
+
+        first = max(search_sorted(records, key_at, since) - 1, 0) * INDEX_INTERVAL
+        last = min(search_sorted(records, key_at, until, right=True) * INDEX_INTERVAL, count)
+
+        values = self.read_entries(name, tracker_type, first, last, count)
+        values = values[search_sorted(len(values), values.__getitem__, since):search_sorted(len(values), values.__getitem__, until, right=True)]
+
+        return values, values
+
+    # Sorted dates (see "Sorted dates")
+
+    # Returns the entries of a date tracker that are later than moment, as
+    # (position, previous, later): the byte offset of the first of them in the
+    # tracker file, the entry before them (None if there isn't one) and their
+    # dates
+    # The file is searched from the end, so this mostly depends on how many
+    #   entries are later than moment.
+    def read_later_entries(self, name, moment):
+        binary = self.tracker_format(name) == "binary"
+
+        with open(self.tracker_path(name), "rb") as tracker_file:
+            if binary:
+                with mmap.mmap(tracker_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    count = (len(mapped) - BINARY_HEADER_SIZE) // 8
+                    key_at = lambda number: read_packed(mapped, BINARY_HEADER_SIZE + number * 8)
+
+                    number = search_sorted(count, key_at, moment, right=True)
+                    position = BINARY_HEADER_SIZE + number * 8
+
+                    previous = key_at(number - 1) if number > 0 else None
+                    later = array.array("q", mapped[position:BINARY_HEADER_SIZE + count * 8])
+
+                if sys.byteorder == "big":
+                    later.byteswap()
+
+                add_count("entries_read", len(later))
+
+                return position, previous, later
+
+            unit = self.read_unit(name)
+
+            # Skip the header lines
+            for line in range(3):
+                tracker_file.readline()
+
+            start = tracker_file.tell()
+            end = tracker_file.seek(0, os.SEEK_END)
+            size = 65536
+
+            # Reads more of the end of the file until it has an entry that's
+            #   not later than moment, or the whole file
+            while True:
+                position = max(start, end - size)
+                tracker_file.seek(position)
+                data = tracker_file.read()
+
+                # The first line may be cut off
+                if position > start:
+                    cut = data.find(b"\n") + 1
+                    position += cut
+                    data = data[cut:]
+
+                entries = data.decode().split()
+                key_at = lambda entry: date_to_epoch(entries[entry], unit)
+
+                entry = search_sorted(len(entries), key_at, moment, right=True)
+
+                if entry > 0 or position == start:
+                    break
+
+                size *= 4
+
+        previous = key_at(entry - 1) if entry > 0 else None
+        later = entries[entry:]
+
+        # The later entries are normally the last lines of the file just as
+        #   they are; otherwise (blank lines or spaces, from editing the file
+        #   by hand) the lines before them are counted one by one
+        tail = "".join(["\n".join(later), "\n"] if later else []).encode()
+
+        if data.endswith(tail):
+            position += len(data) - len(tail)
+
+        else:
+            for line in data.splitlines(keepends=True):
+                if line.strip():
+                    if entry == 0:
+                        break
+                    entry -= 1
+
+                position += len(line)
+
+        add_count("entries_read", len(later))
+        add_count("lines_parsed", len(later))
+
+        return position, previous, dates_to_epochs(later, unit)
+
+    # Replaces the entries of a date tracker from position (see
+    # read_later_entries) on with dates, and saves state as its state
+    # The tracker file is truncated at position and dates are appended, so
+    #   only the entries after position are written. The dates are first saved
+    #   in the state as "pending", with the size that the tracker file is going
+    #   to have: if this is interrupted, repair_tracker writes them again.
+    # This must only be called while holding the tracker's lock
+    def replace_later_entries(self, name, position, dates, state):
+        data = self.date_entries_data(name, dates, state_unit(state))
+
+        state["pending"] = {"position": position, "dates": list(dates)}
+        self.write_state(name, state, position + len(data))
+
+        self.finish_merge(name, state, data)
+
+    # Returns dates (in units, see "Dates") as they're written in a date
+    # tracker file
+    def date_entries_data(self, name, dates, unit):
+        if self.tracker_format(name) == "binary":
+            dates = array.array("q", dates)
+
+            if sys.byteorder == "big":
+                dates.byteswap()
+
+            return dates.tobytes()
+
+        return epochs_to_lines(dates, unit)
+
+    # Writes the pending dates of a merge (see replace_later_entries) in the
+    # tracker file, and saves the state without them
+    # data is the dates as they're written, if the caller already has them.
+    def finish_merge(self, name, state, data=None):
+        merge = state.pop("pending")
+
+        if data is None:
+            data = self.date_entries_data(name, merge["dates"], state_unit(state))
+
+        with open(self.tracker_path(name), "r+b") as tracker_file:
+            tracker_file.truncate(merge["position"])
+            tracker_file.seek(merge["position"])
+            tracker_file.write(data)
+
+        # The entries after position moved
+        self.remove_index(name)
+        self.write_state(name, state)
+
+    # Compaction (see "Compaction")
+
+    def summary_path(self, name):
+        return f"{self.directory}/summaries/{name}"
+
+    # Returns the summary of a tracker, {"compacted": number of entries,
+    # "older_than": the automatic policy, "state": the state of the entries},
+    # or None if it doesn't have one
+    def read_summary(self, name):
+        import json
+
+        try:
+            with open(self.summary_path(name), "rb") as summary_file:
+                return json.loads(summary_file.read())
+
+        except FileNotFoundError:
+            return None
+
+    def write_summary(self, name, summary):
+        import json
+
+        self.write_file_atomically(self.summary_path(name), json.dumps(summary).encode())
+
+    # Computes the state of a tracker from its summary and every entry that's
+    # stored, or values instead of the entries if given
+    def state_from_entries(self, name, tracker_type, mode, values=None):
+        if values is None:
+            values = self.read_values(name, tracker_type)
+
+        summary = self.read_summary(name)
+
+        if summary is None:
+            return state_from_values(tracker_type, values, mode, self.read_unit(name) if tracker_type == "date" else 1)
+
+        state = summary["state"]
+        add_values_to_state(state, tracker_type, values)
+
+        state["compacted"] = summary["compacted"]
+        state["older_than"] = summary["older_than"]
+        state["kept"] = len(values)
+
+        return state
+
+    # Removes the first number stored entries of a tracker, after they were
+    # added to summary, and saves the summary and state
+    # The new tracker file replaces the old one in one step. The new summary is
+    #   first saved in the state as "pending", so that repair_tracker can finish
+    #   the compaction if it's interrupted after that.
+    # This must only be called while holding the tracker's lock
+    def remove_entries(self, name, tracker_type, state, number, summary):
+        if number == 0:
+            self.write_summary(name, summary)
+            self.write_state(name, state)
+            return
+
+        with open(self.tracker_path(name), "rb") as tracker_file:
+            if self.tracker_format(name) == "binary":
+                data = tracker_file.read(BINARY_HEADER_SIZE)
+                tracker_file.seek(BINARY_HEADER_SIZE + number * 8)
+
+            else:
+                data = b"".join(tracker_file.readline() for line in range(3 if tracker_type == "date" else 2))
+                removed = 0
+
+                while removed < number:
+                    removed += bool(tracker_file.readline().strip())
+
+            data += tracker_file.read()
+
+        state["pending"] = {"size": len(data), "summary": summary}
+        self.write_state(name, state)
+
+        self.write_file_atomically(self.tracker_path(name), data)
+        self.finish_compaction(name, state)
+
+    # Saves the summary and state of a compaction once its tracker file was
+    # rewritten, and removes the times of the removed entries
+    def finish_compaction(self, name, state):
+        summary = state.pop("pending")["summary"]
+        count = state["count"] - summary["compacted"]
+
+        # Unless that was done before being interrupted
+        try:
+            with open(self.times_path(name), "rb") as times_file:
+                recorded = times_file.seek(0, os.SEEK_END) // 8
+
+                if recorded > count:
+                    times_file.seek((recorded - count) * 8)
+                    self.write_file_atomically(self.times_path(name), times_file.read())
+
+        except FileNotFoundError:
+            pass
+
+        self.write_summary(name, summary)
+        self.remove_index(name)
+
+        state["compacted"] = summary["compacted"]
+        self.write_state(name, state)
+
+    # Recomputes the state of a tracker from every entry in its file
+    # This is the slow path, used by "avg rebuild" and for trackers that don't
+    # have a state file yet
+    def rebuild_state(self, name):
+        tracker_type = self.read_tracker_type(name)
+        state = self.state_from_entries(name, tracker_type, self.read_mode(name))
+
+        if self.tracker_format(name) == "binary":
+            self.write_header(name, tracker_type, state)
+        else:
+            average = state_average(state, tracker_type)
+            self.write_average(name, 0 if average is None else average)
+
+        # The file may have been edited by hand
+        self.remove_index(name)
+        self.write_state(name, state)
+
+        return state
+
+    # Returns the state of a tracker, without writing anything
+    # Trackers without a (current) state file get one computed from all of their
+    #   entries. If the tracker file grew after the state was saved (a push that
+    #   was interrupted), the entries after the saved size are added to it.
+    def load_state(self, name):
+        state = self.read_state(name)
+        tracker_type = self.read_tracker_type(name)
+
+        if state is None:
+            return self.state_from_entries(name, tracker_type, self.read_mode(name))
+
+        # The window was changed by a push that didn't save its state (see
+        #   "Windows")
+        if isinstance(state["window"], WindowFile) and not state["window"].matches():
+            return self.state_from_entries(name, tracker_type, state["mode"])
+
+        if "size" not in state:
+            return state
+
+        path = self.tracker_path(name)
+        size = os.path.getsize(path)
+
+        # A compaction that isn't finished yet doesn't change the totals (a
+        #   merge does, but its state already has the size the file ends with)
+        if size == state["size"] or size == state.get("pending", {}).get("size"):
+            return state
+
+        # The file was replaced or edited by hand
+        if size < state["size"]:
+            return self.state_from_entries(name, tracker_type, state["mode"])
+
+        with open(path, "rb") as tracker_file:
+            tracker_file.seek(state["size"])
+            tail = tracker_file.read()
+
+        # Only complete entries are added; a partly written one is ignored
+        if self.tracker_format(name) == "binary":
+            tail = tail[:len(tail) - len(tail) % 8]
+            values = array.array(BINARY_TYPECODES[tracker_type], tail)
+
+            if sys.byteorder == "big":
+                values.byteswap()
+
+            for value in values:
+                add_value_to_state(state, tracker_type, value)
+
+        else:
+            tail = tail[:tail.rfind(b"\n") + 1]
+            lines = tail.decode().split()
+            add_count("lines_parsed", len(lines))
+
+            for line in lines:
+                add_to_state(state, tracker_type, line)
+
+        state["size"] += len(tail)
+
+        return state
+
+    # Removes a partly written entry from the end of a tracker file, left behind
+    # if a push was interrupted in the middle of appending
+    # This must only be called while holding the tracker's lock
+    def repair_tracker(self, name):
+        path = self.tracker_path(name)
+        state = self.read_state(name)
+
+        # A merge of dates was interrupted (see "Sorted dates"): write its
+        #   dates again, since the file may have been truncated already
+        if state is not None and "dates" in state.get("pending", {}):
+            self.finish_merge(name, state)
+
+        # A compaction was interrupted: finish it if the tracker file was
+        #   already rewritten, and forget it otherwise
+        elif state is not None and "pending" in state:
+            if os.path.getsize(path) == state["pending"]["size"]:
+                self.finish_compaction(name, state)
+            else:
+                del state["pending"]
+                self.write_state(name, state)
+
+        with open(path, "r+b") as tracker_file:
+            size = tracker_file.seek(0, os.SEEK_END)
+
+            if self.tracker_format(name) == "binary":
+                complete = size - (size - BINARY_HEADER_SIZE) % 8
+
+            else:
+                tracker_file.seek(max(0, size - 4096))
+                data = tracker_file.read()
+                complete = size - len(data) + data.rfind(b"\n") + 1
+
+                # No newline in the last 4096 bytes; leave the file alone
+                if data.rfind(b"\n") == -1:
+                    complete = size
+
+            if complete < size:
+                tracker_file.truncate(complete)
+
+    # Adds a tracker with all of its entries at once, for "avg import" and
+    # "avg migrate"
+    # values are numbers, like the ones read_values returns, and times are the
+    #   times of the entries (see "Time ranges"). The tracker file is written in
+    #   tracker_format, "text" or "binary".
+    # This must only be called while holding the tracker's lock
+    def import_tracker(self, name, header, values, state, times, summary=None, tags=(), tracker_format="text"):
+        tracker_type = header["type"]
+
+        if tracker_format == "binary" and len(header["description"].encode()) <= BINARY_DESCRIPTION_SIZE:
+            packed = array.array(BINARY_TYPECODES[tracker_type], values)
+
+            if sys.byteorder == "big":
+                packed.byteswap()
+
+            data = pack_binary_header(tracker_type, header["description"], state) + packed.tobytes()
+
+        else:
+            data = text_tracker_data(tracker_type, header["description"], values, state)
+
+        self.write_file_atomically(self.tracker_path(name), data)
+        self.write_state(name, state)
+        self.remove_index(name)
+
+        if summary is not None:
+            self.write_summary(name, summary)
+        elif os.path.exists(self.summary_path(name)):
+            os.remove(self.summary_path(name))
+
+        self.write_tags(name, tags)
+
+        if tracker_type == "normal":
+            times = array.array("q", times)
+
+            if sys.byteorder == "big":
+                times.byteswap()
+
+            self.write_file_atomically(self.times_path(name), times.tobytes())
+
+        self.invalidate_tracker(name)
+
+# Tracker
+# One tracker of a Store. Use Store.tracker or Store.create to get one.
+class Tracker:
+    def __init__(self, store, name):
+        self.store = store
+        self.name = name
+
+    # Adds values to the tracker
+    # Every value is checked before any of them are added
+    # With unique, dates that the date tracker already has are skipped (see
+    #   "Sorted dates").
+    def push(self, values, unique=False):
+        values = list(values)
+
+        if not values:
+            return
+
+        store = self.store
+        tracker_type = store.read_tracker_type(self.name)
+
+        if unique and tracker_type != "date":
+            raise AvgError(f"Tracker '{self.name}' is not a date tracker.")
+
+        unit = store.read_unit(self.name) if tracker_type == "date" else 1
+
+        numbers = check_values(tracker_type, values, unit)
+        end_phase("push: check")
+
+        # Only one process can change the tracker at a time
+        with store.lock(self.name):
+            end_phase("push: lock")
+
+            # Load the running aggregates
+            store.repair_tracker(self.name)
+            state = store.load_state(self.name)
+            end_phase("push: state")
+
+            # Build the new entries
+            count = stored_count(state)
+            entries = [format_entry(tracker_type, argument, number, unit) for argument, number in zip(values, numbers)]
+
+            if tracker_type == "date":
+                numbers, entries = sort_dates(numbers, entries, unique)
+
+            # Dates earlier than the last entry are merged into the entries
+            if tracker_type == "date" and state["last"] is not None and numbers[0] < state["last"]:
+                state = self.merge_dates(state, numbers, unique)
+                end_phase("push: merge")
+
+                if state is None:
+                    return
+
+                last = epoch_to_date(state["last"], unit)
+
+            else:
+                if unique and numbers[0] == state["last"]:
+                    numbers, entries = numbers[1:], entries[1:]
+
+                    if not numbers:
+                        return
+
+                add_values_to_state(state, tracker_type, numbers)
+                end_phase("push: aggregate")
+
+                # Appends values to tracker file, all in a single write
+                store.append_entries(self.name, tracker_type, entries, numbers, count)
+                end_phase("push: append")
+
+                last = entries[-1]
+
+            # Update average
+            # Only the state file and the second line of the tracker file are written,
+            #   so this doesn't depend on how many entries the tracker has
+            # A date tracker needs at least two entries to have an average interval,
+            #   because intervals = entries - 1
+            store.write_header(self.name, tracker_type, state)
+
+            # The state is written last: if push is interrupted before this, the next
+            #   one adds the entries that were already appended (see load_state)
+            store.write_state(self.name, state)
+            end_phase("push: write")
+
+            store.update_cached_tracker(self.name, state, last, state_average(state, tracker_type))
+
+            # Automatic compaction (see "Compaction")
+            if state.get("older_than") is not None and stored_count(state) >= max(2 * state.get("kept", 0), COMPACT_MINIMUM):
+                self.fold(state, state["older_than"])
+
+    # Merges sorted dates that start before the last entry into the entries of
+    # the tracker (see "Sorted dates"), and returns the new state, or None if
+    # unique left no dates to add
+    # This must only be called while holding the tracker's lock
+    def merge_dates(self, state, dates, unique):
+        store = self.store
+        position, previous, later = store.read_later_entries(self.name, dates[0])
+
+        # The first stored entry comes right after the compacted ones
+        if previous is None and state.get("compacted", 0) > 0:
+            previous = store.read_summary(self.name)["state"]["last"]
+
+            if dates[0] < previous:
+                raise AvgError(f"Value '{epoch_to_date(dates[0], state_unit(state))}' is older than the compacted entries of '{self.name}'.")
+
+        if unique:
+            existing = set(later)
+            existing.add(previous)
+
+            dates = [date for date in dates if date not in existing]
+
+            if not dates:
+                return None
+
+        # Both are sorted, and timsort merges two sorted runs in linear time
+        merged = sorted(itertools.chain(later, dates))
+
+        if not merge_into_state(state, previous, later, dates, merged, lambda: self.earlier_max(len(later))):
+            values = store.read_values(self.name, "date")
+            values = values[:len(values) - len(later)] + array.array("q", merged)
+
+            state = store.state_from_entries(self.name, "date", state["mode"], values)
+
+        store.replace_later_entries(self.name, position, merged, state)
+
+        return state
+
+    # Returns the largest interval of a date tracker before its last later_count
+    # stored entries, and how many intervals are equal to it, or (None, 0) (see
+    # merge_into_state)
+    # The compacted intervals are known from the summary.
+    def earlier_max(self, later_count):
+        store = self.store
+        values = store.read_values(self.name, "date")
+        values = values[:len(values) - later_count]
+
+        intervals = list(map(operator.sub, values[1:], values[:-1]))
+        summary = store.read_summary(self.name)
+
+        if summary is not None and summary["state"]["last"] is not None and values:
+            intervals.append(values[0] - summary["state"]["last"])
+
+        maximum = max(intervals, default=None)
+        count = intervals.count(maximum)
+
+        # States from before max_count was kept count their max once
+        if summary is not None and summary["state"]["max"] is not None:
+            compacted_max = summary["state"]["max"]
+
+            if maximum is None or compacted_max > maximum:
+                maximum, count = compacted_max, summary["state"].get("max_count", 1)
+            elif compacted_max == maximum:
+                count += summary["state"].get("max_count", 1)
+
+        return maximum, count
+
+    # Returns one of ATTRIBUTES, as the string that "avg get" prints
+    # With since or until (see Tracker.range), the average, count and
+    #   statistics only cover the entries from that range of times
+    def get(self, attribute, since=None, until=None):
+        if attribute not in ATTRIBUTES:
+            raise AvgError(f"No such attribute, '{attribute}'.")
+
+        header = self.store.read_tracker(self.name)
+
+        if since is not None or until is not None:
+            return self.get_in_range(attribute, header["type"], since, until)
+
+        if attribute in ["description", "average", "type"]:
+            return header[attribute]
+
+        if attribute == "count":
+            return f"{header['count']}"
+
+        if attribute == "ETA":
+            if header["type"] != "date":
+                raise AvgError(f"Tracker '{self.name}' is not a date tracker.")
+
+            return header["ETA"]
+
+        # Statistics of the values (normal trackers) or of the intervals in
+        #   seconds (date trackers)
+        state = self.store.load_state(self.name)
+
+        return format_statistic(state_statistic(state, attribute), header["type"], state_unit(state))
+
+    def get_in_range(self, attribute, tracker_type, since, until):
+        if attribute not in RANGE_ATTRIBUTES:
+            raise AvgError(f"The {attribute} of a range of times isn't available.")
+
+        values = self.range(since, until)
+
+        if attribute == "count":
+            return f"{len(values)}"
+
+        unit = self.store.read_unit(self.name) if tracker_type == "date" else 1
+        state = state_from_values(tracker_type, values, unit=unit)
+
+        if attribute == "average":
+            average = state_average(state, tracker_type)
+            return "0" if average is None else f"{average}"
+
+        return format_statistic(state_statistic(state, attribute), tracker_type, unit)
+
+    # Returns the entries from since to until as numbers (like
+    # Store.read_values)
+    # since and until are dates (see "Dates") or Unix timestamps, both
+    #   included; None means no limit. Normal trackers use the time each
+    #   value was pushed.
+    def range(self, since=None, until=None):
+        tracker_type = self.store.read_tracker_type(self.name)
+        unit = self.store.read_unit(self.name) if tracker_type == "date" else 1
+
+        since = None if since is None else to_epoch(since, unit)
+        until = None if until is None else to_epoch(until, unit)
+
+        return self.store.read_range(self.name, tracker_type, since, until)[1]
+
+    # Splits the entries from since to until (see Tracker.range) into buckets
+    # of the given number of seconds, and returns the start ("YYYY/MM/DD/HH/MM"),
+    # number of entries and average of each bucket that has entries
+    # The average of a date tracker's bucket is the average interval between
+    #   the entries in it.
+    def series(self, bucket, since=None, until=None):
+        tracker_type = self.store.read_tracker_type(self.name)
+        unit = self.store.read_unit(self.name) if tracker_type == "date" else 1
+
+        since = None if since is None else to_epoch(since, unit)
+        until = None if until is None else to_epoch(until, unit)
+
+        times, values = self.store.read_range(self.name, tracker_type, since, until)
+        series = []
+
+        # The times are sorted, so every bucket is one run of entries
+        numbers = range(len(values))
+        for start, bucket_numbers in itertools.groupby(numbers, lambda number: times[number] // (bucket * unit) * bucket):
+            bucket_numbers = list(bucket_numbers)
+            bucket_values = values[bucket_numbers[0]:bucket_numbers[-1] + 1]
+
+            average = state_average(state_from_values(tracker_type, bucket_values, unit=unit), tracker_type)
+
+            series.append({
+                "start": epoch_to_date(start),
+                "count": len(bucket_values),
+                "average": "0" if average is None else f"{average}"
+            })
+
+        return series
+
+    # Returns the name, description, type, average, number of entries, last
+    # entry, ETA (None for normal trackers), average mode, number of compacted
+    # entries, automatic compaction policy and tags of the tracker
+    def info(self):
+        header = self.store.read_tracker(self.name)
+        end_phase("info: header")
+
+        state = self.store.load_state(self.name)
+        end_phase("info: state")
+
+        return {
+            "name": self.name,
+            "description": header["description"],
+            "type": header["type"],
+            "average": header["average"],
+            "count": header["count"],
+            "last": header["last"],
+            "ETA": header["ETA"],
+            "mode": state["mode"],
+            "unit": state_unit(state),
+            "compacted": state.get("compacted", 0),
+            "older_than": state.get("older_than"),
+            "tags": self.store.read_tags(self.name)
+        }
+
+    # Recomputes the average and aggregates of the tracker from all of its
+    # entries, after its file was edited by hand
+    # The entries of a date tracker are sorted first if they're out of order
+    #   (pushed by older versions of kvrg-avg, or edited by hand).
+    def rebuild(self):
+        store = self.store
+
+        with store.lock(self.name):
+            store.repair_tracker(self.name)
+
+            if store.read_tracker_type(self.name) == "date":
+                position, previous, dates = store.read_later_entries(self.name, -END_OF_TIME)
+
+                if any(map(operator.gt, dates[:-1], dates[1:])):
+                    dates = sorted(dates)
+                    state = store.state_from_entries(self.name, "date", store.read_mode(self.name), array.array("q", dates))
+
+                    store.replace_later_entries(self.name, position, dates, state)
+
+            store.rebuild_state(self.name)
+            store.invalidate_tracker(self.name)
+
+    # Folds the entries that are more than older_than seconds old (by the time
+    # they were pushed, for normal trackers) into the summary of the tracker
+    # (see "Compaction"), and returns how many there were
+    # The latest entry is always kept.
+    def compact(self, older_than):
+        with self.store.lock(self.name):
+            self.store.repair_tracker(self.name)
+            return self.fold(self.store.load_state(self.name), older_than)
+
+    # Makes push compact the tracker like compact(older_than) from now on (and
+    # compacts it now), or stops that if older_than is None
+    def set_compaction(self, older_than):
+        with self.store.lock(self.name):
+            self.store.repair_tracker(self.name)
+
+            state = self.store.load_state(self.name)
+            state["older_than"] = older_than
+
+            return self.fold(state, older_than)
+
+    # Compacts the entries of the tracker (whose current state is state) that
+    # are more than older_than seconds old, none if it's None, and saves the
+    # summary, state and policy
+    # This must only be called while holding the tracker's lock
+    def fold(self, state, older_than):
+        store = self.store
+        tracker_type = store.read_tracker_type(self.name)
+
+        count = stored_count(state)
+        values = store.read_values(self.name, tracker_type)
+        times = store.read_times(self.name, count) if tracker_type == "normal" else values
+
+        # Entries are compacted from the oldest one up to the first one that's
+        #   new enough
+        # The dates of a date tracker are in its unit (see "Dates").
+        number = 0
+        unit = state_unit(state)
+
+        if older_than is not None:
+            before = local_time(unit) - older_than * unit
+
+            while number < count - 1 and times[number] < before:
+                number += 1
+
+        summary = store.read_summary(self.name) or {"compacted": 0, "state": new_state(state["mode"], unit)}
+        add_values_to_state(summary["state"], tracker_type, values[:number])
+
+        summary["compacted"] += number
+        summary["older_than"] = state.get("older_than")
+        state["kept"] = count - number
+
+        store.remove_entries(self.name, tracker_type, state, number, summary)
+        store.invalidate_tracker(self.name)
+
+        return number
+
+    # Switches the tracker to the "binary" or "text" format
+    def convert(self, tracker_format):
+        store = self.store
+
+        if tracker_format not in ["binary", "text"]:
+            raise AvgError(f"No such format, '{tracker_format}'.")
+
+        # Nothing to do
+        if store.tracker_format(self.name) == tracker_format:
+            return
+
+        if store.tracker_format(self.name) == "sqlite":
+            raise AvgError("Trackers in a database can't be converted; see 'avg migrate'.")
+
+        with store.lock(self.name):
+            store.repair_tracker(self.name)
+
+            tracker_type = store.read_tracker_type(self.name)
+            description = store.read_tracker(self.name)["description"]
+            values = store.read_values(self.name, tracker_type)
+            state = store.state_from_entries(self.name, tracker_type, store.read_mode(self.name))
+
+            if tracker_format == "binary":
+                if len(description.encode()) > BINARY_DESCRIPTION_SIZE:
+                    raise AvgError(f"The description is too long for a binary tracker (more than {BINARY_DESCRIPTION_SIZE} bytes).")
+
+                if sys.byteorder == "big":
+                    values.byteswap()
+
+                data = pack_binary_header(tracker_type, description, state) + values.tobytes()
+
+            else:
+                data = text_tracker_data(tracker_type, description, values, state)
+
+            # The tracker is never left half-converted
+            store.write_file_atomically(store.tracker_path(self.name), data)
+            store.remove_index(self.name)
+
+            store.write_state(self.name, state)
+            store.invalidate_tracker(self.name)
+
+    # Returns the statistics of the intervals of a date tracker in seconds (see
+    # interval_statistics), all 0 if it doesn't have any intervals yet
+    def intervals(self):
+        if self.store.read_tracker_type(self.name) != "date":
+            raise AvgError(f"Tracker '{self.name}' is not a date tracker.")
+
+        statistics = interval_statistics(self.store.read_values(self.name, "date"))
+
+        # No intervals
+        if statistics is None:
+            statistics = {"mean": 0, "median": 0, "min": 0, "max": 0, "stddev": 0}
+
+        unit = self.store.read_unit(self.name)
+
+        if unit != 1:
+            statistics = {key: value / unit for key, value in statistics.items()}
+
+        return statistics
+
+# SQLite backend
+# Instead of one file per tracker, trackers can be kept in a single SQLite
+# database, config/avg/avg.db (see "avg migrate"). With tens of thousands of
+# trackers, this avoids listing a huge directory to check if a tracker exists.
+# - trackers holds one row per tracker: its header (description, type,
+#   average as it's written in text trackers, number of entries and last entry)
+#   and its state as JSON
+# - entries holds the entries of every tracker, in the order they were pushed,
+#   as numbers (seconds since the epoch for date trackers), with their time
+#   (see "Time ranges"). Its primary key keeps the entries of a tracker next
+#   to each other, and range queries use the index on their times.
+# - summaries holds the summaries of compacted trackers (see "Compaction"),
+#   and tags the tags of every tracker (see "Groups")
+# - windows holds the records of the windows of average modes, like the window
+#   files of a Store (see "Windows" and WindowTable)
+# The database uses write-ahead logging, so reading never waits for a push.
+# Every push is one transaction, with all of its entries inserted at once.
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS trackers (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    description TEXT NOT NULL,
+    type TEXT NOT NULL,
+    average TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    last TEXT,
+    state TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS entries (
+    tracker INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    time INTEGER NOT NULL,
+    value NOT NULL,
+    PRIMARY KEY (tracker, position)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS entries_time ON entries (tracker, time);
+
+CREATE TABLE IF NOT EXISTS summaries (
+    tracker INTEGER PRIMARY KEY,
+    summary TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS windows (
+    tracker INTEGER NOT NULL,
+    number INTEGER NOT NULL,
+    value NOT NULL,
+    PRIMARY KEY (tracker, number)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS tags (
+    tag TEXT NOT NULL,
+    tracker INTEGER NOT NULL,
+    PRIMARY KEY (tag, tracker)
+) WITHOUT ROWID;
+"""
+
+# The columns that SQLiteStore.read_tracker reads, in the order sqlite_header
+# takes them
+# The last date of a date tracker is read from its state as a number, with its
+# unit (NULL for seconds).
+SQLITE_HEADER_COLUMNS = "description, average, type, count, last, json_extract(state, '$.last'), json_extract(state, '$.unit')"
+
+def sqlite_header(description, average, tracker_type, count, last, last_epoch, unit):
+    if last_epoch is not None and unit is not None:
+        last_epoch //= unit
+
+    return {
+        "description": description,
+        "average": average,
+        "type": tracker_type,
+        "count": count,
+        "last": last,
+        "ETA": estimate_ETA(count, last_epoch, average) if tracker_type == "date" else None
+    }
+
+# Returns a Store for a config/avg directory: an SQLiteStore if it has an
+# avg.db, and a Store that uses the tracker files otherwise
+def open_store(directory, cache=False):
+    if os.path.exists(f"{directory}/avg.db"):
+        return SQLiteStore(directory, cache)
+
+    return Store(directory, cache)
+
+# Store.lock for an SQLiteStore: a transaction that other processes can't
+# write during
+class SQLiteTransaction:
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exception_type, exception, exception_traceback):
+        if exception_type is None:
+            self.connection.execute("COMMIT")
+        else:
+            self.connection.execute("ROLLBACK")
+
+# The window of a state in avg.db, which works like a WindowFile with its
+# records in the windows table
+# The records are saved in the transaction of the push, so they don't need a
+#   stamp, and the dropped ones are deleted right away.
+class WindowTable(WindowFile):
+    def __init__(self, connection, name, typecode, start=0, length=0):
+        WindowFile.__init__(self, None, typecode, None, start, length)
+        self.connection = connection
+        self.name = name
+
+    def descriptor(self):
+        return {"typecode": self.typecode, "start": self.start, "length": self.length}
+
+    def read(self, first, last):
+        rows = self.connection.execute(
+            "SELECT number, value FROM windows WHERE tracker = (SELECT id FROM trackers WHERE name = ?) AND number >= ? AND number < ?",
+            (self.name, first, last)
+        )
+
+        values = array.array(self.typecode, [0]) * (last - first)
+
+        for number, value in rows:
+            values[number - first] = value
+
+        return values
+
+    def matches(self):
+        return True
+
+    def save(self, write_file_atomically=None):
+        tracker_id = self.connection.execute("SELECT id FROM trackers WHERE name = ?", (self.name,)).fetchone()[0]
+
+        if self.records is not None:
+            self.connection.execute("DELETE FROM windows WHERE tracker = ?", (tracker_id,))
+            self.connection.executemany(
+                "INSERT INTO windows (tracker, number, value) VALUES (?, ?, ?)",
+                zip(itertools.repeat(tracker_id), itertools.count(self.start), self.records[self.start:])
+            )
+
+        else:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO windows (tracker, number, value) VALUES (?, ?, ?)",
+                ((tracker_id, number, value) for number, value in self.changes.items())
+            )
+            self.connection.execute("DELETE FROM windows WHERE tracker = ? AND number < ?", (tracker_id, self.start))
+            self.connection.execute("DELETE FROM windows WHERE tracker = ? AND number >= ?", (tracker_id, self.length))
+
+        self.changes = {}
+        self.records = None
+        self.block = None
+
+# A Store kept in config/avg/avg.db instead of tracker files
+# Only the methods that read and write trackers are different; Tracker works
+#   the same way with both.
+class SQLiteStore(Store):
+    def __init__(self, directory, cache=False, path=None):
+        import sqlite3
+
+        self.directory = directory
+        self.path = path or f"{directory}/avg.db"
+
+        # Without an isolation level, transactions are only started by
+        #   SQLiteTransaction. The timeout is how long a push waits for
+        #   another one to finish.
+        self.connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(SQLITE_SCHEMA)
+
+        self.tracker_cache = None
+        self.state_cache = None
+
+        if cache:
+            self.tracker_cache = dict.fromkeys(self.names())
+            self.state_cache = {}
+
+    def close(self):
+        self.connection.close()
+
+    def names(self):
+        if self.tracker_cache is not None:
+            return list(self.tracker_cache)
+
+        return [name for (name,) in self.connection.execute("SELECT name FROM trackers ORDER BY id")]
+
+    def exists(self, name):
+        if self.tracker_cache is not None:
+            return name in self.tracker_cache
+
+        return self.connection.execute("SELECT 1 FROM trackers WHERE name = ?", (name,)).fetchone() is not None
+
+    def create(self, name, description=None, tracker_type="normal", mode=None, tags=(), unit=1):
+        import json
+        import sqlite3
+
+        self.check_new_tracker(name, tracker_type, mode, tags, unit)
+
+        if description is None:
+            description = "This tracker does not have a description."
+
+        try:
+            with self.lock(name):
+                self.connection.execute(
+                    "INSERT INTO trackers (name, description, type, average, count, state) VALUES (?, ?, ?, '0', 0, ?)",
+                    (name, description, tracker_type, json.dumps(new_state(mode, unit)))
+                )
+                self.write_tags(name, tags)
+
+        # Another process made the tracker in the meantime
+        except sqlite3.IntegrityError:
+            raise AvgError(f"Tracker with name '{name}' already exists.")
+
+        self.invalidate_tracker(name)
+
+        return Tracker(self, name)
+
+    def delete(self, name):
+        with self.lock(name):
+            row = self.connection.execute("SELECT id FROM trackers WHERE name = ?", (name,)).fetchone()
+
+            # Tracker does not exist
+            if row is None:
+                raise AvgError(f"There is no such tracker '{name}'.")
+
+            self.connection.execute("DELETE FROM entries WHERE tracker = ?", row)
+            self.connection.execute("DELETE FROM summaries WHERE tracker = ?", row)
+            self.connection.execute("DELETE FROM tags WHERE tracker = ?", row)
+            self.connection.execute("DELETE FROM windows WHERE tracker = ?", row)
+            self.connection.execute("DELETE FROM trackers WHERE id = ?", row)
+
+        self.forget_tracker(name)
+
+    # Every header is read with one query
+    def list(self, jobs=None):
+        if self.tracker_cache is not None:
+            return [dict(self.read_tracker(name), name=name) for name in self.names()]
+
+        rows = self.connection.execute(f"SELECT {SQLITE_HEADER_COLUMNS}, name FROM trackers ORDER BY id")
+
+        return [dict(sqlite_header(*row[:-1]), name=row[-1]) for row in rows]
+
+    # The connection can only be used by one thread, and a database doesn't
+    #   get faster with more of them anyway
+    def get(self, attribute, names, jobs=None, since=None, until=None):
+        return Store.get(self, attribute, names, 1, since, until)
+
+    def read_tags(self, name):
+        rows = self.connection.execute(
+            "SELECT tag FROM tags WHERE tracker = (SELECT id FROM trackers WHERE name = ?) ORDER BY tag",
+            (name,)
+        )
+
+        return [tag for (tag,) in rows]
+
+    def write_tags(self, name, tags):
+        tracker_id = self.connection.execute("SELECT id FROM trackers WHERE name = ?", (name,)).fetchone()[0]
+
+        self.connection.execute("DELETE FROM tags WHERE tracker = ?", (tracker_id,))
+        self.connection.executemany("INSERT INTO tags (tag, tracker) VALUES (?, ?)", zip(tags, itertools.repeat(tracker_id)))
+
+    def tagged(self, tag):
+        rows = self.connection.execute("SELECT name FROM trackers JOIN tags ON tags.tracker = trackers.id WHERE tag = ?", (tag,))
+
+        return [name for (name,) in rows]
+
+    # Every state is read with one query
+    def read_states(self, names, jobs=None):
+        if self.state_cache is not None:
+            return [(self.read_tracker_type(name), self.read_state(name)) for name in names]
+
+        import json
+
+        rows = {name: (tracker_type, state) for name, tracker_type, state in self.connection.execute("SELECT name, type, state FROM trackers")}
+
+        return [(rows[name][0], json.loads(rows[name][1])) for name in names]
+
+    def get_group(self, attribute, pattern=None, tag=None, jobs=None, since=None, until=None):
+        return Store.get_group(self, attribute, pattern, tag, 1, since, until)
+
+    def tracker_format(self, name):
+        return "sqlite"
+
+    def read_tracker(self, name):
+        if self.tracker_cache is not None and self.tracker_cache.get(name) is not None:
+            return self.tracker_cache[name]
+
+        header = sqlite_header(*self.connection.execute(
+            f"SELECT {SQLITE_HEADER_COLUMNS} FROM trackers WHERE name = ?",
+            (name,)
+        ).fetchone())
+
+        if self.tracker_cache is not None:
+            self.tracker_cache[name] = header
+
+        return header
+
+    def read_state(self, name):
+        if self.state_cache is not None and name in self.state_cache:
+            return self.state_cache[name]
+
+        import json
+
+        state = json.loads(self.connection.execute("SELECT state FROM trackers WHERE name = ?", (name,)).fetchone()[0])
+        add_count("states_read")
+
+        if isinstance(state["window"], dict):
+            state["window"] = self.open_window(name, **state["window"])
+
+        if self.state_cache is not None:
+            self.state_cache[name] = state
+
+        return state
+
+    def read_mode(self, name):
+        return self.read_state(name)["mode"]
+
+    def read_unit(self, name):
+        return state_unit(self.read_state(name))
+
+    def open_window(self, name, typecode, start=0, length=0):
+        return WindowTable(self.connection, name, typecode, start, length)
+
+    # Every push is a transaction, so the state is never behind the entries
+    def load_state(self, name):
+        return self.read_state(name)
+
+    def write_state(self, name, state):
+        import json
+
+        self.connection.execute("UPDATE trackers SET state = ? WHERE name = ?", (json.dumps(self.save_window(name, state)), name))
+        add_count("states_written")
+
+        if self.state_cache is not None:
+            self.state_cache[name] = state
+
+    def lock(self, name):
+        return SQLiteTransaction(self.connection)
+
+    def read_tracker_type(self, name):
+        if self.tracker_cache is not None:
+            return self.read_tracker(name)["type"]
+
+        return self.connection.execute("SELECT type FROM trackers WHERE name = ?", (name,)).fetchone()[0]
+
+    # A date tracker keeps its old average if it has fewer than two entries,
+    #   like a text tracker
+    def write_header(self, name, tracker_type, state):
+        average = state_average(state, tracker_type)
+
+        if average is None:
+            self.connection.execute("UPDATE trackers SET count = ? WHERE name = ?", (state["count"], name))
+        else:
+            self.connection.execute("UPDATE trackers SET average = ?, count = ? WHERE name = ?", (f"{average}", state["count"], name))
+
+    # Every push is a transaction, so the tracker has exactly count entries
+    def append_entries(self, name, tracker_type, entries, values, count):
+        tracker_id = self.connection.execute("SELECT id FROM trackers WHERE name = ?", (name,)).fetchone()[0]
+
+        if tracker_type == "normal":
+            times = [local_time()] * len(values)
+        else:
+            times = values
+
+        self.connection.executemany(
+            "INSERT INTO entries (tracker, position, time, value) VALUES (?, ?, ?, ?)",
+            zip(itertools.repeat(tracker_id), itertools.count(count), times, values)
+        )
+        self.connection.execute("UPDATE trackers SET last = ? WHERE id = ?", (entries[-1], tracker_id))
+
+    def read_values(self, name, tracker_type):
+        rows = self.connection.execute(
+            "SELECT value FROM entries WHERE tracker = (SELECT id FROM trackers WHERE name = ?) ORDER BY position",
+            (name,)
+        )
+
+        values = array.array(BINARY_TYPECODES[tracker_type], (value for (value,) in rows))
+        add_count("entries_read", len(values))
+
+        return values
+
+    def rebuild_state(self, name):
+        tracker_type = self.read_tracker_type(name)
+        state = self.state_from_entries(name, tracker_type, self.read_mode(name))
+
+        self.write_header(name, tracker_type, state)
+        self.write_state(name, state)
+
+        return state
+
+    # position is the position of the first later entry in the database
+    def read_later_entries(self, name, moment):
+        tracker_id = self.connection.execute("SELECT id FROM trackers WHERE name = ?", (name,)).fetchone()[0]
+
+        row = self.connection.execute(
+            "SELECT position, value FROM entries WHERE tracker = ? AND time <= ? ORDER BY time DESC, position DESC LIMIT 1",
+            (tracker_id, moment)
+        ).fetchone()
+
+        position, previous = (0, None) if row is None else (row[0] + 1, row[1])
+
+        rows = self.connection.execute(
+            "SELECT value FROM entries WHERE tracker = ? AND position >= ? ORDER BY position",
+            (tracker_id, position)
+        )
+
+        later = array.array("q", (value for (value,) in rows))
+        add_count("entries_read", len(later))
+
+        return position, previous, later
+
+    # The entries are replaced in the transaction of SQLiteStore.lock, so the
+    #   state is saved by push like after appending
+    def replace_later_entries(self, name, position, dates, state):
+        tracker_id = self.connection.execute("SELECT id FROM trackers WHERE name = ?", (name,)).fetchone()[0]
+
+        self.connection.execute("DELETE FROM entries WHERE tracker = ? AND position >= ?", (tracker_id, position))
+        self.connection.executemany(
+            "INSERT INTO entries (tracker, position, time, value) VALUES (?, ?, ?, ?)",
+            zip(itertools.repeat(tracker_id), itertools.count(position), dates, dates)
+        )
+        self.connection.execute("UPDATE trackers SET last = ? WHERE id = ?", (epoch_to_date(dates[-1], state_unit(state)), tracker_id))
+
+    def read_summary(self, name):
+        import json
+
+        row = self.connection.execute(
+            "SELECT summary FROM summaries WHERE tracker = (SELECT id FROM trackers WHERE name = ?)",
+            (name,)
+        ).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def write_summary(self, name, summary):
+        import json
+
+        self.connection.execute(
+            "INSERT OR REPLACE INTO summaries (tracker, summary) VALUES ((SELECT id FROM trackers WHERE name = ?), ?)",
+            (name, json.dumps(summary))
+        )
+
+    # The compaction is part of the transaction of SQLiteStore.lock, so it
+    #   can't be interrupted halfway
+    def remove_entries(self, name, tracker_type, state, number, summary):
+        tracker_id = self.connection.execute("SELECT id FROM trackers WHERE name = ?", (name,)).fetchone()[0]
+
+        self.connection.execute("DELETE FROM entries WHERE tracker = ? AND position < ?", (tracker_id, number))
+
+        # The positions start at 0 again. They go through negative numbers first,
+        #   so that two entries never have the same position.
+        self.connection.execute("UPDATE entries SET position = -1 - (position - ?) WHERE tracker = ?", (number, tracker_id))
+        self.connection.execute("UPDATE entries SET position = -1 - position WHERE tracker = ?", (tracker_id,))
+
+        self.write_summary(name, summary)
+
+        state["compacted"] = summary["compacted"]
+        self.write_state(name, state)
+
+    # A transaction that was interrupted is rolled back by SQLite
+    def repair_tracker(self, name):
+        pass
+
+    # Adds a tracker with all of its entries at once, like Store.import_tracker
+    # The tracker_format of the files doesn't matter in a database.
+    def import_tracker(self, name, header, values, state, times, summary=None, tags=(), tracker_format="text"):
+        import json
+
+        cursor = self.connection.execute(
+            "INSERT INTO trackers (name, description, type, average, count, last, state) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (name, header["description"], header["type"], header["average"], state["count"], header["last"], json.dumps(state))
+        )
+
+        self.connection.executemany(
+            "INSERT INTO entries (tracker, position, time, value) VALUES (?, ?, ?, ?)",
+            zip(itertools.repeat(cursor.lastrowid), itertools.count(), times, values)
+        )
+
+        if summary is not None:
+            self.write_summary(name, summary)
+
+        self.write_tags(name, tags)
+
+        # Moves the window into the windows table
+        self.write_state(name, state)
+
+    # Returns the times of all entries of a tracker
+    def read_times(self, name, count):
+        rows = self.connection.execute(
+            "SELECT time FROM entries WHERE tracker = (SELECT id FROM trackers WHERE name = ?) ORDER BY position",
+            (name,)
+        )
+
+        return array.array("q", (moment for (moment,) in rows))
+
+    def read_range(self, name, tracker_type, since=None, until=None):
+        since = 1 if since is None else max(since, 1)
+        until = END_OF_TIME if until is None else until
+
+        rows = self.connection.execute(
+            "SELECT time, value FROM entries WHERE tracker = (SELECT id FROM trackers WHERE name = ?) AND time BETWEEN ? AND ? ORDER BY position",
+            (name, since, until)
+        )
+
+        times = array.array("q")
+        values = array.array(BINARY_TYPECODES[tracker_type])
+
+        for moment, value in rows:
+            times.append(moment)
+            values.append(value)
+
+        return times, values
+
+# Moves every tracker of a config/avg directory from its tracker files into
+# avg.db, and returns the new SQLiteStore
+# The database is built under another name and only renamed to avg.db once
+#   every tracker is in it, so an interrupted migration changes nothing. The
+#   tracker files are left where they are, but aren't used anymore.
+def migrate_to_sqlite(directory):
+    if os.path.exists(f"{directory}/avg.db"):
+        raise AvgError("The trackers are already in a database.")
+
+    files = Store(directory)
+    temporary_path = f"{directory}/avg.db.migrating"
+
+    # Left behind by an interrupted migration
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(temporary_path + suffix):
+            os.remove(temporary_path + suffix)
+
+    database = SQLiteStore(directory, path=temporary_path)
+
+    # Everything is inserted in a single transaction
+    with SQLiteTransaction(database.connection):
+        for name in files.names():
+            with files.lock(name):
+                files.repair_tracker(name)
+
+                tracker_type = files.read_tracker_type(name)
+                state = detach_window(files.load_state(name))
+                state.pop("size", None)
+                values = files.read_values(name, tracker_type)
+
+                if tracker_type == "normal":
+                    times = files.read_times(name, len(values))
+                else:
+                    times = values
+
+                database.import_tracker(name, files.read_tracker(name), values, state, times, files.read_summary(name), files.read_tags(name))
+
+    database.close()
+    os.replace(temporary_path, f"{directory}/avg.db")
+
+    return SQLiteStore(directory)
+
+# Moves every tracker of a config/avg directory from avg.db back into text
+# tracker files, and returns the new Store
+# Tracker files that aren't in the database (e.g. trackers that were deleted
+#   after the last migration) are removed.
+def migrate_to_files(directory):
+    if not os.path.exists(f"{directory}/avg.db"):
+        raise AvgError("The trackers are already in tracker files.")
+
+    database = SQLiteStore(directory)
+    files = Store(directory)
+
+    names = database.names()
+
+    for name in set(files.names()) - set(names):
+        files.delete(name)
+
+    for name in names:
+        header = database.read_tracker(name)
+        values = database.read_values(name, header["type"])
+        times = database.read_times(name, len(values)) if header["type"] == "normal" else values
+
+        with files.lock(name):
+            files.import_tracker(name, header, values, detach_window(database.read_state(name)), times, database.read_summary(name), database.read_tags(name))
+
+    database.close()
+
+    for suffix in ["", "-wal", "-shm"]:
+        if os.path.exists(f"{directory}/avg.db{suffix}"):
+            os.remove(f"{directory}/avg.db{suffix}")
+
+    return files
+
+# Archives
+# "avg export" saves trackers into a single archive file, which "avg import"
+# loads back (into tracker files or avg.db, whichever is in use). An archive
+# is laid out like this:
+# - ARCHIVE_MAGIC
+# - the columns of every tracker, one after another: its entries packed like
+#   in a binary tracker (little-endian float64 values, or int64 seconds (or
+#   milliseconds, see "Dates") since the epoch for date trackers), followed by the times of its entries as
+#   int64 for normal trackers (see "Time ranges")
+# - the manifest, in JSON: one object per tracker with its name, header,
+#   format, tags, state, summary, number of entries and the byte offsets of
+#   its columns
+# - ARCHIVE_FOOTER: the size of the manifest and ARCHIVE_MAGIC again
+# Every column starts at a multiple of 8 bytes, so it can be read straight
+# into an array (or a numpy.memmap) without parsing anything. The manifest is
+# at the end so that export only holds one tracker in memory at a time, and
+# can write to a pipe.
+ARCHIVE_MAGIC = b"AVGARCH1"
+ARCHIVE_FOOTER = struct.Struct("<Q8s")
+
+# Writes the trackers called names (all of them by default) from a store into
+# an archive, and returns the number of trackers and entries
+# archive_file is a binary file open for writing.
+def export_trackers(store, archive_file, names=None):
+    import json
+
+    names = store.names() if names is None else names
+    manifest = []
+    offset = archive_file.write(ARCHIVE_MAGIC)
+    entries = 0
+
+    for name in names:
+        with store.lock(name):
+            store.repair_tracker(name)
+
+            header = store.read_tracker(name)
+            tracker_type = header["type"]
+            state = detach_window(dict(store.load_state(name)))
+            state.pop("size", None)
+
+            values = store.read_values(name, tracker_type)
+            columns = [("values", values)]
+
+            if tracker_type == "normal":
+                columns.append(("times", store.read_times(name, len(values))))
+
+            tracker = {
+                "name": name,
+                "description": header["description"],
+                "type": tracker_type,
+                "average": header["average"],
+                "last": header["last"],
+                "format": store.tracker_format(name),
+                "tags": store.read_tags(name),
+                "state": state,
+                "summary": store.read_summary(name),
+                "count": len(values),
+                "times": None
+            }
+
+            for column, numbers in columns:
+                if sys.byteorder == "big":
+                    numbers.byteswap()
+
+                tracker[column] = offset
+                offset += archive_file.write(numbers.tobytes())
+
+        manifest.append(tracker)
+        entries += len(values)
+
+    data = json.dumps({"version": STATE_VERSION, "trackers": manifest}).encode()
+    archive_file.write(data + ARCHIVE_FOOTER.pack(len(data), ARCHIVE_MAGIC))
+
+    return len(manifest), entries
+
+# Returns the manifest of an archive (see "Archives")
+# archive_file is a binary file open for reading, which must be seekable.
+# Every column must end before the manifest starts, so that a damaged or
+#   crafted archive can't make import read past its entries.
+def read_archive_manifest(archive_file):
+    import json
+
+    size = archive_file.seek(0, os.SEEK_END)
+
+    if size >= len(ARCHIVE_MAGIC) + ARCHIVE_FOOTER.size:
+        archive_file.seek(size - ARCHIVE_FOOTER.size)
+        manifest_size, magic = ARCHIVE_FOOTER.unpack(archive_file.read(ARCHIVE_FOOTER.size))
+
+        archive_file.seek(0)
+
+        manifest_start = size - ARCHIVE_FOOTER.size - manifest_size
+
+        if magic == ARCHIVE_MAGIC and manifest_start >= len(ARCHIVE_MAGIC) and archive_file.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC:
+            archive_file.seek(manifest_start)
+            manifest = json.loads(archive_file.read(manifest_size))
+
+            # The states would have to be rebuilt
+            if manifest["version"] != STATE_VERSION:
+                raise AvgError("This archive was made by a different version of kvrg-avg.")
+
+            for tracker in manifest["trackers"]:
+                if tracker["type"] not in BINARY_TYPECODES:
+                    raise AvgError(f"No such tracker type, '{tracker['type']}'.")
+
+                columns = ["values", "times"] if tracker["type"] == "normal" else ["values"]
+                count = tracker["count"]
+
+                for column in columns:
+                    offset = tracker[column]
+
+                    if type(offset) is not int or type(count) is not int or offset < len(ARCHIVE_MAGIC) or count < 0 or offset + count * 8 > manifest_start:
+                        raise AvgError(f"The entries of '{tracker['name']}' are outside of the archive, it's damaged.")
+
+            return manifest
+
+    raise AvgError("This file isn't a kvrg-avg archive, or it's incomplete.")
+
+# Reads a column of an archive
+def read_archive_column(archive_file, typecode, offset, count):
+    numbers = array.array(typecode)
+
+    archive_file.seek(offset)
+    numbers.frombytes(archive_file.read(count * 8))
+
+    if sys.byteorder == "big":
+        numbers.byteswap()
+
+    return numbers
+
+# Adds the trackers of an archive to a store, or only the ones whose names
+# match one of patterns (globs), and returns the number of trackers and
+# entries
+# The entries aren't checked one by one: the archive already has the states
+# that push computed. Trackers that already exist are an error, unless
+# replace is True.
+def import_trackers(store, archive_file, patterns=None, replace=False):
+    import fnmatch
+
+    trackers = read_archive_manifest(archive_file)["trackers"]
+
+    if patterns is not None:
+        trackers = [tracker for tracker in trackers if any(fnmatch.fnmatchcase(tracker["name"], pattern) for pattern in patterns)]
+
+    # Nothing is imported if any tracker is in the way, or has a name (or
+    #   tags) that isn't a file name and would be written outside of the store
+    existing_names = set(store.names())
+
+    for tracker in trackers:
+        for name in [tracker["name"]] + list(tracker["tags"]):
+            if not isinstance(name, str) or name in ["", ".", ".."] or "/" in name:
+                raise AvgError(f"'{name}' can't be used as a tracker name or tag.")
+
+        if tracker["name"] in existing_names and not replace:
+            raise AvgError(f"Tracker with name '{tracker['name']}' already exists.")
+
+    entries = 0
+
+    for tracker in trackers:
+        name = tracker["name"]
+        tracker_type = tracker["type"]
+
+        values = read_archive_column(archive_file, BINARY_TYPECODES[tracker_type], tracker["values"], tracker["count"])
+
+        if tracker_type == "normal":
+            times = read_archive_column(archive_file, "q", tracker["times"], tracker["count"])
+        else:
+            times = values
+
+        if name in existing_names:
+            store.delete(name)
+
+        with store.lock(name):
+            store.import_tracker(name, tracker, values, tracker["state"], times, tracker["summary"], tracker["tags"], tracker["format"])
+
+        entries += len(values)
+
+    return len(trackers), entries
+
+# Command line
+# Everything below runs the avg command itself, on top of a Store in
+# config/avg (see main).
+
+# The store of the avg command, set by main
+store = None
+
+# Removes "--jobs N" from the arguments of list and get
+# N is the number of trackers that are read at the same time; by default,
+#   that's decided by concurrent.futures
+def read_jobs_option(argv):
+    if "--jobs" not in argv:
+        return argv, None
+
+    index = argv.index("--jobs")
+
+    try:
+        jobs = int(argv[index + 1])
+        if jobs < 1:
+            raise ValueError
+
+    except (IndexError, ValueError):
+        print("--jobs needs a positive number.")
+        sys.exit(1)
+
+    return argv[:index] + argv[index + 2:], jobs
+
+# Removes "--since X" and "--until Y" from the arguments, and returns the
+# arguments, since and until (None if they weren't given)
+# X and Y are dates (see "Dates") or Unix timestamps.
+def read_range_options(argv):
+    moments = {}
+
+    for option in ["--since", "--until"]:
+        moments[option] = None
+
+        if option not in argv:
+            continue
+
+        index = argv.index(option)
+
+        if index + 1 == len(argv):
+            print(f"{option} needs a date.")
+            sys.exit(1)
+
+        moment = argv[index + 1]
+        moments[option] = int(moment) if moment.isdigit() else moment
+
+        argv = argv[:index] + argv[index + 2:]
+
+    return argv, moments["--since"], moments["--until"]
+
+# header is one of the headers returned by Store.list, and date_list_ETA_set
+#   is True if the config file asks for the ETA of date trackers
+def list_line(header, date_list_ETA_set):
+    tracker = header["name"]
+
+    if header["type"] == "date":
+        if date_list_ETA_set:
+            # the ETA, or 0 if there are not enough intervals for one
+            return f"{tracker} - {header['ETA']}"
+
+        # convert to human-readable
+        return f"{tracker} - {humanize_duration(average_number(header))}"
+
+    return f"{tracker} - {header['average']}"
+
+# Removes "--format json|tsv" from the arguments, and returns the arguments and
+# the format, or None for the usual human-readable output
+def read_format_option(argv):
+    if "--format" not in argv:
+        return argv, None
+
+    index = argv.index("--format")
+
+    if argv[index + 1:index + 2] not in [["json"], ["tsv"]]:
+        print("--format needs 'json' or 'tsv'.")
+        sys.exit(1)
+
+    return argv[:index] + argv[index + 2:], argv[index + 1]
+
+# Prints rows (dictionaries with the same keys) for scripts
+# json is one array of objects, and tsv is a line of column names followed by
+#   one line per row, with tabs between the columns and "" for None
+def print_rows(rows, keys, output_format):
+    if output_format == "json":
+        import json
+        print(json.dumps([{key: row[key] for key in keys} for row in rows]))
+        return
+
+    print("\t".join(keys))
+
+    for row in rows:
+        print("\t".join("" if row[key] is None else f"{row[key]}" for key in keys))
+
+# The average of a header as a number, for --format
+# Date trackers in milliseconds (see "Dates") can have a fraction of a second.
+def average_number(header):
+    if header["type"] == "date" and "." not in header["average"]:
+        return int(header["average"])
+
+    return float(header["average"])
+
+
+# You ran "avg" without any extra arguments, or you ran "avg list"
+# running something like "avg list foo bar" is the same
+def command_list(argv):
+    argv, jobs = read_jobs_option(argv)
+    argv, output_format = read_format_option(argv)
+
+    # Get the tracker names and headers by looking in config/avg/trackers
+    headers = store.list(jobs)
+    end_phase("list: read")
+
+    if output_format is not None:
+        for header in headers:
+            header["average"] = average_number(header)
+
+        print_rows(headers, ["name", "type", "average", "count", "ETA", "description"], output_format)
+        sys.exit(0)
+
+    # Alert the user if they have no trackers
+    if not headers:
+        print("You have no trackers.")
+        print("Use 'avg create \"<name>\" [\"<description>\"]' to create one.")
+        sys.exit(1)
+
+    # Print the tracker names and their average values, if the user has a tracker
+    else:
+        # config for either average (default) or ETA for date trackers
+        # Only avg list needs it, so the other commands don't read the file
+        date_list_ETA_set = store.read_config()
+
+        for header in headers:
+            print(list_line(header, date_list_ETA_set))
+
+        sys.exit(0)
+
+# Converts a duration like "90", "45m", "12h" or "30d" to seconds
+def parse_duration(duration):
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+    if duration and duration[-1] in units:
+        return int(duration[:-1]) * units[duration[-1]]
+
+    return int(duration)
+
+# Removes "--window N", "--window-time T" or "--ewma A" from the arguments of
+# create, and returns the arguments and the mode they describe
+def read_mode_options(argv):
+    for option in ["--window", "--window-time", "--ewma"]:
+        if option not in argv:
+            continue
+
+        index = argv.index(option)
+
+        try:
+            if option == "--window":
+                mode = {"type": "last", "size": int(argv[index + 1])}
+                valid = mode["size"] > 0
+
+            elif option == "--window-time":
+                mode = {"type": "time", "seconds": parse_duration(argv[index + 1])}
+                valid = mode["seconds"] > 0
+
+            else:
+                mode = {"type": "ewma", "alpha": float(argv[index + 1])}
+                valid = 0 < mode["alpha"] <= 1
+
+        except (IndexError, ValueError):
+            valid = False
+
+        if not valid:
+            print(f"Invalid value for {option}.")
+            sys.exit(1)
+
+        return argv[:index] + argv[index + 2:], mode
+
+    return argv, None
+
+# Removes every "--tag T" from the arguments, and returns the arguments and
+# the tags
+def read_tag_options(argv):
+    tags = []
+
+    while "--tag" in argv:
+        index = argv.index("--tag")
+
+        if index + 1 == len(argv):
+            print("--tag needs a tag.")
+            sys.exit(1)
+
+        tags.append(argv[index + 1])
+        argv = argv[:index] + argv[index + 2:]
+
+    return argv, tags
+
+
+# You ran "avg create ..."
+def command_create(argv):
+    # If user runs "avg create"
+    if len(argv) == 2:
+        print("You need a <name> argument.")
+        sys.exit(1)
+
+    # Check if config/avg/trackers contains a tracker called <name>
+    if store.exists(argv[2]):
+        print(f"Tracker with name '{argv[2]}' already exists.")
+        sys.exit(1)
+
+    argv, mode = read_mode_options(argv)
+    argv, tags = read_tag_options(argv)
+
+    # "--milliseconds" keeps the fractions of the dates (see "Dates")
+    unit = 1
+    if "--milliseconds" in argv:
+        argv.remove("--milliseconds")
+        unit = MILLISECONDS
+
+    # avg create ... date
+    tracker_type = "date" if argv[3:4] == ["date"] else "normal"
+
+    # Saves the description if the user provided one
+
+    # the description is the fourth argument, so the length has to be > 3 (>=4)
+    # and argv[3] will get the fourth argument (3rd when not including "avg")
+
+    if len(argv) > 3 and argv[3] != "date":
+        description = argv[3]
+
+    # Date tracker with description
+
+    elif len(argv) > 4:
+        description = argv[4]
+
+    # No description
+
+    else:
+        description = None
+
+    store.create(argv[2], description, tracker_type, mode, tags, unit)
+
+    sys.exit(0)
+
+# You ran "avg delete ..."
+def command_delete(argv):
+    # If user runs "avg delete"
+    if len(argv) == 2:
+        print("You need a <name> argument.")
+        sys.exit(1)
+
+    store.delete(argv[2])
+
+    sys.exit(0)
+
+# You ran "avg push ..."
+def command_push(argv):
+    # "--unique" skips dates that the tracker already has
+    unique = "--unique" in argv
+    if unique:
+        argv.remove("--unique")
+
+    # If user runs "avg push"
+    if len(argv) == 2:
+        print("You need a <name> and a <one or more values> argument.")
+        sys.exit(1)
+
+    # Check if config/avg/trackers contains a tracker called <name>
+    tracker = store.tracker(argv[2])
+
+    # If user runs "avg push <name>"
+    if len(argv) == 3:
+        print("You need a <one or more values> argument.")
+        sys.exit(1)
+
+    # "avg push <name> -" reads the values from stdin instead, separated by
+    #   whitespace, so large batches don't have to fit in the argument list
+    if argv[3:] == ["-"]:
+        values = sys.stdin.read().split()
+
+        if not values:
+            print("You need a <one or more values> argument.")
+            sys.exit(1)
+
+    else:
+        values = argv[3:]
+
+    warn_dropped_fractions(tracker.name, values)
+    tracker.push(values, unique)
 
-try:
-    # Change the next line if your config folder is not $HOME/.config
-    config_directory = f"{os.environ['HOME']}/.config"
+    sys.exit(0)
 
-    # If $HOME isn't set, os.environ['HOME'] will cause an error
+# Trackers that warn_dropped_fractions already warned about
+warned_fractions = set()
+
+# Prints a note (once per tracker) if any of the values pushed to a date
+# tracker in seconds has a fraction of a second, which is dropped
+def warn_dropped_fractions(name, values):
+    if name in warned_fractions or store.read_tracker_type(name) != "date" or store.read_unit(name) != 1:
+        return
+
+    for value in values:
+        if value.partition(".")[2].strip("0"):
+            print(f"Note: '{name}' keeps whole seconds, so the fraction of '{value}' is dropped (see 'avg create --milliseconds').")
+            warned_fractions.add(name)
+            return
+
+# You ran "avg rebuild ..."
+# Recomputes the average and aggregates of a tracker from all of its entries
+# Use this if you edited a tracker file by hand
+def command_rebuild(argv):
+    # If user runs "avg rebuild"
+    if len(argv) == 2:
+        print("You need a <name> argument.")
+        sys.exit(1)
 
-except KeyError:
-    print("The environment variable $HOME is not set.")
-    print("You need to change the config_directory variable.")
-    print("See README.md on github (https://github.com/michaelskyba/kvrg-avg) for more information.")
+    store.tracker(argv[2]).rebuild()
 
-    sys.exit(1)
+    sys.exit(0)
 
-# If config_directory doesn't exist, print an error an exit
-if not os.path.isdir(config_directory):
-    print(f"The config directory that is set ({config_directory}) does not exist.")
-    print("You need to change the config_directory variable.")
-    print("See README.md on github (https://github.com/michaelskyba/kvrg-avg) for more information.")
+# You ran "avg convert ..."
+# Switches a tracker between the text and binary formats
+def command_convert(argv):
+    # If user runs "avg convert"
+    if len(argv) == 2:
+        print("You need a <name> argument.")
+        sys.exit(1)
 
-    sys.exit(1)
+    # Check if config/avg/trackers contains a tracker called <name>
+    tracker = store.tracker(argv[2])
 
-# If config_director/avg/trackers does not exist, create it
-# mkdir without -p will raise an error if config_directory/avg doesn't exist first
-if not os.path.isdir("f{config_directory}/avg/trackers"):
-    subprocess.run(["mkdir", "-p", f"{config_directory}/avg/trackers"])
+    # If user runs "avg convert <name>" or gives an unknown format
+    if len(argv) != 5 or argv[3] != "--to" or argv[4] not in ["binary", "text"]:
+        print("You need a '--to binary' or '--to text' argument.")
+        sys.exit(1)
 
-# config for either average (default) or ETA for date trackers in avg list
+    tracker.convert(argv[4])
 
-date_list_ETA_set = False
+    sys.exit(0)
 
-if os.path.isfile(f"{config_directory}/avg/config"):
-    with open(f"{config_directory}/avg/config", "r") as config_file:
-        if "ETA\n" in config_file.readlines():
-            date_list_ETA_set = True
+# You ran "avg intervals ..."
+# Prints statistics about the intervals between the entries of a date
+# tracker, in seconds. These are computed from every entry.
+def command_intervals(argv):
+    argv, output_format = read_format_option(argv)
 
-# Starts checking for command-line arguments
+    # If user runs "avg intervals"
+    if len(argv) == 2:
+        print("You need a <name> argument.")
+        sys.exit(1)
 
-# You ran "avg" without any extra arguments, or you ran "avg list"
-# running something like "avg list foo bar" is the same
-if len(sys.argv) == 1 or sys.argv[1] == "list":
+    statistics = store.tracker(argv[2]).intervals()
 
-    # Get the tracker names by looking in config/avg/trackers
-    tracker_names = os.listdir(f"{config_directory}/avg/trackers")
+    # Whole seconds, or milliseconds for a tracker in milliseconds
+    unit = store.read_unit(argv[2])
+    statistics = {key: round_seconds(value, unit) for key, value in statistics.items()}
 
-    # Alert the user if they have no trackers
-    if not tracker_names:
-        print("You have no trackers.")
-        print("Use 'avg create \"<name>\" [\"<description>\"]' to create one.")
+    if output_format is not None:
+        print_rows([statistics], ["mean", "median", "min", "max", "stddev"], output_format)
+        sys.exit(0)
+
+    print(f"Mean: {statistics['mean']}")
+    print(f"Median: {statistics['median']}")
+    print(f"Minimum: {statistics['min']}")
+    print(f"Maximum: {statistics['max']}")
+    print(f"Standard deviation: {statistics['stddev']}")
+
+    sys.exit(0)
+
+# You ran "avg series ..."
+# Prints the start, number of entries and average of every bucket of time
+# that has entries, one per line
+def command_series(argv):
+    argv, since, until = read_range_options(argv)
+    argv, output_format = read_format_option(argv)
+
+    bucket = None
+
+    if "--bucket" in argv:
+        index = argv.index("--bucket")
+
+        try:
+            bucket = argv[index + 1]
+            bucket = BUCKETS[bucket] if bucket in BUCKETS else parse_duration(bucket)
+
+        except (IndexError, ValueError):
+            bucket = 0
+
+        argv = argv[:index] + argv[index + 2:]
+
+    # If user runs "avg series"
+    if len(argv) == 2:
+        print("You need a <name> argument.")
         sys.exit(1)
 
-    # Print the tracker names and their average values, if the user has a tracker
-    else:
-        for tracker in tracker_names:
-            with open(f"{config_directory}/avg/trackers/{tracker}", "r") as tracker_file:
-                tracker_lines = tracker_file.readlines()
+    if bucket is None or bucket <= 0:
+        print("You need a '--bucket minute|hour|day|week|<duration>' argument.")
+        sys.exit(1)
 
-                if len(tracker_lines) > 2 and tracker_lines[2].strip() == "date":
-                    if not date_list_ETA_set:
-                        # convert to human-readable
-                        seconds = int(tracker_lines[1].strip())
+    series = store.tracker(argv[2]).series(bucket, since, until)
 
-                        if seconds == 0:
-                            output = seconds
-                            print(f"{tracker} - {output}")
-                            continue
+    if output_format is not None:
+        print_rows(series, ["start", "count", "average"], output_format)
+        sys.exit(0)
 
-                        minutes = math.floor(seconds / 60)
+    for line in series:
+        print(f"{line['start']} {line['count']} {line['average']}")
 
-                        if minutes == 0:
-                            output = seconds
-                            print(f"{tracker} - {output}")
-                            continue
+    sys.exit(0)
 
-                        hours = math.floor(minutes / 60)
+# Following files
+# "avg ingest" tails a file like "tail -f", or reads a pipe, and pushes the
+# values that are written to it in batches.
 
-                        if hours == 0:
-                            output = f"{minutes} minutes and {seconds - minutes * 60} seconds"
-                            print(f"{tracker} - {output}")
-                            continue
+# Seconds between checks of a followed file when inotify isn't available
+POLL_INTERVAL = 0.1
 
-                        days = math.floor(hours / 24)
+# inotify events that wake a Follower up: a file in the directory was written,
+# created or moved there (a rotated log)
+INOTIFY_EVENTS = 0x2 | 0x80 | 0x100
 
-                        if days == 0:
-                            output = f"{hours} hours and {minutes - hours * 60} minutes"
-                            print(f"{tracker} - {output}")
-                            continue
+# Returns a non-blocking inotify file descriptor that watches a directory, or
+# None if inotify isn't available (e.g. not on Linux)
+def watch_directory(directory):
+    import ctypes
 
-                        months = math.floor(days / 30)
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        descriptor = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
 
-                        if months == 0:
-                            output = f"{days} days and {hours - days * 24} hours"
-                            print(f"{tracker} - {output}")
-                            continue
+    except (OSError, AttributeError):
+        return None
 
-                        years = math.floor(months / 12)
+    if descriptor < 0:
+        return None
 
-                        if years == 0:
-                            output = f"{months} months and {days - months * 30} days"
-                            print(f"{tracker} - {output}")
-                            continue
+    if libc.inotify_add_watch(descriptor, directory.encode(), INOTIFY_EVENTS) < 0:
+        os.close(descriptor)
+        return None
 
-                        output = f"{years} years and {months - years * 12} months"
-                        print(f"{tracker} - {output}")
+    return descriptor
 
-                    elif len(tracker_lines) > 4:
-                        # we want the ETA
-                        argument = tracker_lines[len(tracker_lines) - 1].strip()
+class Follower:
+    # path is a file, or "-" for stdin
+    # A file is read from its end, like "tail -f", unless from_start is True.
+    def __init__(self, path, from_start=False):
+        import select
 
-                        date = []
-                        date.append(argument[0:4])
-                        date.append(argument[5:7])
-                        date.append(argument[8:10])
-                        date.append(argument[11:13])
-                        date.append(argument[14:16])
+        self.select = select.select
+        self.path = path
+        self.inotify = None
 
-                        # Make sure everything is an integer
-                        int_date = []
-                        for part in date:
-                            int_date.append(int(part))
-                        date = []
-                        for part in int_date:
-                            date.append(part)
+        if path == "-":
+            self.descriptor = sys.stdin.fileno()
+            return
 
-                        latest_date = datetime.datetime(date[0], date[1], date[2], date[3], date[4])
-                        average = tracker_lines[1].strip()
-                        average = int(average)
-                        average = datetime.timedelta(seconds=average)
+        self.open(from_start)
+        self.inotify = watch_directory(os.path.dirname(os.path.abspath(path)))
 
-                        print(f"{tracker} - {latest_date + average}")
+    def open(self, from_start):
+        self.file = open(self.path, "rb")
+        self.inode = os.fstat(self.file.fileno()).st_ino
 
-                    else:
-                        # not enough intervals for an ETA
-                        print(f"{tracker} - 0")
+        if not from_start:
+            self.file.seek(0, os.SEEK_END)
 
-                else:
-                    print(f"{tracker} - {tracker_lines[1].strip()}")
-        sys.exit(0)
+    # Returns the data that was written since the last read, b"" if nothing was
+    # written within timeout seconds (None waits as long as it takes), or None
+    # once a pipe is closed
+    def read(self, timeout):
+        if self.path == "-":
+            if not self.select([self.descriptor], [], [], timeout)[0]:
+                return b""
 
-# You ran "avg create ..."
-if sys.argv[1] == "create":
-    # If user runs "avg create"
-    if len(sys.argv) == 2:
+            return os.read(self.descriptor, 1 << 20) or None
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            data = self.file.read()
+            if data:
+                return data
+
+            try:
+                status = os.stat(self.path)
+
+            # Between moving a log away and creating the new one
+            except FileNotFoundError:
+                status = None
+
+            # The old file is finished, so continue with the new one
+            if status is not None and status.st_ino != self.inode:
+                self.file.close()
+                self.open(True)
+                continue
+
+            # The file was truncated
+            if status is not None and status.st_size < self.file.tell():
+                self.file.seek(0)
+                continue
+
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return b""
+
+            self.wait(remaining)
+
+    def wait(self, timeout):
+        if self.inotify is None:
+            time.sleep(POLL_INTERVAL if timeout is None else min(timeout, POLL_INTERVAL))
+            return
+
+        if self.select([self.inotify], [], [], timeout)[0]:
+            # Only waking up matters, not which event it was
+            try:
+                while os.read(self.inotify, 65536):
+                    pass
+            except BlockingIOError:
+                pass
+
+# Pushes values for "avg ingest", through the daemon if it's running
+# Invalid values are reported and skipped, instead of losing the whole batch.
+def ingest_batch(tracker, tracker_type, values, unique):
+    if not values:
+        return
+
+    warn_dropped_fractions(tracker.name, values)
+
+    try:
+        response = forward_to_daemon(["avg", "push", tracker.name] + (["--unique"] if unique else []) + ["-"], "\n".join(values))
+
+        if response is None:
+            tracker.push(values, unique)
+            return
+
+        if response["status"] == 0:
+            return
+
+        error = AvgError(response["output"].rstrip("\n"))
+
+    except AvgError as push_error:
+        error = push_error
+
+    # The push parses every value anyway, so they are only checked one at a
+    #   time once it failed, to push the valid ones and report the others
+    valid_values = []
+    unit = tracker.store.read_unit(tracker.name) if tracker_type == "date" else 1
+
+    for value in values:
+        try:
+            check_values(tracker_type, [value], unit)
+            valid_values.append(value)
+
+        except AvgError as value_error:
+            print(value_error)
+
+    # Nothing was invalid, so the push failed for another reason
+    if len(valid_values) == len(values):
+        raise error
+
+    ingest_batch(tracker, tracker_type, valid_values, unique)
+
+# You ran "avg ingest ..."
+# Follows a file or pipe and pushes every value written to it, separated by
+# whitespace, in batches of up to --batch values (10000 by default)
+# A batch is also pushed --flush-interval seconds (1 by default) after its
+#   first value arrived, so values are never held back for longer than that.
+def command_ingest(argv):
+    import signal
+
+    options = {"--follow": None, "--batch": "10000", "--flush-interval": "1"}
+
+    from_start = "--from-start" in argv
+    if from_start:
+        argv.remove("--from-start")
+
+    unique = "--unique" in argv
+    if unique:
+        argv.remove("--unique")
+
+    for option in options:
+        if option in argv:
+            index = argv.index(option)
+
+            if index + 1 == len(argv):
+                print(f"{option} needs a value.")
+                sys.exit(1)
+
+            options[option] = argv[index + 1]
+            argv = argv[:index] + argv[index + 2:]
+
+    # If user runs "avg ingest"
+    if len(argv) == 2:
         print("You need a <name> argument.")
         sys.exit(1)
 
     # Check if config/avg/trackers contains a tracker called <name>
-    if sys.argv[2] in os.listdir(f"{config_directory}/avg/trackers"):
-        print(f"Tracker with name '{sys.argv[2]}' already exists.")
+    tracker = store.tracker(argv[2])
+    tracker_type = store.read_tracker_type(argv[2])
+
+    if options["--follow"] is None:
+        print("You need a '--follow <file>' or '--follow -' argument.")
         sys.exit(1)
 
-    # Create a file with name <name> in config/avg/trackers
-    with open(f"{config_directory}/avg/trackers/{sys.argv[2]}", "w") as tracker_file:
+    try:
+        batch_size = int(options["--batch"])
+        flush_interval = float(options["--flush-interval"])
+
+        if batch_size < 1 or flush_interval < 0:
+            raise ValueError
 
-        # Saves the description if the user provided one
+    except ValueError:
+        print("--batch needs a positive number, and --flush-interval a number of seconds.")
+        sys.exit(1)
 
-        # the description is the fourth argument, so the length has to be > 3 (>=4)
-        # and sys.argv[3] will get the fourth argument (3rd when not including "avg")
+    try:
+        follower = Follower(options["--follow"], from_start)
 
-        if len(sys.argv) > 3 and sys.argv[3] != "date":
-            description = sys.argv[3]
+    except OSError as error:
+        print(f"Can't follow '{options['--follow']}': {error.strerror}.")
+        sys.exit(1)
 
-        # Date tracker with description
+    # Push what was already read on "kill" as well as Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
 
-        elif len(sys.argv) > 4:
-            description = sys.argv[4]
+    values = []
+    # Part of a value that isn't followed by a newline yet
+    partial = b""
+    deadline = None
 
-        # No description
+    try:
+        while True:
+            timeout = None if deadline is None else max(deadline - time.monotonic(), 0)
+            data = follower.read(timeout)
+            end_phase("ingest: read")
 
-        else:
-            description = "This tracker does not have a description."
+            # The pipe was closed
+            if data is None:
+                break
 
-        # avg create ... date
+            if data:
+                data = partial + data
+                end = data.rfind(b"\n") + 1
+                partial = data[end:]
 
-        if len(sys.argv) > 3 and sys.argv[3] == "date":
-            tracker_file.write(f"{description}\n0\n{sys.argv[3]}\n")
+                if end > 0 and not values:
+                    deadline = time.monotonic() + flush_interval
 
-        else:
-            tracker_file.write(f"{description}\n0\n")
+                values.extend(data[:end].decode().split())
+
+            while len(values) >= batch_size:
+                ingest_batch(tracker, tracker_type, values[:batch_size], unique)
+                del values[:batch_size]
+
+            if not values:
+                deadline = None
+
+            elif time.monotonic() >= deadline:
+                ingest_batch(tracker, tracker_type, values, unique)
+                values = []
+                deadline = None
+
+    except KeyboardInterrupt:
+        pass
+
+    ingest_batch(tracker, tracker_type, values + partial.decode().split(), unique)
 
     sys.exit(0)
 
-# You ran "avg delete ..."
-if sys.argv[1] == "delete":
-    # If user runs "avg delete"
-    if len(sys.argv) == 2:
+# You ran "avg compact ..."
+# "--older-than T" compacts the entries that are more than T old, "--auto"
+# also makes push keep doing that, and "--no-auto" stops it
+def command_compact(argv):
+    older_than = None
+
+    if "--older-than" in argv:
+        index = argv.index("--older-than")
+
+        try:
+            older_than = parse_duration(argv[index + 1])
+            if older_than < 0:
+                raise ValueError
+
+        except (IndexError, ValueError):
+            print("--older-than needs a duration, like '30d'.")
+            sys.exit(1)
+
+        argv = argv[:index] + argv[index + 2:]
+
+    auto = None
+
+    for option, value in [("--auto", True), ("--no-auto", False)]:
+        if option in argv:
+            argv.remove(option)
+            auto = value
+
+    # If user runs "avg compact"
+    if len(argv) == 2:
         print("You need a <name> argument.")
         sys.exit(1)
 
-    # Removes the tracker file
-    try:
-        os.remove(f"{config_directory}/avg/trackers/{sys.argv[2]}")
+    # Check if config/avg/trackers contains a tracker called <name>
+    tracker = store.tracker(argv[2])
 
-    # Tracker does not exist
-    except FileNotFoundError:
-        print(f"There is no such tracker '{sys.argv[2]}'.")
+    if auto is False:
+        tracker.set_compaction(None)
+        sys.exit(0)
+
+    if older_than is None:
+        print("You need an '--older-than <duration>' argument.")
         sys.exit(1)
 
+    if auto:
+        number = tracker.set_compaction(older_than)
+    else:
+        number = tracker.compact(older_than)
+
+    print(f"Compacted {number} entries.")
+
     sys.exit(0)
 
-# You ran "avg push ..."
-if sys.argv[1] == "push":
-    # If user runs "avg push"
-    if len(sys.argv) == 2:
-        print("You need a <name> and a <one or more values> argument.")
+# You ran "avg migrate ..."
+# Moves every tracker into config/avg/avg.db ("--to sqlite", the default), or
+# back into tracker files ("--to files")
+def command_migrate(argv):
+    global store
+
+    if argv[2:] not in [[], ["--to", "sqlite"], ["--to", "files"]]:
+        print("You need a '--to sqlite' or '--to files' argument.")
         sys.exit(1)
 
-    # Check if config/avg/trackers contains a tracker called <name>
-    if sys.argv[2] not in os.listdir(f"{config_directory}/avg/trackers"):
-        print(f"Tracker with name '{sys.argv[2]}' does not exist.")
+    # The daemon would keep using the old trackers
+    if store.tracker_cache is not None:
+        print("Stop 'avg serve' before running 'avg migrate'.")
         sys.exit(1)
 
-    # If user runs "avg push <name>"
-    if len(sys.argv) == 3:
-        print("You need a <one or more values> argument.")
+    store.close()
+
+    if argv[2:] == ["--to", "files"]:
+        store = migrate_to_files(store.directory)
+    else:
+        store = migrate_to_sqlite(store.directory)
+
+    sys.exit(0)
+
+# You ran "avg export ..."
+# Saves every tracker, or the ones given by name or glob (and/or "--tag T"),
+# into an archive file, or writes the archive to stdout with "-"
+def command_export(argv):
+    argv, tags = read_tag_options(argv)
+
+    # If user runs "avg export"
+    if len(argv) == 2:
+        print("You need a <file> argument.")
         sys.exit(1)
 
-    # Check type of tracker
-    with open(f"{config_directory}/avg/trackers/{sys.argv[2]}", "r") as tracker_file:
-        tracker_lines = tracker_file.readlines()
+    if len(tags) > 1:
+        print("Only one --tag can be given.")
+        sys.exit(1)
 
-        if len(tracker_lines) > 2 and tracker_lines[2].strip() == "date":
-            tracker_type = "date"
-        else:
-            tracker_type = "normal"
+    tag = tags[0] if tags else None
+    patterns = argv[3:]
 
-    # Makes sure all values are numbers if it's a normal tracker
-    if tracker_type == "normal":
-        for index, argument in enumerate(sys.argv):
-            if index > 2:
-                try:
-                    float_argument = float(argument)
-                except ValueError:
-                    print(f"Value '{argument}' is not a number.")
-                    sys.exit(1)
+    if not patterns and tag is None:
+        names = None
 
-    # Makes sure all values are dates (or "now") if it's a date tracker
+    # Every tracker once, in the order they were asked for
     else:
-        for index, argument in enumerate(sys.argv):
-            if index > 2:
-                # Skip it if they type "now"
-                if argument == "now":
-                    continue
+        names = []
+
+        for pattern in patterns or ["*"]:
+            if tag is None and store.exists(pattern):
+                group = [pattern]
+            else:
+                group = store.group(pattern, tag)
 
-                # Make sure the date is the right length
-                if len(argument) != 16:
-                    print(f"Value '{argument}' is invalid.")
-                    sys.exit(1)
+            names += group
 
-                # Test if they put slashes in the right places
-                for slash in [4, 7, 10, 13]:
-                    if argument[slash] != "/":
-                        print(f"Value '{argument}' is invalid.")
-                        sys.exit(1)
+        names = list(dict.fromkeys(names))
 
-                date = []
+    if argv[2] == "-":
+        export_trackers(store, sys.stdout.buffer, names)
+        sys.exit(0)
 
-                date.append(argument[0:4])
-                date.append(argument[5:7])
-                date.append(argument[8:10])
-                date.append(argument[11:13])
-                date.append(argument[14:16])
+    # The archive only appears once it's complete
+    temporary_path = f"{argv[2]}.partial"
 
-                # Make sure they put integers as the date values (month, day, etc.)
-                for date_index, value in enumerate(date):
-                    try:
-                        date[date_index] = int(value)
+    try:
+        with open(temporary_path, "wb") as archive_file:
+            trackers, entries = export_trackers(store, archive_file, names)
 
-                    except ValueError:
-                        print(f"Value '{value}' is not a number.")
-                        sys.exit(1)
+        os.replace(temporary_path, argv[2])
 
-                # Test if user's date is a real date
-                try:
-                    final_date = datetime.datetime(date[0], date[1], date[2], date[3], date[4])
-
-                except ValueError:
-                    print(f"Value '{argument}' is invalid.")
-                    sys.exit(1)
-
-    # Appends values to tracker file
-    # A separate loop is used to avoid appending a few of the arguments before
-    #   finding out one of them is invalid
-    for index, argument in enumerate(sys.argv):
-        if index > 2:
-            with open(f"{config_directory}/avg/trackers/{sys.argv[2]}", "a") as tracker_file:
-                if argument == "now":
-                    # cdate -- current date
-                    cdate = datetime.datetime.now()
-                    # zfill puts in zeros accordingly - '14'.zfill(3) = '014'
-                    passed_argument = f"{cdate.year}/{str(cdate.month).zfill(2)}/{str(cdate.day).zfill(2)}/{str(cdate.hour).zfill(2)}/{str(cdate.minute).zfill(2)}"
+    except OSError as error:
+        print(f"Can't write '{argv[2]}': {error.strerror}.")
+        sys.exit(1)
 
-                else:
-                    passed_argument = argument
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
 
-                tracker_file.write(f"{passed_argument}\n")
+    print(f"Exported {trackers} trackers ({entries} entries).")
 
-    # Update average
+    sys.exit(0)
 
-    # Calculate the correct average
-    with open(f"{config_directory}/avg/trackers/{sys.argv[2]}", "r") as tracker_file:
+# You ran "avg import ..."
+# Loads every tracker of an archive made by "avg export", or the ones given by
+# name or glob, from a file or from stdin with "-"
+# "--replace" replaces trackers that already exist
+def command_import(argv):
+    import io
 
-        new_tracker_file_lines = tracker_file.readlines()
+    replace = "--replace" in argv
+    if replace:
+        argv.remove("--replace")
 
-        # Get the number of lines
-        tracker_file_num_of_lines = len(new_tracker_file_lines)
+    # If user runs "avg import"
+    if len(argv) == 2:
+        print("You need a <file> argument.")
+        sys.exit(1)
 
-        # Normal tracker
-        if tracker_type == "normal":
-            # Add the values
-            value_sum = 0
-
-            for index, value in enumerate(new_tracker_file_lines):
-                if index > 1:
-                    value_sum += float(value)
-
-            # Actual computation
-            average = value_sum * 100 / (tracker_file_num_of_lines - 2)
-            average = round(average)
-            average = average / 100
-            # it needs to be tracker_file_num_of_lines - 2 because the
-            #   description (first line) and average (second line) aren't entries
-
-            new_tracker_file_lines[1] = f"{average}\n"
-
-        # Date tracker that has at least two entries
-        # You can't calculate an average interval with only one entry, because intervals = entries - 1
-        # Date trackers have a description (first line), an average (second line), and a date identifier (third line)
-        # That's three lines
-        # Finally, the entries are listed. With one entry, you have 3 + 1 = 4 lines
-        # So, to have at least two entries, you need to have more than one entry, or more than 4 lines:
-        elif tracker_file_num_of_lines > 4:
-            # Add the intervals between dates
-            # stored as seconds
-            intervals = []
-
-            for index, value in enumerate(new_tracker_file_lines):
-                # Entries start on the fourth line, so index has to be at least 3
-                # lines - 1 is used to avoid later_date being out of range
-                if index > 2 and index < (tracker_file_num_of_lines - 1):
-                    # print(f"find the distance between {value} and {new_tracker_file_lines[index + 1]}")
-
-                    # Get the earlier date in the right format (index)
-
-                    argument = value
-
-                    date = []
-                    date.append(argument[0:4])
-                    date.append(argument[5:7])
-                    date.append(argument[8:10])
-                    date.append(argument[11:13])
-                    date.append(argument[14:16])
-
-                    # Make sure everything is an integer
-                    int_date = []
-                    for part in date:
-                        int_date.append(int(part))
-                    date = []
-                    for part in int_date:
-                        date.append(part)
-
-                    earlier_date = datetime.datetime(date[0], date[1], date[2], date[3], date[4])
-
-                    # Get the later date in the right format (index + 1)
-
-                    argument = new_tracker_file_lines[index + 1]
-
-                    date = []
-                    date.append(argument[0:4])
-                    date.append(argument[5:7])
-                    date.append(argument[8:10])
-                    date.append(argument[11:13])
-                    date.append(argument[14:16])
-
-                    # Make sure everything is an integer
-                    int_date = []
-                    for part in date:
-                        int_date.append(int(part))
-                    date = []
-                    for part in int_date:
-                        date.append(part)
-
-                    later_date = datetime.datetime(date[0], date[1], date[2], date[3], date[4])
-
-                    # Add the interval to the intervals list
-                    intervals.append((later_date - earlier_date).total_seconds())
-
-            # calculate the average of the second intervals
-            interval_sum = 0
-
-            for interval in intervals:
-                interval_sum += interval
-
-            average = interval_sum / (len(intervals))
-            average = round(average)
-
-            # write to tracker file
-            new_tracker_file_lines[1] = f"{average}\n"
-
-    # Update the average in the file
-    with open(f"{config_directory}/avg/trackers/{sys.argv[2]}", "w") as tracker_file:
-        tracker_file.writelines(new_tracker_file_lines)
+    # The daemon would keep the old trackers in memory
+    if forward_to_daemon([argv[0], "list"]) is not None:
+        print("Stop 'avg serve' before running 'avg import'.")
+        sys.exit(1)
+
+    try:
+        if argv[2] == "-":
+            archive_file = io.BytesIO(sys.stdin.buffer.read())
+        else:
+            archive_file = open(argv[2], "rb")
+
+    except OSError as error:
+        print(f"Can't read '{argv[2]}': {error.strerror}.")
+        sys.exit(1)
+
+    with archive_file:
+        trackers, entries = import_trackers(store, archive_file, argv[3:] or None, replace)
+
+    print(f"Imported {trackers} trackers ({entries} entries).")
 
     sys.exit(0)
 
 # You ran "avg get ..."
-if sys.argv[1] == "get":
+def command_get(argv):
+    argv, jobs = read_jobs_option(argv)
+    argv, since, until = read_range_options(argv)
+    argv, output_format = read_format_option(argv)
+    argv, tags = read_tag_options(argv)
+
     # If user runs "avg get"
-    if len(sys.argv) == 2:
+    if len(argv) == 2:
         print("You need an <attribute> argument and a <name> argument.")
         sys.exit(1)
 
     # Check if user gave a valid attribute
-    if sys.argv[2] not in ["description", "average", "type", "ETA"]:
-        print(f"No such attribute, '{sys.argv[2]}'.")
+    if argv[2] not in ATTRIBUTES:
+        print(f"No such attribute, '{argv[2]}'.")
         sys.exit(1)
 
-    # If user runs "avg get <attribute>"
-    if len(sys.argv) == 3:
-        print("You need a <name> argument.")
+    if len(tags) > 1:
+        print("Only one --tag can be given.")
         sys.exit(1)
 
-    # Checks if user gave a valid tracker name
-    if sys.argv[3] not in os.listdir(f"{config_directory}/avg/trackers"):
-        print(f"Tracker with name '{sys.argv[3]}' does not exist.")
-        sys.exit(1)
+    tag = tags[0] if tags else None
+    names = argv[3:]
 
-    # Use has a valid tracker name
-    with open(f"{config_directory}/avg/trackers/{sys.argv[3]}", "r") as tracker_file:
-        tracker_lines = tracker_file.readlines()
+    # If user runs "avg get <attribute>"
+    if not names and tag is None:
+        print("You need a <name> argument.")
+        sys.exit(1)
 
-        # User ran "avg get description <name>"
-        if sys.argv[2] == "description":
-            print(tracker_lines[0].strip())
+    # "avg get <attribute> <name1> <name2> ..." prints one line per tracker,
+    #   in the same order as the names
+    if tag is None and not any(is_glob(name) and not store.exists(name) for name in names):
+        values = store.get(argv[2], names, jobs, since, until)
 
-        # User ran "avg get average <name>"
-        if sys.argv[2] == "average":
-            print(tracker_lines[1].strip())
+    # Globs and --tag combine a group of trackers into one line each (see
+    #   "Groups"); --tag alone is every tracker with the tag
+    else:
+        names = names or ["*"]
+        values = []
 
-        # User ran "avg get type <name>"
-        if sys.argv[2] == "type":
-            if len(tracker_lines) > 2 and tracker_lines[2].strip() == "date":
-                print("date")
+        for name in names:
+            if tag is not None or (is_glob(name) and not store.exists(name)):
+                values.append(store.get_group(argv[2], name, tag, jobs, since, until))
             else:
-                print("normal")
-
-        if sys.argv[2] == "ETA":
-            if len(tracker_lines) > 4:
-                argument = tracker_lines[len(tracker_lines) - 1].strip()
-
-                date = []
-                date.append(argument[0:4])
-                date.append(argument[5:7])
-                date.append(argument[8:10])
-                date.append(argument[11:13])
-                date.append(argument[14:16])
-
-                # Make sure everything is an integer
-                int_date = []
-                for part in date:
-                    int_date.append(int(part))
-                date = []
-                for part in int_date:
-                    date.append(part)
-
-                latest_date = datetime.datetime(date[0], date[1], date[2], date[3], date[4])
-                average = tracker_lines[1].strip()
-                average = int(average)
-                average = datetime.timedelta(seconds=average)
-
-                print(latest_date + average)
+                values += store.get(argv[2], [name], jobs, since, until)
 
-            else:
-                # No intervals
-                print("0")
+    if output_format is not None:
+        rows = [{"name": name, argv[2]: value} for name, value in zip(names, values)]
+        print_rows(rows, ["name", argv[2]], output_format)
+        sys.exit(0)
+
+    for value in values:
+        print(value)
 
     sys.exit(0)
 
 # You ran "avg info ..."
-if sys.argv[1] == "info":
+def command_info(argv):
+    argv, output_format = read_format_option(argv)
+
     # If user runs "avg info"
-    if len(sys.argv) == 2:
+    if len(argv) == 2:
         print("You need a <name> argument.")
         sys.exit(1)
 
-    # Checks if user gave a valid tracker name
-    if sys.argv[2] not in os.listdir(f"{config_directory}/avg/trackers"):
-        print(f"Tracker with name '{sys.argv[2]}' does not exist.")
+    # Lists attributes
+    info = store.tracker(argv[2]).info()
+
+    if output_format is not None:
+        info["average"] = average_number(info)
+        info["mode"] = None if info["mode"] is None else describe_mode(info["mode"], info["type"])
+        info["tags"] = ",".join(info["tags"])
+
+        print_rows([info], ["name", "description", "type", "average", "count", "last", "ETA", "mode", "compacted", "older_than", "tags"], output_format)
+        sys.exit(0)
+
+    print(f"Name: {argv[2]}")
+    print(f"Description: {info['description']}")
+
+    if info["type"] == "date":
+        if info["count"] > 1:
+            # average, converted to human-readable
+            print(f"Average: {humanize_duration(average_number(info))}")
+
+            # ETA
+            print(f"ETA: {info['ETA']}")
+
+        else:
+            # No intervals
+            print("Average: 0")
+            print("ETA: 0")
+
+        # type
+        print("This tracker is a date tracker.")
+
+        if info["unit"] != 1:
+            print("Its dates are kept to the millisecond.")
+    else:
+        print(f"Average: {info['average']}")
+        print("This is a normal tracker.")
+
+    if info["mode"] is not None:
+        print(f"The average is the {describe_mode(info['mode'], info['type'])}.")
+
+    if info["compacted"] > 0:
+        print(f"{info['compacted']} of its entries are compacted.")
+
+    if info["older_than"] is not None:
+        print(f"Entries are compacted once they're {info['older_than']} seconds old.")
+
+    if info["tags"]:
+        print(f"Tags: {', '.join(info['tags'])}")
+
+    sys.exit(0)
+
+commands = {
+    "list": command_list,
+    "create": command_create,
+    "delete": command_delete,
+    "push": command_push,
+    "rebuild": command_rebuild,
+    "convert": command_convert,
+    "intervals": command_intervals,
+    "series": command_series,
+    "ingest": command_ingest,
+    "compact": command_compact,
+    "export": command_export,
+    "import": command_import,
+    "get": command_get,
+    "info": command_info,
+    "migrate": command_migrate
+}
+
+# Runs a command, given the arguments in the same form as sys.argv
+# Like the commands themselves, this always ends with sys.exit
+def run_command(argv):
+    if len(argv) == 1:
+        argv = argv + ["list"]
+
+    if argv[1] not in commands:
+        # Invalid command
+        print(f"'{argv[1]}' is not a kvrg-avg command. See the README for a list of valid commands.")
+        sys.exit(1)
+
+    try:
+        commands[argv[1]](argv)
+
+    # The store found something wrong with the arguments
+    except AvgError as error:
+        print(error)
         sys.exit(1)
 
-    # Lists attributes
-    with open(f"{config_directory}/avg/trackers/{sys.argv[2]}", "r") as tracker_file:
-        tracker_lines = tracker_file.readlines()
+# Daemon
+# "avg serve" listens on a Unix domain socket in config/avg. While it's
+# running, every other avg command sends its arguments to it and prints the
+# response, instead of reading the tracker files itself. The daemon still
+# writes every change to disk, so stopping it loses nothing.
+
+# config/avg/socket, set by main
+socket_path = None
 
-        print(f"Name: {sys.argv[2]}")
-        print(f"Description: {tracker_lines[0].strip()}")
+# Reads from a socket until the other side stops writing
+def receive_all(connection):
+    chunks = []
 
-        if len(tracker_lines) > 2 and tracker_lines[2].strip() == "date":
-            if len(tracker_lines) > 4:
-                # average
+    while True:
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
 
-                # convert to human-readable
-                print_average = True
+    return b"".join(chunks)
 
-                seconds = int(tracker_lines[1].strip())
+# Sends a command to the daemon and returns its response, a dictionary with
+# the "output" and the exit "status" of the command
+# stdin is what "avg push <name> -" reads, which is our own stdin by default
+# Returns None if no daemon is running
+def forward_to_daemon(argv, stdin=None):
+    if not os.path.exists(socket_path):
+        return None
 
-                if seconds == 0 and print_average:
-                    output = seconds
-                    print(f"Average: {output}")
-                    print_average = False
+    # "avg ingest" runs in its own process, and sends every batch to the daemon
+    #   as a push instead (see ingest_batch). "avg export" and "avg import"
+    #   read and write files (or stdin and stdout) of their own.
+    if argv[1:2] in [["ingest"], ["export"], ["import"]]:
+        return None
 
-                minutes = math.floor(seconds / 60)
+    import json
+    import socket
 
-                if minutes == 0 and print_average:
-                    output = seconds
-                    print(f"Average: {output}")
-                    print_average = False
+    # "avg push [--unique] <name> -" reads its values from our stdin, not the daemon's
+    # All of it is read before connecting: the daemon handles one request at a
+    #   time, so a slow producer would hold up every other command.
+    read_stdin = stdin is None and len(argv) > 3 and argv[1] == "push" and [argument for argument in argv if argument != "--unique"][3:] == ["-"]
 
-                hours = math.floor(minutes / 60)
+    if read_stdin:
+        stdin = sys.stdin.read()
 
-                if hours == 0 and print_average:
-                    output = f"{minutes} minutes and {seconds - minutes * 60} seconds"
-                    print(f"Average: {output}")
-                    print_average = False
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
 
-                days = math.floor(hours / 24)
+    try:
+        client.connect(socket_path)
 
-                if days == 0 and print_average:
-                    output = f"{hours} hours and {minutes - hours * 60} minutes"
-                    print(f"Average: {output}")
-                    print_average = False
+    # The socket file was left behind by a daemon that isn't running anymore
+    except OSError:
+        client.close()
 
-                months = math.floor(days / 30)
+        # The command runs without the daemon, and reads the same values
+        if read_stdin:
+            import io
+            sys.stdin = io.StringIO(stdin)
 
-                if months == 0 and print_average:
-                    output = f"{days} days and {hours - days * 24} hours"
-                    print(f"Average: {output}")
-                    print_average = False
+        return None
 
-                years = math.floor(months / 12)
+    with client:
+        client.sendall(json.dumps({"argv": argv, "stdin": stdin}).encode())
+        client.shutdown(socket.SHUT_WR)
 
-                if years == 0 and print_average:
-                    output = f"{months} months and {days - months * 30} days"
-                    print(f"Average: {output}")
-                    print_average = False
+        return json.loads(receive_all(client))
 
-                output = f"{years} years and {months - years * 12} months"
-                if print_average:
-                    print(f"Average: {output}")
+# How long the daemon waits for a client to send its request (or to read the
+# response), in seconds, before giving up on it
+# Clients send everything at once (see forward_to_daemon), so this only stops
+#   a client that's stuck from holding up every other command.
+REQUEST_TIMEOUT = 5
 
-                # ETA
-                argument = tracker_lines[len(tracker_lines) - 1].strip()
+# How often the daemon checks whether it was asked to stop while it waits for
+# a request, in seconds (see command_serve)
+STOP_INTERVAL = 0.5
 
-                date = []
-                date.append(argument[0:4])
-                date.append(argument[5:7])
-                date.append(argument[8:10])
-                date.append(argument[11:13])
-                date.append(argument[14:16])
+# Runs one request inside the daemon, capturing what the command prints
+def handle_request(connection):
+    import io
+    import json
+    import contextlib
+    import traceback
 
-                # Make sure everything is an integer
-                int_date = []
-                for part in date:
-                    int_date.append(int(part))
-                date = []
-                for part in int_date:
-                    date.append(part)
+    request = json.loads(receive_all(connection))
 
-                latest_date = datetime.datetime(date[0], date[1], date[2], date[3], date[4])
-                average = tracker_lines[1].strip()
-                average = int(average)
-                average = datetime.timedelta(seconds=average)
+    output = io.StringIO()
+    status = 0
 
-                print(f"ETA: {latest_date + average}")
+    real_stdin = sys.stdin
+    sys.stdin = io.StringIO(request["stdin"] or "")
 
-            else:
-                # No intervals
-                print("Average: 0")
-                print("ETA: 0")
+    try:
+        with contextlib.redirect_stdout(output):
+            run_command(request["argv"])
 
-            # type
-            print("This tracker is a date tracker.")
-        else:
-            print(f"Average: {tracker_lines[1].strip()}")
-            print("This is a normal tracker.")
+    except SystemExit as error:
+        status = error.code or 0
+
+    # Keep serving if a command crashes, but tell the client about it
+    except Exception:
+        traceback.print_exc()
+        output.write("The avg daemon failed to run this command.\n")
+        status = 1
+
+    finally:
+        sys.stdin = real_stdin
+
+    connection.sendall(json.dumps({"output": output.getvalue(), "status": status}).encode())
+
+
+def command_serve(argv):
+    global store
+
+    import signal
+    import socket
+
+    # Only one daemon can run at a time
+    if forward_to_daemon([argv[0], "list"]) is not None:
+        print("The avg daemon is already running.")
+        sys.exit(1)
+
+    # Remove a socket file left behind by a daemon that was killed
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+
+    # Load every tracker into memory
+    store = open_store(store.directory, cache=True)
+
+    for name in store.names():
+        store.read_tracker(name)
+        store.read_state(name)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen()
+
+    # Stop cleanly (and remove the socket) on "kill" as well as Ctrl-C
+    # "kill" only sets a flag, which is checked between requests: exiting from
+    #   the signal handler would stop a request halfway, and handle_request
+    #   would send that exit to its client as the status of the command.
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    server.settimeout(STOP_INTERVAL)
+
+    try:
+        while not stopping:
+            try:
+                connection, address = server.accept()
+
+            except socket.timeout:
+                continue
+
+            end_phase("serve: wait")
+
+            connection.settimeout(REQUEST_TIMEOUT)
+
+            with connection:
+                try:
+                    handle_request(connection)
+
+                # The client stopped sending or reading, or went away
+                except (OSError, ValueError):
+                    pass
+
+            end_phase("serve: request")
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.close()
+        os.remove(socket_path)
 
     sys.exit(0)
 
-# Invalid command
-print(f"'{sys.argv[1]}' is not a kvrg-avg command. See the README for a list of valid commands.")
-sys.exit(1)
+# "avg --timing <command>" prints how long each phase of running the command
+# took to stderr, in milliseconds, after running it (see "Profiling"):
+# - imports: loading this script and the modules it imports up front
+# - config: finding the config directory and creating config/avg
+# - daemon: checking for "avg serve" (and the whole command, if it's running)
+# - the phases of the command itself, if it has any
+# - command: the rest of the command, including the modules it imports
+# The time Python itself takes to start isn't included.
+#
+# "avg --profile <command>", or any command run with AVG_PROFILE=1, prints the
+# same phases and then these counters:
+# - lines_parsed, dates_parsed, dates_checked, entries_read, states_read and
+#   states_written, counted by the Store
+# - files_opened (including Python modules), directories_listed, files_replaced
+#   and files_removed, counted with an audit hook (see sys.addaudithook)
+# - bytes_read, bytes_written, read_syscalls and write_syscalls, from
+#   /proc/self/io (Linux only)
+# With AVG_PROFILE set to a file name instead of 1, they're appended to that
+# file as one line of JSON per command, which is easier to collect from
+# scripts. With AVG_PROFILE_DUMP set to a file name, the command also runs
+# under cProfile, and its statistics are saved to that file (see pstats).
+
+# The fields of /proc/self/io and the counters they're reported as
+PROC_IO_COUNTERS = {"rchar": "bytes_read", "wchar": "bytes_written", "syscr": "read_syscalls", "syscw": "write_syscalls"}
+
+# Audit events and the counters they add to
+AUDIT_COUNTERS = {
+    "open": "files_opened",
+    "os.listdir": "directories_listed",
+    "os.scandir": "directories_listed",
+    "os.rename": "files_replaced",
+    "os.remove": "files_removed"
+}
+
+# Returns the counters of /proc/self/io, or {} if it isn't there
+def read_proc_io():
+    try:
+        with open("/proc/self/io", "r") as io_file:
+            fields = dict(line.split(": ") for line in io_file.read().splitlines())
+
+    except OSError:
+        return {}
+
+    return {PROC_IO_COUNTERS[field]: int(value) for field, value in fields.items() if field in PROC_IO_COUNTERS}
+
+def count_audit_event(event, arguments):
+    if event in AUDIT_COUNTERS:
+        add_count(AUDIT_COUNTERS[event])
+
+def print_timings():
+    for phase, duration in timings.items():
+        print(f"{phase}: {duration * 1000:.2f} ms", file=sys.stderr)
+
+    print(f"total: {(phase_start - start_time) * 1000:.2f} ms", file=sys.stderr)
+
+# Prints the phases and counters of "--profile", or appends them to the file
+# AVG_PROFILE names
+def report_profile(sink, argv, status, io_before):
+    for counter, value in read_proc_io().items():
+        counters[counter] = value - io_before[counter]
+
+    if sink == "1":
+        print_timings()
+
+        for counter, value in counters.items():
+            print(f"{counter}: {value}", file=sys.stderr)
+
+        return
+
+    import json
+
+    record = {
+        "time": time.time(),
+        "argv": argv[1:],
+        "status": status,
+        "phases_ms": {phase: duration * 1000 for phase, duration in timings.items()},
+        "total_ms": (phase_start - start_time) * 1000,
+        "counters": counters
+    }
+
+    with open(sink, "a") as sink_file:
+        sink_file.write(json.dumps(record) + "\n")
+
+def main():
+    global timings, counters
+
+    option = sys.argv[1:2]
+
+    sink = os.environ.get("AVG_PROFILE", "")
+    if sink == "0":
+        sink = ""
+
+    if option == ["--profile"]:
+        sink = sink or "1"
+
+    if option in [["--timing"], ["--profile"]]:
+        del sys.argv[1]
+
+    argv = list(sys.argv)
+
+    if sink or option == ["--timing"]:
+        timings = {}
+
+    end_phase("imports")
+
+    if sink:
+        counters = {}
+        io_before = read_proc_io()
+        sys.addaudithook(count_audit_event)
+
+    profiler = None
+
+    if os.environ.get("AVG_PROFILE_DUMP"):
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    status = 0
+
+    try:
+        run_main()
+
+    except SystemExit as error:
+        status = error.code or 0
+        raise
+
+    except BaseException:
+        status = 1
+        raise
+
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.environ["AVG_PROFILE_DUMP"])
+
+        if sink:
+            report_profile(sink, argv, status, io_before)
+        elif timings is not None:
+            print_timings()
+
+def run_main():
+    global store, socket_path
+
+    try:
+        # Change the next line if your config folder is not $HOME/.config
+        config_directory = f"{os.environ['HOME']}/.config"
+
+        # If $HOME isn't set, os.environ['HOME'] will cause an error
+
+    except KeyError:
+        print("The environment variable $HOME is not set.")
+        print("You need to change the config_directory variable.")
+        print("See README.md on github (https://github.com/michaelskyba/kvrg-avg) for more information.")
+
+        sys.exit(1)
+
+    # If config_directory doesn't exist, print an error an exit
+    if not os.path.isdir(config_directory):
+        print(f"The config directory that is set ({config_directory}) does not exist.")
+        print("You need to change the config_directory variable.")
+        print("See README.md on github (https://github.com/michaelskyba/kvrg-avg) for more information.")
+
+        sys.exit(1)
+
+    # Creates config/avg and its directories if they don't exist yet, unless
+    #   the trackers are in config/avg/avg.db
+    store = open_store(f"{config_directory}/avg")
+    socket_path = f"{config_directory}/avg/socket"
+
+    end_phase("config")
+
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        command_serve(sys.argv)
+
+    # Let the daemon run the command if there is one
+    response = forward_to_daemon(sys.argv)
+
+    end_phase("daemon")
+
+    if response is not None:
+        print(response["output"], end="")
+        sys.exit(response["status"])
+
+    try:
+        run_command(sys.argv)
+
+    finally:
+        end_phase("command")
 
+if __name__ == "__main__":
+    main()